@@ -0,0 +1,98 @@
+"""
+Benchmark of bytes and CPU per message for the payload codecs, using representative
+status, temperature and event payloads. "legacy" is the old send_outgoing_message path,
+which serialized every message twice with json.dumps.
+
+    python benchmarks/bench_codec.py [--iterations 2000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from octoprint_printago_connector.codec import PayloadCodec  # noqa: E402
+
+STATUS = {
+    "type": "status",
+    "timestamp": "2024-05-01T12:00:00.000000Z",
+    "printer_id": "printer-0001",
+    "client_type": "octoprint",
+    "data": {
+        "printer_state_id": "PRINTING",
+        "printer_state_string": "Printing",
+        "current_state_data": {
+            "state": {"text": "Printing", "flags": {"operational": True, "printing": True, "cancelling": False,
+                                                    "pausing": False, "resuming": False, "finishing": False,
+                                                    "closedOrError": False, "error": False, "paused": False,
+                                                    "ready": False, "sdReady": False}, "error": ""},
+            "job": {"file": {"name": "bracket_x4.gcode", "path": "Printago/bracket_x4.gcode", "display": "bracket_x4.gcode",
+                             "origin": "local", "size": 18273645, "date": 1714564800},
+                    "estimatedPrintTime": 14523.4, "averagePrintTime": None, "lastPrintTime": None,
+                    "filament": {"tool0": {"length": 15234.2, "volume": 36.6}}, "user": "_api"},
+            "progress": {"completion": 42.1734, "filepos": 7706722, "printTime": 6100, "printTimeLeft": 8402,
+                         "printTimeLeftOrigin": "estimate"},
+            "currentZ": 12.4,
+            "offsets": {},
+            "resends": {"count": 0, "transmitted": 251234, "ratio": 0},
+        },
+        "temperatures": {"tool0": {"actual": 214.8, "target": 215.0, "offset": 0},
+                         "bed": {"actual": 60.1, "target": 60.0, "offset": 0}},
+        "current_job": {"file": {"name": "bracket_x4.gcode", "path": "Printago/bracket_x4.gcode"},
+                        "estimatedPrintTime": 14523.4},
+    },
+}
+TEMPERATURE = {"actual": 214.8, "target": 215.0, "_timestamp": 1714564800}
+EVENT = {"name": "bracket_x4.gcode", "path": "Printago/bracket_x4.gcode", "origin": "local", "size": 18273645,
+         "owner": "_api", "user": "_api", "_event": "PrintStarted", "_timestamp": 1714564800}
+
+PAYLOADS = dict(status=STATUS, temperature=TEMPERATURE, event=EVENT)
+CODECS = [
+    ("json", dict(fmt="json")),
+    ("json+zlib", dict(fmt="json", compress_threshold=256)),
+    ("msgpack", dict(fmt="msgpack")),
+    ("msgpack+zlib", dict(fmt="msgpack", compress_threshold=256)),
+    ("cbor", dict(fmt="cbor")),
+    ("cbor+zlib", dict(fmt="cbor", compress_threshold=256)),
+]
+
+
+def legacy_encode(obj):
+    json.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def measure(encode, payload, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        data = encode(payload)
+    return len(data), (time.perf_counter() - start) * 1e6 / iterations
+
+
+def run(iterations=2000):
+    results = []
+    encoders = [("legacy", legacy_encode)]
+    for name, kwargs in CODECS:
+        codec = PayloadCodec(**kwargs)
+        if codec.format != kwargs["fmt"]:
+            continue  # optional package not installed
+        encoders.append((name, codec.encode))
+
+    for payload_name, payload in PAYLOADS.items():
+        for codec_name, encode in encoders:
+            size, micros = measure(encode, payload, iterations)
+            results.append(dict(payload=payload_name, codec=codec_name, bytes=size, us_per_message=round(micros, 2)))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'payload':<12} {'codec':<14} {'bytes':>7} {'us/msg':>8}")
+    for result in run(iterations=args.iterations):
+        print(f"{result['payload']:<12} {result['codec']:<14} {result['bytes']:>7} {result['us_per_message']:>8}")
@@ -0,0 +1,166 @@
+"""
+Micro-benchmark of command dispatch cost: the table-driven CommandRegistry against the
+if/elif chain it replaced. Handlers are no-ops, so only lookup and parameter validation
+are measured.
+
+    python benchmarks/bench_dispatch.py [--commands 10000] [--repeat 5]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from octoprint_printago_connector.registry import NUMBER, CommandRegistry, Param  # noqa: E402
+
+COMMAND_MIX = [
+    ("printer_control", "get_status", {}),
+    ("printer_control", "pause_print", {}),
+    ("printer_control", "resume_print", {}),
+    ("printer_control", "stop_print", {}),
+    ("printer_control", "start_print", {"file_name": "Printago/part.gcode"}),
+    ("printer_control", "download_gcode", {"url": "http://example.com/part.gcode", "sha256": "00"}),
+    ("temperature_control", "set_hotend", {"tool": 1, "temperature": 215}),
+    ("temperature_control", "set_bed", {"temperature": 60}),
+    ("movement_control", "jog", {"axes": {"x": 10}, "relative": True, "speed": 3000, "tags": []}),
+    ("movement_control", "extrude", {"amount": 5, "speed": 100}),
+    ("movement_control", "home", {"axes": "x,y,z"}),
+    ("camera_control", "get_providers", {}),
+    ("camera_control", "snapshot", {"camera_provider_id": "classicwebcam", "camera_name": "classic"}),
+]
+
+
+def noop(*args, **kwargs):
+    pass
+
+
+def legacy_dispatch(command_type, action, parameters):
+    # Shape of CommandHandler.process_command and the _handle_*_control methods before
+    # the registry: a chain of string compares per type, then per action.
+    if command_type == "printer_control":
+        if action == "download_gcode":
+            if "url" in parameters:
+                noop(parameters.get("url"), parameters.get("sha256"))
+        elif action == "pause_print":
+            noop()
+        elif action == "resume_print":
+            noop()
+        elif action == "stop_print":
+            noop()
+        elif action == "get_status":
+            noop()
+        elif action == "start_print":
+            file_name = parameters.get("file_name", None)
+            if not file_name.startswith("Printago/"):
+                file_name = "Printago/" + file_name
+            noop(file_name)
+    elif command_type == "temperature_control":
+        if action == "set_hotend":
+            target_temp = parameters.get("temperature", None)
+            tool = parameters.get("tool", 0)
+            if target_temp is not None:
+                noop("tool" + str(tool), target_temp)
+        elif action == "set_bed":
+            target_temp = parameters.get("temperature", None)
+            if target_temp is not None:
+                noop("bed", target_temp)
+    elif command_type == "movement_control":
+        if action == "jog":
+            axes_data = parameters.get("axes", None)
+            relative = parameters.get("relative", True)
+            speed = parameters.get("speed", None)
+            tags = set(parameters.get("tags", []))
+            if axes_data:
+                noop(axes_data, relative, speed, tags)
+        elif action == "extrude":
+            amount = parameters.get("amount", None)
+            speed = parameters.get("speed", None)
+            if amount is not None:
+                noop(amount, speed)
+        elif action == "home":
+            axes = parameters.get("axes", None)
+            if isinstance(axes, str):
+                axes = [axis.strip().lower() for axis in axes.split(",")]
+            if axes:
+                noop(axes)
+    elif command_type == "camera_control":
+        if action == "get_providers":
+            noop()
+        elif action == "snapshot":
+            if "camera_provider_id" in parameters and "camera_name" in parameters:
+                noop(parameters["camera_provider_id"], parameters["camera_name"])
+
+
+def build_registry():
+    # Mirrors CommandHandler._register_builtin_commands
+    registry = CommandRegistry()
+    registry.register("printer_control", "download_gcode", noop,
+                      params=(Param("url", str, required=True), Param("sha256", str), Param("job_id", str)))
+    for action in ("pause_print", "resume_print", "stop_print", "get_status"):
+        registry.register("printer_control", action, noop)
+    registry.register("printer_control", "start_print", noop, params=(Param("file_name", str, required=True),))
+    registry.register("temperature_control", "set_hotend", noop,
+                      params=(Param("temperature", NUMBER, required=True), Param("tool", int, default=0)))
+    registry.register("temperature_control", "set_bed", noop, params=(Param("temperature", NUMBER, required=True),))
+    registry.register("movement_control", "jog", noop,
+                      params=(Param("axes", dict, required=True), Param("relative", bool, default=True),
+                              Param("speed", NUMBER), Param("tags", list, default=[])))
+    registry.register("movement_control", "extrude", noop,
+                      params=(Param("amount", NUMBER, required=True), Param("speed", NUMBER),
+                              Param("tags", list, default=[])))
+    registry.register("movement_control", "home", noop, params=(Param("axes", (str, list), required=True),))
+    registry.register("camera_control", "get_providers", noop)
+    registry.register("camera_control", "snapshot", noop,
+                      params=(Param("camera_provider_id", str, required=True),
+                              Param("camera_name", str, required=True)))
+    return registry
+
+
+def measure(func, commands, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for command_type, action, parameters in commands:
+            func(command_type, action, parameters)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(count=10000, repeat=5, seed=42):
+    rng = random.Random(seed)
+    commands = [rng.choice(COMMAND_MIX) for _ in range(count)]
+    registry = build_registry()
+
+    legacy = measure(legacy_dispatch, commands, repeat)
+    lookup = registry.lookup
+
+    def table_dispatch(command_type, action, parameters):
+        spec = lookup(command_type, action)
+        spec.handler(spec.validate(parameters))
+
+    def lookup_only(command_type, action, parameters):
+        lookup(command_type, action).handler(parameters)
+
+    table = measure(table_dispatch, commands, repeat)
+    table_lookup = measure(lookup_only, commands, repeat)
+
+    return dict(commands=count,
+                legacy_chain_us=round(legacy * 1e6 / count, 3),
+                registry_us=round(table * 1e6 / count, 3),
+                registry_lookup_only_us=round(table_lookup * 1e6 / count, 3))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--commands", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    result = run(count=args.commands, repeat=args.repeat)
+    print(f"{result['commands']} commands: legacy chain {result['legacy_chain_us']} us/command, "
+          f"registry {result['registry_us']} us/command "
+          f"(lookup only {result['registry_lookup_only_us']} us/command)")
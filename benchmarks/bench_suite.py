@@ -0,0 +1,281 @@
+"""
+End-to-end benchmark suite for PrintagoMqttConnector and CommandHandler, run entirely
+in-process against the fakes in ``fakes.py``: no broker, printer or network needed.
+
+Measures publish throughput (connected and spooling), temperature fan-out per sample
+for each temperature mode, command dispatch latency from receipt to reply, download
+throughput and peak Python memory, and the time to drain the spool after a reconnect.
+
+Results are written as JSON. With ``--baseline`` a previous result file is compared
+against, and the exit code is 1 if any metric regressed by more than ``--tolerance``.
+
+    python benchmarks/bench_suite.py [--quick] [--output results.json]
+                                     [--baseline previous.json] [--tolerance 0.2]
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fakes import COMMAND_TOPIC, FakePlugin, FileServer, generate_gcode  # noqa: E402
+
+STATUS = {
+    "state": {"text": "Printing", "flags": {"operational": True, "printing": True, "paused": False}},
+    "job": {"file": {"name": "bracket_x4.gcode", "path": "Printago/bracket_x4.gcode", "origin": "local"},
+            "estimatedPrintTime": 14523.4},
+    "progress": {"completion": 42.1734, "filepos": 7706722, "printTime": 6100, "printTimeLeft": 8402},
+    "temperatures": {"tool0": {"actual": 214.8, "target": 215.0}, "bed": {"actual": 60.1, "target": 60.0}},
+}
+
+TEMPERATURE_MODES = ("per_heater", "frame", "aggregate")
+
+SIZES = dict(
+    full=dict(publish=20000, temperature_samples=5000, heaters=4, commands=2000, download_bytes=32 * 1024 * 1024,
+              drain=2000, drain_paced=250),
+    quick=dict(publish=2000, temperature_samples=500, heaters=4, commands=200, download_bytes=4 * 1024 * 1024,
+               drain=200, drain_paced=50),
+)
+
+
+def metric(value, unit, better):
+    return dict(value=value, unit=unit, better=better)
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 3)
+
+    return at(0.5), at(0.95), at(0.99)
+
+
+def bench_publish(count):
+    results = dict()
+    # a spool big enough that appends never have to drop old messages
+    with FakePlugin({"printago.spool_max_bytes": 256 * 1024 * 1024}) as fake:
+        publish = fake.plugin.mqtt_publish
+        start = time.perf_counter()
+        for _ in range(count):
+            publish("octoPrint/status", STATUS)
+        elapsed = time.perf_counter() - start
+        results["publish_msgs_per_s"] = metric(round(count / elapsed), "msg/s", "higher")
+        results["publish_us_per_msg"] = metric(round(elapsed * 1e6 / count, 2), "us", "lower")
+
+        fake.disconnect()
+        start = time.perf_counter()
+        for _ in range(count):
+            publish("octoPrint/status", STATUS, allow_queueing=True)
+        elapsed = time.perf_counter() - start
+        results["spool_msgs_per_s"] = metric(round(count / elapsed), "msg/s", "higher")
+    return results
+
+
+def temperature_samples(count, heaters, seed_time=1714564800.0):
+    # heaters drift slowly around their targets, so only some samples cross the threshold
+    samples = []
+    for index in range(count):
+        sample = dict(time=seed_time + index)
+        for heater in range(heaters):
+            key = "bed" if heater == heaters - 1 else f"tool{heater}"
+            target = 60.0 if key == "bed" else 215.0
+            sample[key] = dict(actual=target + ((index * 7 + heater * 3) % 40) / 10.0 - 2.0, target=target)
+        samples.append(sample)
+    return samples
+
+
+def bench_temperature(count, heaters):
+    results = dict()
+    samples = temperature_samples(count, heaters)
+    for mode in TEMPERATURE_MODES:
+        with FakePlugin({"publish.temperatureMode": mode}) as fake:
+            fake.client.reset_counts()
+            add = fake.plugin.on_printer_add_temperature
+            start = time.perf_counter()
+            for sample in samples:
+                add(sample)
+            elapsed = time.perf_counter() - start
+            results[f"temperature_{mode}_us_per_sample"] = metric(round(elapsed * 1e6 / count, 2), "us", "lower")
+            results[f"temperature_{mode}_msgs_per_sample"] = metric(round(fake.client.published / count, 3), "msg",
+                                                                    "lower")
+            results[f"temperature_{mode}_bytes_per_sample"] = metric(
+                round(fake.client.published_bytes / count, 1), "B", "lower")
+    return results
+
+
+def bench_commands(count):
+    results = dict()
+    with FakePlugin() as fake:
+        replied = threading.Event()
+
+        def on_publish(topic, payload):
+            if topic in ("octoprint/success", "octoprint/error", "octoprint/response"):
+                replied.set()
+
+        fake.client.on_publish = on_publish
+        codec = fake.plugin._publish_plan.codec
+
+        for command_type, action, parameters in (("printer_control", "pause_print", {}),
+                                                 ("temperature_control", "set_bed", {"temperature": 60})):
+            samples = []
+            for index in range(count):
+                payload = codec.encode(dict(type=command_type, action=action, parameters=parameters,
+                                            request_id=str(index)))
+                replied.clear()
+                start = time.perf_counter()
+                fake.receive(COMMAND_TOPIC, payload)
+                if not replied.wait(5):
+                    raise RuntimeError(f"No reply to {command_type}::{action}")
+                samples.append((time.perf_counter() - start) * 1e6)
+
+            p50, p95, p99 = percentiles(samples)
+            results[f"command_{action}_p50_us"] = metric(p50, "us", "lower")
+            results[f"command_{action}_p95_us"] = metric(p95, "us", "lower")
+            results[f"command_{action}_p99_us"] = metric(p99, "us", "lower")
+            results[f"command_{action}_mean_us"] = metric(round(statistics.mean(samples), 3), "us", "lower")
+
+        # pre-print setup as one batch: a single message and a single reply
+        batch = [dict(type="temperature_control", action="set_hotend", parameters={"temperature": 215, "tool": 0}),
+                 dict(type="temperature_control", action="set_bed", parameters={"temperature": 60}),
+                 dict(type="movement_control", action="home", parameters={"axes": "x,y,z"}),
+                 dict(type="printer_control", action="pause_print", parameters={})]
+        samples = []
+        for index in range(count):
+            payload = codec.encode(dict(commands=batch, request_id=str(index)))
+            replied.clear()
+            start = time.perf_counter()
+            fake.receive(COMMAND_TOPIC, payload)
+            if not replied.wait(5):
+                raise RuntimeError("No reply to batch")
+            samples.append((time.perf_counter() - start) * 1e6)
+
+        p50, p95, _ = percentiles(samples)
+        results["command_batch4_p50_us"] = metric(p50, "us", "lower")
+        results["command_batch4_p95_us"] = metric(p95, "us", "lower")
+    return results
+
+
+def bench_download(size):
+    data = generate_gcode(size)
+    with FileServer({"part.gcode": data, "traced.gcode": data}) as server, FakePlugin() as fake:
+        handler = fake.plugin.command_handler
+
+        start = time.perf_counter()
+        handler.download_file(server.url("part.gcode"))
+        elapsed = time.perf_counter() - start
+
+        # same URL again: revalidated with the ETag, answered with 304
+        start = time.perf_counter()
+        handler.download_file(server.url("part.gcode"))
+        revalidate = time.perf_counter() - start
+
+        # tracemalloc slows allocations down a lot, so memory gets its own download
+        tracemalloc.start()
+        handler.download_file(server.url("traced.gcode"))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return dict(download_bytes=metric(len(data), "B", None),
+                download_mib_per_s=metric(round(len(data) / 1024 / 1024 / elapsed, 2), "MiB/s", "higher"),
+                download_peak_python_kib=metric(round(peak / 1024), "KiB", "lower"),
+                download_revalidate_ms=metric(round(revalidate * 1000, 2), "ms", "lower"))
+
+
+def bench_drain(count, paced_count):
+    results = dict()
+    # paced drains take count / drain_rate seconds by design, so they get a smaller backlog
+    for label, rate, backlog in (("paced", None, paced_count), ("unpaced", 0, count)):
+        settings = dict() if rate is None else {"printago.drain_rate": rate}
+        with FakePlugin(settings, connected=False) as fake:
+            for index in range(backlog):
+                fake.plugin.mqtt_publish(f"octoPrint/event/E{index}", dict(index=index), allow_queueing=True)
+
+            start = time.perf_counter()
+            fake.connect()
+            if not fake.wait_for_drain():
+                raise RuntimeError("Spool did not drain")
+            elapsed = time.perf_counter() - start
+            configured = fake.plugin._settings.get_int(["printago", "drain_rate"])
+
+        results[f"drain_{label}_s"] = metric(round(elapsed, 3), "s", "lower")
+        if label == "paced":
+            results["drain_paced_rate"] = metric(configured, "msg/s", None)
+        else:
+            results["drain_unpaced_msgs_per_s"] = metric(round(backlog / elapsed), "msg/s", "higher")
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except Exception:
+        commit = None
+    return dict(python=platform.python_version(), implementation=platform.python_implementation(),
+                machine=platform.machine(), system=platform.system(), commit=commit,
+                timestamp=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+
+
+def run(quick=False):
+    sizes = SIZES["quick" if quick else "full"]
+    results = dict()
+    results.update(bench_publish(sizes["publish"]))
+    results.update(bench_temperature(sizes["temperature_samples"], sizes["heaters"]))
+    results.update(bench_commands(sizes["commands"]))
+    results.update(bench_download(sizes["download_bytes"]))
+    results.update(bench_drain(sizes["drain"], sizes["drain_paced"]))
+    return dict(environment=environment(), sizes=sizes, results=results)
+
+
+def compare(current, baseline, tolerance):
+    """Returns the metrics in ``current`` that are worse than in ``baseline`` by more than ``tolerance``."""
+    regressions = []
+    for name, entry in current["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None or entry["better"] is None or not previous["value"]:
+            continue
+        change = (entry["value"] - previous["value"]) / previous["value"]
+        if entry["better"] == "higher":
+            change = -change
+        if change > tolerance:
+            regressions.append(dict(name=name, baseline=previous["value"], current=entry["value"],
+                                    unit=entry["unit"], worse_by=round(change, 3)))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="smaller workloads, for a smoke run")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression, default 0.2")
+    args = parser.parse_args()
+
+    report = run(quick=args.quick)
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        for name, entry in sorted(report["results"].items()):
+            print(f"{name:<42} {entry['value']:>12} {entry['unit']}")
+    else:
+        print(output)
+
+    if report.get("regressions"):
+        for regression in report["regressions"]:
+            print(f"REGRESSION {regression['name']}: {regression['baseline']} -> {regression['current']} "
+                  f"{regression['unit']}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,98 @@
+"""
+Benchmark of the per-line cost of the gcode.received firmware trigger matcher.
+
+Runs a serial log through the previous single startswith check, the default triggers
+and 50 triggers. Without ``--log`` a synthetic log is used: a mix of ok, temperature
+report, busy and position lines in the proportions of a Marlin print, with a few
+trigger lines sprinkled in.
+
+    python benchmarks/bench_triggers.py [--log serial.log] [--lines 200000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from octoprint_printago_connector.firmware_triggers import DEFAULT_FIRMWARE_TRIGGERS, FirmwareTriggerMatcher  # noqa: E402
+
+
+def synthetic_log(lines, seed=42):
+    rng = random.Random(seed)
+    result = []
+    for _ in range(lines):
+        roll = rng.random()
+        if roll < 0.80:
+            result.append("ok")
+        elif roll < 0.92:
+            result.append(f" T:{210 + rng.random():.2f} /210.00 B:{60 + rng.random():.2f} /60.00 @:64 B@:0")
+        elif roll < 0.96:
+            result.append("echo:busy: processing")
+        elif roll < 0.99:
+            result.append(f"X:{rng.random() * 200:.2f} Y:{rng.random() * 200:.2f} Z:{rng.random() * 10:.2f} E:0.00 "
+                          f"Count X:0 Y:0 Z:0")
+        elif roll < 0.9995:
+            result.append("echo:Unknown command: \"M9999\"")
+        else:
+            result.append(rng.choice(["echo:busy: paused for user", "//action:pause", "Error:Probing Failed"]))
+    return result
+
+
+def fifty_triggers():
+    triggers = list(DEFAULT_FIRMWARE_TRIGGERS)
+    prefixes = ("echo:", "Error:", "//action:", "Warning:", "FIRMWARE_", "Cap:", "fsensor ", "MMU2:")
+    index = 0
+    while len(triggers) < 50:
+        triggers.append(dict(event=f"Custom{index}", prefix=f"{prefixes[index % len(prefixes)]}custom trigger {index}"))
+        index += 1
+    return triggers
+
+
+def measure(func, lines, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            func(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e9 / len(lines)
+
+
+def run(lines, repeat=5):
+    def legacy(line):
+        return line.startswith('echo:busy: paused for user')
+
+    def empty(line):
+        return line
+
+    default_match = FirmwareTriggerMatcher(DEFAULT_FIRMWARE_TRIGGERS).match
+    fifty_match = FirmwareTriggerMatcher(fifty_triggers()).match
+
+    return dict(lines=len(lines),
+                call_overhead_ns=round(measure(empty, lines, repeat), 1),
+                legacy_startswith_ns=round(measure(legacy, lines, repeat), 1),
+                default_triggers_ns=round(measure(default_match, lines, repeat), 1),
+                fifty_triggers_ns=round(measure(fifty_match, lines, repeat), 1),
+                matched_lines=sum(1 for line in lines if fifty_match(line)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--log", help="serial.log to replay instead of the synthetic log")
+    parser.add_argument("--lines", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.log:
+        # OctoPrint's serial.log prefixes received lines with "Recv: "
+        with open(args.log, "r", errors="replace") as f:
+            lines = [line.rstrip("\r\n").partition("Recv: ")[2] for line in f if "Recv: " in line]
+    else:
+        lines = synthetic_log(args.lines)
+
+    for key, value in run(lines, repeat=args.repeat).items():
+        print(f"{key:<22} {value}")
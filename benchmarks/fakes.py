@@ -0,0 +1,392 @@
+"""
+In-process stand-ins for what PrintagoMqttConnector talks to: the paho client, OctoPrint's
+printer, file manager, plugin manager and settings, and a local HTTP server for G-code
+downloads. Nothing here touches the network beyond 127.0.0.1.
+"""
+
+import copy
+import hashlib
+import http.server
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+PLUGIN_IDENTIFIER = "printago_connector"
+COMMAND_TOPIC = "octoPrint/commands"
+
+
+class FakeMessageInfo:
+    __slots__ = ("rc", "mid")
+
+    def __init__(self, mid, rc=0):
+        self.rc = rc
+        self.mid = mid
+
+    def is_published(self):
+        return True
+
+    def wait_for_publish(self, timeout=None):
+        return True
+
+
+class FakeMqttMessage:
+    __slots__ = ("topic", "payload", "retain", "qos")
+
+    def __init__(self, topic, payload, retain=False, qos=0):
+        self.topic = topic
+        self.payload = payload
+        self.retain = retain
+        self.qos = qos
+
+
+class FakeMqttClient:
+    """
+    Accepts publishes like a connected paho client whose socket never blocks. Counts
+    messages and bytes, and calls ``on_publish(topic, payload)`` if set, which is how the
+    benchmarks notice replies.
+    """
+
+    def __init__(self):
+        self._out_packet = deque()
+        self._out_messages = {}
+        self._mid = 0
+        self._lock = threading.Lock()
+        self.published = 0
+        self.published_bytes = 0
+        self.on_publish = None
+        self.on_connect = self.on_disconnect = self.on_message = None
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        with self._lock:
+            self._mid += 1
+            self.published += 1
+            self.published_bytes += len(payload) if payload is not None else 0
+            mid = self._mid
+        if self.on_publish is not None:
+            self.on_publish(topic, payload)
+        return FakeMessageInfo(mid)
+
+    def reset_counts(self):
+        with self._lock:
+            self.published = 0
+            self.published_bytes = 0
+
+    def subscribe(self, *args, **kwargs):
+        return 0, 1
+
+    def unsubscribe(self, *args, **kwargs):
+        return 0, 1
+
+    def will_set(self, *args, **kwargs):
+        pass
+
+    def loop_start(self):
+        return 0
+
+    def loop_stop(self, *args, **kwargs):
+        return 0
+
+    def disconnect(self, *args, **kwargs):
+        return 0
+
+
+class FakePrinter:
+    """OctoPrint's printer, idle and operational. Control calls only count themselves."""
+
+    def __init__(self):
+        self.calls = dict()
+        self.printing = False
+
+    def _called(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def register_callback(self, callback):
+        pass
+
+    def is_operational(self):
+        return True
+
+    def is_printing(self):
+        return self.printing
+
+    def is_paused(self):
+        return False
+
+    def get_state_id(self):
+        return "PRINTING" if self.printing else "OPERATIONAL"
+
+    def get_state_string(self):
+        return "Printing" if self.printing else "Operational"
+
+    def get_current_job(self):
+        return dict(file=dict(name=None, path=None, origin=None, size=None, date=None),
+                    estimatedPrintTime=None, filament=None, user=None)
+
+    def get_current_data(self):
+        return dict(state=dict(text=self.get_state_string(), flags=dict(operational=True, printing=self.printing)),
+                    job=self.get_current_job(),
+                    progress=dict(completion=None, filepos=None, printTime=None, printTimeLeft=None),
+                    currentZ=None, offsets={})
+
+    def get_current_temperatures(self):
+        return dict(tool0=dict(actual=214.8, target=215.0, offset=0), bed=dict(actual=60.1, target=60.0, offset=0))
+
+    def pause_print(self, *args, **kwargs):
+        self._called("pause_print")
+
+    def resume_print(self, *args, **kwargs):
+        self._called("resume_print")
+
+    def cancel_print(self, *args, **kwargs):
+        self._called("cancel_print")
+
+    def set_temperature(self, heater, value, *args, **kwargs):
+        self._called("set_temperature")
+
+    def jog(self, *args, **kwargs):
+        self._called("jog")
+
+    def home(self, *args, **kwargs):
+        self._called("home")
+
+    def extrude(self, *args, **kwargs):
+        self._called("extrude")
+
+    def select_file(self, *args, **kwargs):
+        self._called("select_file")
+
+
+class FakeStorage:
+    def __init__(self, file_manager):
+        self._file_manager = file_manager
+
+    def get_metadata(self, path):
+        return self._file_manager.metadata.get(path)
+
+
+class FakeFileManager:
+    """The local storage of OctoPrint's file manager, backed by a temporary directory."""
+
+    def __init__(self, base_folder):
+        self.base_folder = base_folder
+        self.metadata = dict()
+        self._storage = FakeStorage(self)
+
+    def _path(self, path):
+        return os.path.join(self.base_folder, path)
+
+    def folder_exists(self, location, path):
+        return os.path.isdir(self._path(path))
+
+    def add_folder(self, location, path, *args, **kwargs):
+        os.makedirs(self._path(path), exist_ok=True)
+        return path
+
+    def file_exists(self, location, path):
+        return os.path.isfile(self._path(path))
+
+    def add_file(self, location, path, file_object, allow_overwrite=False, analysis=None, **kwargs):
+        file_object.save(self._path(path))
+        if analysis is not None:
+            self.metadata.setdefault(path, {})["analysis"] = analysis
+        return path
+
+    def set_additional_metadata(self, location, path, key, data, overwrite=False, merge=False):
+        self.metadata.setdefault(path, {})[key] = data
+
+    def remove_file(self, location, path):
+        os.remove(self._path(path))
+        self.metadata.pop(path, None)
+
+    def list_files(self, location, path=None, recursive=True, **kwargs):
+        entries = dict()
+        folder = self._path(path or "")
+        if os.path.isdir(folder):
+            for name in os.listdir(folder):
+                full = os.path.join(folder, name)
+                entry_path = f"{path}/{name}" if path else name
+                if os.path.isdir(full):
+                    entries[name] = dict(path=entry_path, type="folder")
+                else:
+                    entries[name] = dict(path=entry_path, type="machinecode", size=os.path.getsize(full),
+                                         date=int(os.path.getmtime(full)))
+        return {location: entries}
+
+
+class FakePluginManager:
+    def get_implementations(self, *args, **kwargs):
+        return []
+
+
+class FakeSettings:
+    """Nested dict settings with OctoPrint's typed getters."""
+
+    def __init__(self, defaults):
+        self._data = copy.deepcopy(defaults)
+
+    def get(self, path, asdict=False, merged=False, **kwargs):
+        node = self._data
+        for key in path:
+            if not isinstance(node, dict) or key not in node:
+                return None
+            node = node[key]
+        return node
+
+    def get_int(self, path, **kwargs):
+        value = self.get(path)
+        return None if value is None else int(value)
+
+    def get_float(self, path, **kwargs):
+        value = self.get(path)
+        return None if value is None else float(value)
+
+    def get_boolean(self, path, **kwargs):
+        return bool(self.get(path))
+
+    def set(self, path, value, **kwargs):
+        node = self._data
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = value
+
+
+def generate_gcode(size, seed=42):
+    """PrusaSlicer-style G-code of roughly ``size`` bytes."""
+    rng = random.Random(seed)
+    lines = ["; generated by PrusaSlicer 2.6.0+linux-x64", "M140 S60", "M104 S215", "M190 S60", "M109 S215",
+             "G28", "G90", "M83", "G92 E0"]
+    written = sum(len(line) + 1 for line in lines)
+    layer = 0
+    while written < size:
+        layer += 1
+        block = [";LAYER_CHANGE", f";Z:{0.2 * layer:.2f}", f"G1 Z{0.2 * layer:.3f} F720"]
+        for _ in range(500):
+            block.append(f"G1 X{50 + rng.random() * 100:.3f} Y{50 + rng.random() * 100:.3f} "
+                         f"E{0.03 + rng.random() * 0.02:.5f}")
+        lines.extend(block)
+        written += sum(len(line) + 1 for line in block)
+    lines += ["M104 S0", "M140 S0", "; filament used [mm] = 4321.12", "; filament used [g] = 12.89",
+              "; estimated printing time (normal mode) = 1h 23m 45s", "; layer_height = 0.2",
+              "; filament_diameter = 1.75", "; filament_type = PLA"]
+    return ("\n".join(lines) + "\n").encode("ascii")
+
+
+class FileServer:
+    """
+    Serves in-memory files from 127.0.0.1 on a free port, with ETag and If-None-Match
+    support. Use as a context manager; ``url(name)`` gives a file's download URL.
+    """
+
+    def __init__(self, files):
+        self.files = dict(files)
+        self.etags = dict((name, hashlib.sha256(data).hexdigest()[:16]) for name, data in self.files.items())
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                name = self.path.lstrip("/").split("?")[0]
+                data = server.files.get(name)
+                if data is None:
+                    self.send_error(404)
+                    return
+                etag = f'"{server.etags[name]}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                view = memoryview(data)
+                for offset in range(0, len(data), 64 * 1024):
+                    self.wfile.write(view[offset:offset + 64 * 1024])
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = None
+
+    def url(self, name):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/{name}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="BenchFileServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class FakePlugin:
+    """
+    A fully initialized PrintagoMqttConnector wired to the fakes above, connected to a
+    FakeMqttClient. ``settings`` overrides are applied on top of the plugin defaults
+    before ``initialize``. Use as a context manager so threads and temp files go away.
+    """
+
+    def __init__(self, settings=None, connected=True):
+        from octoprint_printago_connector import PrintagoMqttConnector
+
+        self.data_folder = tempfile.mkdtemp(prefix="printago-bench-")
+        self.client = FakeMqttClient()
+        self.printer = FakePrinter()
+        self.file_manager = FakeFileManager(os.path.join(self.data_folder, "uploads"))
+
+        plugin = self.plugin = PrintagoMqttConnector()
+        plugin._identifier = PLUGIN_IDENTIFIER
+        plugin._plugin_version = "bench"
+        plugin._logger = logging.getLogger(f"octoprint.plugins.{PLUGIN_IDENTIFIER}")
+        plugin._printer = self.printer
+        plugin._file_manager = self.file_manager
+        plugin._plugin_manager = FakePluginManager()
+        plugin._settings = FakeSettings(plugin.get_settings_defaults())
+        plugin.get_plugin_data_folder = lambda: self.data_folder
+
+        plugin._settings.set(["broker", "url"], "127.0.0.1")
+        plugin._settings.set(["printago", "metrics_interval"], 0)
+        for path, value in (settings or {}).items():
+            plugin._settings.set(path.split("."), value)
+
+        plugin.initialize()
+        plugin._mqtt = self.client
+        if connected:
+            self.connect()
+
+    def connect(self):
+        self.plugin._on_mqtt_connect(self.client, None, {}, 0)
+
+    def disconnect(self):
+        self.plugin._on_mqtt_disconnect(self.client, None, 0)
+
+    def receive(self, topic, payload):
+        self.plugin._on_mqtt_message(self.client, None, FakeMqttMessage(topic, payload))
+
+    def wait_for_drain(self, timeout=60):
+        spool = self.plugin._mqtt_publish_queue
+        deadline = time.monotonic() + timeout
+        while len(spool) and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return len(spool) == 0
+
+    def close(self):
+        self.plugin.on_shutdown()
+        shutil.rmtree(self.data_folder, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
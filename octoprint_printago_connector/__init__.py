@@ -1,16 +1,30 @@
 # coding=utf-8
 from __future__ import absolute_import
 
-import json
+import flask
+import os
 import six
 import time
 from collections import deque
 
 import octoprint.plugin
+import octoprint.printer
 
+from octoprint.access.permissions import Permissions
 from octoprint.events import Events
-from octoprint.util import dict_minimal_mergediff, RepeatedTimer
+from octoprint.filemanager import FileDestinations
+from octoprint.util import RepeatedTimer, dict_minimal_mergediff
 from .command_handler import CommandHandler
+from .executor import LANE_DEFAULT
+from .firmware_triggers import DEFAULT_FIRMWARE_TRIGGERS
+from .metrics import Metrics, topic_key
+from .progress import ProgressThrottle, compute_progress
+from .publish_plan import build_publish_plan
+from .spool import PublishSpool, SpoolDrainer
+from .status_stream import STATUS_MODE_DELTA, STATUS_MODE_FULL
+from .temperature import (TEMPERATURE_MODE_AGGREGATE, TEMPERATURE_MODE_FRAME, TEMPERATURE_MODE_PER_HEATER,
+                          TemperatureAggregator, TemperatureHistory, temperature_changed)
+from .topic_trie import TopicTrie
 
 
 class PrintagoMqttConnector(octoprint.plugin.SettingsPlugin,
@@ -20,6 +34,7 @@ class PrintagoMqttConnector(octoprint.plugin.SettingsPlugin,
                  octoprint.plugin.ProgressPlugin,
                  octoprint.plugin.TemplatePlugin,
                  octoprint.plugin.AssetPlugin,
+                 octoprint.plugin.SimpleApiPlugin,
                  octoprint.printer.PrinterCallback):
 
     EVENT_CLASS_TO_EVENT_LIST = dict(server   = (Events.STARTUP, Events.SHUTDOWN, Events.CLIENT_OPENED,
@@ -44,6 +59,13 @@ class PrintagoMqttConnector(octoprint.plugin.SettingsPlugin,
                                                  Events.SLICING_PROFILE_DELETED, Events.SLICING_PROFILE_MODIFIED),
                                      settings = (Events.SETTINGS_UPDATED,))
 
+    # fired by the bundled plugin manager, not part of Events
+    PLUGIN_CHANGE_EVENTS = ("plugin_pluginmanager_install_plugin", "plugin_pluginmanager_uninstall_plugin",
+                            "plugin_pluginmanager_enable_plugin", "plugin_pluginmanager_disable_plugin")
+
+    # the metadata topic's {key}, all configured keys are published together in one message
+    METADATA_TOPIC_KEY = "all"
+
     LWT_CONNECTED = "connected"
     LWT_DISCONNECTED = "disconnected"
 
@@ -53,17 +75,42 @@ class PrintagoMqttConnector(octoprint.plugin.SettingsPlugin,
         self._mqtt_reset_state = True
 
         self._mqtt_subscriptions = []
+        self._mqtt_subscription_trie = TopicTrie()
 
-        self._mqtt_publish_queue = deque()
+        self._mqtt_publish_queue = None
+        self._spool_drainer = None
         self._mqtt_subscribe_queue = deque()
 
+        self._publish_plan = None
+
         self.lastTemp = {}
+        self._last_temperature_publish = 0
+        self._temperature_aggregator = None
+        self.temperature_history = None
 
-        self.progress_timer = None
-        self.last_progress = {"storage": "", "path": "", "progress": -1}
+        self._progress_throttle = None
+
+        self.metrics = Metrics()
+        self._metrics_timer = None
 
     def initialize(self):
         self._printer.register_callback(self)
+        self._rebuild_publish_plan()
+        self._progress_throttle = ProgressThrottle(self._publish_progress,
+                                                   min_interval=self._settings.get_float(["printago", "progress_min_interval"]),
+                                                   max_interval=self._settings.get_float(["printago", "progress_max_interval"]))
+        self.temperature_history = TemperatureHistory(self._settings.get_int(["printago", "temperature_history_size"]))
+
+        self._mqtt_publish_queue = PublishSpool(os.path.join(self.get_plugin_data_folder(), "publish_spool.db"),
+                                                max_bytes=self._settings.get_int(["printago", "spool_max_bytes"]),
+                                                max_age=self._settings.get_int(["printago", "spool_max_age"]),
+                                                logger=self._logger)
+        self._spool_drainer = SpoolDrainer(self._mqtt_publish_queue, self._publish_spooled,
+                                           rate=self._settings.get_int(["printago", "drain_rate"]),
+                                           max_inflight=self._settings.get_int(["printago", "drain_max_inflight"]),
+                                           logger=self._logger)
+
+        self._register_metrics_gauges()
 
         if self._settings.get(["broker", "url"]) is None:
             self._logger.error("No broker URL defined, MQTT plugin won't be able to work")
@@ -71,6 +118,14 @@ class PrintagoMqttConnector(octoprint.plugin.SettingsPlugin,
         
         self.command_handler = CommandHandler(self)
 
+        metrics_interval = self._settings.get_float(["printago", "metrics_interval"])
+        if metrics_interval:
+            self._metrics_timer = RepeatedTimer(metrics_interval, self._publish_metrics, daemon=True)
+            self._metrics_timer.start()
+
+    def register_command(self, command_type, action, handler, params=(), lane=LANE_DEFAULT):
+        return self.command_handler.register_command(command_type, action, handler, params=params, lane=lane)
+
     ##~~ TemplatePlugin API
 
     def get_template_configs(self):
@@ -91,7 +146,28 @@ class PrintagoMqttConnector(octoprint.plugin.SettingsPlugin,
     ##~~ ShutdownPlugin API
 
     def on_shutdown(self):
+        if self._metrics_timer is not None:
+            self._metrics_timer.cancel()
+        if self._progress_throttle is not None:
+            self._progress_throttle.cancel()
+        if self._spool_drainer is not None:
+            self._spool_drainer.stop()
+        if getattr(self, "command_handler", None) is not None:
+            self.command_handler.shutdown()
         self.mqtt_disconnect(force=True)
+        if self._mqtt_publish_queue is not None:
+            self._mqtt_publish_queue.close()
+
+    ##~~ SimpleApiPlugin API
+
+    def is_api_protected(self):
+        return True
+
+    def on_api_get(self, request):
+        # topics, publish rates and spool state are as revealing as the settings they come from
+        if not Permissions.SETTINGS_READ.can():
+            flask.abort(403)
+        return flask.jsonify(self.metrics.snapshot())
 
     ##~~ SettingsPlugin API
 
@@ -135,13 +211,21 @@ class PrintagoMqttConnector(octoprint.plugin.SettingsPlugin,
                 temperatureTopic="temperature/{temp}",
                 temperatureActive=True,
                 temperatureThreshold=1.0,
+                temperatureMode=TEMPERATURE_MODE_PER_HEATER,   # per_heater, frame or aggregate
+                temperatureWindow=10,                         # aggregate mode window, seconds
+                temperatureHeartbeat=60,                      # max seconds between frames/aggregates
 
                 metadataTopic="metadata/{key}",
                 metadataActive=False,
                 metadataKeys="",
 
+                firmwareTriggers=DEFAULT_FIRMWARE_TRIGGERS,   # firmware line prefixes that publish an event
+
                 lwTopic="mqtt",
-                lwActive=True
+                lwActive=True,
+
+                codec="json",               # json, msgpack or cbor
+                compressThreshold=0         # zlib-compress payloads larger than this many bytes, 0 disables
             ),
             subscribe=dict(
                 commandTopic="commands",
@@ -154,21 +238,44 @@ class PrintagoMqttConnector(octoprint.plugin.SettingsPlugin,
                 _public_key=None,              # Public key (hidden)
                 printer_id="",
                 reconnect_interval=5,
-                max_printago_files=10,
+                cache_max_bytes=512 * 1024 * 1024, # size budget of the Printago job folder
+                transfer_queue_size=8,
+                queue_prefetch=2,                  # queued jobs downloaded ahead of time
+                prefetch_max_rate=256 * 1024,      # bytes per second for prefetching while printing, 0 for no limit
+                snapshot_cache_ttl=2.0,            # seconds a webcam snapshot is reused for other requests
+                snapshot_chunk_size=128 * 1024,    # snapshots are published as raw JPEG chunks of this size
+                snapshot_timeout=10.0,             # seconds snapshot_all waits for a camera
+                stream_max_fps=5.0,
+                stream_change_threshold=2.0,       # mean pixel difference (0-255) below which a frame is skipped
+                stream_heartbeat=30.0,             # seconds after which an unchanged frame is sent anyway
+                stream_max_backlog=4,              # unsent messages above which streams slow down
+                spool_max_bytes=5 * 1024 * 1024,   # offline publish spool limits
+                spool_max_age=24 * 60 * 60,
+                drain_rate=50,                     # spooled messages per second after a reconnect
+                drain_max_inflight=20,
+                temperature_history_size=7200,     # samples kept per heater, 16 bytes each
+                progress_min_interval=1.0,         # seconds between progress publishes, adapts up to the max
+                progress_max_interval=10.0,
+                status_mode=STATUS_MODE_FULL,      # full, or delta for keyframes plus merge-patch deltas
+                status_interval=5.0,               # delta mode: seconds between streamed status updates
+                status_keyframe_interval=60.0,
+                metrics_interval=60.0,             # seconds between metrics messages, 0 disables them
+                latency_window=3600,               # seconds covered by get_latency_report
             ),
             timestamp_fieldname="_timestamp"
         )
 
     def on_settings_save(self, data):
         old_broker_data = self._settings.get(["broker"])
-        old_lw_active = self._settings.get_boolean(["publish", "lwActive"])
+        old_lw_active = self._publish_plan.lw_active
         old_lw_topic = self._get_topic("lw")
         old_client_data = self._settings.get(["client"])
 
         octoprint.plugin.SettingsPlugin.on_settings_save(self, data)
+        self._rebuild_publish_plan()
 
         new_broker_data = self._settings.get(["broker"])
-        new_lw_active = self._settings.get_boolean(["publish", "lwActive"])
+        new_lw_active = self._publish_plan.lw_active
         new_lw_topic = self._get_topic("lw")
         new_client_data = self._settings.get(["client"])
 
@@ -187,11 +294,24 @@ class PrintagoMqttConnector(octoprint.plugin.SettingsPlugin,
     ##~~ EventHandlerPlugin API
 
     def on_event(self, event, payload):
-        if event in [Events.PRINT_STARTED, Events.PRINT_DONE, Events.FILE_SELECTED, Events.FILE_DESELECTED]:
-            if self.progress_timer is None:
-                self.progress_timer = RepeatedTimer(5, self._update_progress, [payload["origin"], payload["path"]])
-                self.progress_timer.start()
+        if event == Events.SETTINGS_UPDATED or event in self.PLUGIN_CHANGE_EVENTS:
+            # webcam configurations live in settings and plugins, so rebuild the inventory on next use
+            if getattr(self, "command_handler", None) is not None:
+                self.command_handler.webcams.invalidate()
+
+        if event == Events.PRINT_STARTED and payload.get("origin") == FileDestinations.LOCAL \
+                and getattr(self, "command_handler", None) is not None:
+            # job cache eviction is least recently printed first
+            self.command_handler.job_cache.touch(payload["path"])
+
+        if event in [Events.PRINT_DONE, Events.PRINT_FAILED, Events.PRINT_CANCELLED]:
+            # publish the final progress right away instead of waiting for the trailing flush
+            self._progress_throttle.flush()
 
+        if event == Events.PRINTER_STATE_CHANGED and payload.get("state_id") == "OPERATIONAL" \
+                and getattr(self, "command_handler", None) is not None:
+            # PrintDone fires while the printer is still finishing, a queued job can only start once it's idle
+            self.command_handler.on_printer_idle()
 
         if event in [Events.PRINT_STARTED, Events.PRINT_DONE, Events.PRINT_FAILED, Events.PRINT_CANCELLED]:
             self.on_additional_metadata(payload["origin"], payload["path"], event)
@@ -206,42 +326,29 @@ class PrintagoMqttConnector(octoprint.plugin.SettingsPlugin,
                     data = dict(payload)
                 data["_event"] = event
 
-                _retained = self._settings.get_boolean(["broker", "retain"])
+                _retained = self._publish_plan.retain
                 if not _retained or event not in ["ZChange", "FirmwareData"]:
                     _retained = False
 
-                self.mqtt_publish_with_timestamp(topic.format(event=event), data, retained=_retained)
+                self.mqtt_publish_with_timestamp(topic.format(event=event), data, retained=_retained,
+                                                 allow_queueing=True)
 
     ##~~ ProgressPlugin API
 
-    def _update_progress(self, storage, path):
+    def on_print_progress(self, storage, path, progress):
+        # the same source as on_printer_send_current_data, otherwise the file position based
+        # value pushed here and PrintTimeGenius' time based one would alternate
+        current_data = self._printer.get_current_data()
+        progress = compute_progress(current_data.get("progress") or {})
+        printer_data = current_data if self._publish_plan.printer_data else None
+        self._progress_throttle.update(storage, path, progress, printer_data=printer_data)
+
+    def _publish_progress(self, data):
         topic = self._get_topic("progress")
 
         if topic:
-            printer_data = self._printer.get_current_data()
-            print_job_progress = printer_data["progress"]
-            progress = 0
-
-            if "completion" in print_job_progress and print_job_progress["completion"] is not None:
-                progress = round(float(print_job_progress["completion"]))
-            if "printTimeLeftOrigin" in print_job_progress and print_job_progress["printTimeLeftOrigin"] == "genius":
-                progress = round(float(print_job_progress["printTime"] or 0) / (float(print_job_progress["printTime"] or 0) + float(print_job_progress["printTimeLeft"])) * 100)
-
-            if print_job_progress.get("completion") in [None, 100]:
-                if self.progress_timer is not None:
-                    self.progress_timer.cancel()
-                    self.progress_timer = None
-
-            data = dict(location=storage,
-                        path=path,
-                        progress=progress)
-
-            if self._settings.get_boolean(["publish", "printerData"]):
-                data['printer_data'] = printer_data
-
-            if self.last_progress["progress"] != data["progress"] or self.last_progress["path"] != data["path"]:
-                self.mqtt_publish_with_timestamp(topic.format(progress="printing"), data, retained=True)
-                self.last_progress = data
+            self.mqtt_publish_with_timestamp(topic.format(progress="printing"), data, retained=True,
+                                             allow_queueing=True, coalesce=True)
 
     def on_slicing_progress(self, slicer, source_location, source_path, destination_location, destination_path, progress):
         topic = self._get_topic("progress")
@@ -258,91 +365,126 @@ class PrintagoMqttConnector(octoprint.plugin.SettingsPlugin,
     ##~~ Additional Metadata
 
     def on_additional_metadata(self, origin, path, event):
-        if not self._settings.get_boolean(["publish", "metadataActive"]):
+        plan = self._publish_plan
+        if not plan.metadata_active:
             return
 
-        keys = list(set([key.strip() for key in self._settings.get(["publish", "metadataKeys"]).split(",") if key.strip() != ""]))
-
-        if not keys:
+        if not plan.metadata_keys:
             self._logger.warn("No metadata keys defined, can't publish metadata")
             return
 
-        topic = self._get_topic("metadata")
+        topic = plan.get_topic("metadata")
 
         if not topic:
             self._logger.warn("No metadata topic defined, can't publish metadata")
             return
 
+        topic = topic.format(key=self.METADATA_TOPIC_KEY)
+
         if event == Events.PRINT_STARTED:
             storage = self._file_manager._storage(origin)
-            file = storage.path_on_disk(path)
-
-            def _get_nested_value(data, key):
-                first, _, rest = key.partition(".")
-                value = data.get(first)
-
-                if rest:
-                    return _get_nested_value(value, rest) if isinstance(value, dict) else None
-                else:
-                    return value
 
-            for key in keys:
-                if "." not in key:
-                    value = storage.get_additional_metadata(file, key)
-                else:
-                    first, _, rest = key.partition(".")
-                    data = storage.get_additional_metadata(file, first)
-                    value = _get_nested_value(data, rest) if isinstance(data, dict) else None
-
-                if isinstance(value, (dict, list)):
-                    value = json.dumps(value)
-
-                if not isinstance(value, (six.string_types, six.integer_types, float, bytearray, type(None))):
+            try:
+                # one read of the file's metadata entry for all keys
+                metadata = storage.get_metadata(path) or dict()
+            except NotImplementedError:
+                metadata = dict()
+                for first in set(key.partition(".")[0] for key, _ in plan.metadata_keys):
+                    metadata[first] = storage.get_additional_metadata(path, first)
+
+            values = dict()
+            for key, get in plan.metadata_keys:
+                value = get(metadata)
+                if not isinstance(value, (dict, list, six.string_types, six.integer_types, float, type(None))):
                     self._logger.warn("Metadata key {key} is not a simple type, can't publish".format(key=key))
                     continue
+                values[key] = value
 
-                self.mqtt_publish(topic.format(key=key), value, raw_data=True)
+            self.mqtt_publish(topic, dict(origin=origin, path=path, metadata=values))
         elif event in [Events.PRINT_DONE, Events.PRINT_FAILED, Events.PRINT_CANCELLED]:
-            for key in keys:
-                self.mqtt_publish(topic.format(key=key), None, raw_data=True)
+            # an empty payload clears the retained message
+            self.mqtt_publish(topic, None, raw_data=True)
 
     ##~~ PrinterCallback
 
+    def on_printer_send_current_data(self, data):
+        if self._publish_plan.status_mode == STATUS_MODE_DELTA and getattr(self, "command_handler", None) is not None:
+            self.command_handler.publish_status_update()
+
+        job_file = (data.get("job") or {}).get("file") or {}
+        if not job_file.get("path") or data.get("progress") is None:
+            return
+
+        progress = compute_progress(data["progress"])
+        printer_data = data if self._publish_plan.printer_data else None
+        self._progress_throttle.update(job_file.get("origin"), job_file["path"], progress, printer_data=printer_data)
+
     def on_printer_add_temperature(self, data):
         topic = self._get_topic("temperature")
-        threshold = self._settings.get_float(["publish", "temperatureThreshold"])
+        plan = self._publish_plan
 
-        if topic:
-            for key, value in data.items():
-                if key == "time":
-                    continue
+        timestamp = data["time"]
+        heaters = dict()
+        changed = dict()
+        for key, value in data.items():
+            if key == "time":
+                continue
 
-                # skip any entries that are none or zero.
-                if not (value.get("actual") or value.get("target")):
-                    continue
+            # skip any entries that are none or zero.
+            if not (value.get("actual") or value.get("target")):
+                continue
+
+            heaters[key] = value
+            if temperature_changed(value, self.lastTemp.get(key), plan.temperature_threshold):
+                # unknown key, new actual or new target -> update mqtt topic!
+                changed[key] = value
 
-                # in issue #42 the problem wasn't a failure to get the key, but
-                # the last_temp value was None. Hence "or 0". However by pulling
-                # lastTemp we risk failing on the dict navigation, so we'll be careful.
-                safe_actual_temp = value.get("actual") or 0
-                safe_actual_target_temp = value.get("target") or 0
-                safe_last_temp = 0
-                safe_last_target_temp = 0
-                if key in self.lastTemp:
-                    safe_last_temp = self.lastTemp[key].get("actual") or 0
-                    safe_last_target_temp = self.lastTemp[key].get("target") or 0
-
-                # some pedantry on the target temp to keep away from float math problems
-                if not safe_last_temp \
-                    or abs(safe_actual_temp - safe_last_temp) >= threshold \
-                    or abs(safe_actual_target_temp - safe_last_target_temp) >= 0.1:
-                    # unknown key, new actual or new target -> update mqtt topic!
-                    dataset = dict(actual=value["actual"],
-                                   target=value["target"])
-                    self.mqtt_publish_with_timestamp(topic.format(temp=key), dataset,
-                                                     allow_queueing=True,
-                                                     timestamp=data["time"])
-                    self.lastTemp.update({key: data[key]})
+        if self.temperature_history is not None:
+            self.temperature_history.add(timestamp, heaters)
+
+        if not topic:
+            return
+
+        if plan.temperature_mode == TEMPERATURE_MODE_FRAME:
+            heartbeat_due = timestamp - self._last_temperature_publish >= plan.temperature_heartbeat
+            if changed or (heaters and heartbeat_due):
+                # spooled frames coalesce into the newest one, so while offline every frame has to
+                # carry all heaters or a change only sent in an earlier frame would get lost
+                frame = heaters if heartbeat_due or not self._mqtt_connected else changed
+                dataset = dict(heaters=dict((key, dict(actual=value["actual"], target=value["target"]))
+                                            for key, value in frame.items()))
+                self.mqtt_publish_with_timestamp(topic.format(temp="frame"), dataset,
+                                                 allow_queueing=True,
+                                                 coalesce=True,
+                                                 timestamp=timestamp)
+                self.lastTemp.update(frame)
+                self._last_temperature_publish = timestamp
+
+        elif plan.temperature_mode == TEMPERATURE_MODE_AGGREGATE:
+            window = self._temperature_aggregator.add(timestamp, heaters, bool(changed))
+            if window is None:
+                return
+
+            stats, window_changed = window
+            if stats and (window_changed or timestamp - self._last_temperature_publish >= plan.temperature_heartbeat):
+                self.mqtt_publish_with_timestamp(topic.format(temp="aggregate"),
+                                                 dict(window=plan.temperature_window, heaters=stats),
+                                                 allow_queueing=True,
+                                                 coalesce=True,
+                                                 timestamp=timestamp)
+                self.lastTemp.update(dict((key, dict(actual=value["last"], target=value["target"]))
+                                          for key, value in stats.items()))
+                self._last_temperature_publish = timestamp
+
+        else:
+            for key, value in changed.items():
+                dataset = dict(actual=value["actual"],
+                               target=value["target"])
+                self.mqtt_publish_with_timestamp(topic.format(temp=key), dataset,
+                                                 allow_queueing=True,
+                                                 coalesce=True,
+                                                 timestamp=timestamp)
+                self.lastTemp.update({key: value})
 
     ##~~ Softwareupdate hook
 
@@ -428,7 +570,7 @@ class PrintagoMqttConnector(octoprint.plugin.SettingsPlugin,
             if lwt is None:
                 lwt = self._get_topic("lw")
             if lwt:
-                _retain = self._settings.get_boolean(["broker", "lwRetain"])
+                _retain = self._publish_plan.lw_retain
                 self._mqtt.publish(lwt, self.LWT_DISCONNECTED, qos=1, retain=_retain)
 
         self._mqtt.loop_stop()
@@ -437,7 +579,8 @@ class PrintagoMqttConnector(octoprint.plugin.SettingsPlugin,
             time.sleep(1)
             self._mqtt.loop_stop(force=True)
 
-    def mqtt_publish_with_timestamp(self, topic, payload, retained=None, qos=0, allow_queueing=False, timestamp=None):
+    def mqtt_publish_with_timestamp(self, topic, payload, retained=None, qos=0, allow_queueing=False, timestamp=None,
+                                    coalesce=False):
         if not payload:
             payload = dict()
         if not isinstance(payload, dict):
@@ -446,41 +589,63 @@ class PrintagoMqttConnector(octoprint.plugin.SettingsPlugin,
         if timestamp is None:
             timestamp = time.time()
 
-        timestamp_fieldname = self._settings.get(["timestamp_fieldname"])
-        payload[timestamp_fieldname] = int(timestamp)
+        payload[self._publish_plan.timestamp_fieldname] = int(timestamp)
 
         if retained is None:
-            retained = self._settings.get_boolean(["broker", "retain"])
+            retained = self._publish_plan.retain
 
-        return self.mqtt_publish(topic, payload, retained=retained, qos=qos, allow_queueing=allow_queueing)
+        return self.mqtt_publish(topic, payload, retained=retained, qos=qos, allow_queueing=allow_queueing,
+                                 coalesce=coalesce)
 
-    def mqtt_publish(self, topic, payload, retained=None, qos=0, allow_queueing=False, raw_data=False):
+    def mqtt_publish(self, topic, payload, retained=None, qos=0, allow_queueing=False, raw_data=False, coalesce=False):
         if not (isinstance(payload, six.string_types) or raw_data):
-            payload = json.dumps(payload)
+            payload = self._publish_plan.codec.encode(payload)
+
+        _retain = retained
+        if retained is None:
+            _retain = self._publish_plan.retain
 
         if not self._mqtt_connected:
-            if allow_queueing:
+            if allow_queueing and self._mqtt_publish_queue is not None:
                 self._logger.debug("Not connected, enqueuing message: {topic} - {payload}".format(**locals()))
-                self._mqtt_publish_queue.append((topic, payload, qos))
+                self._mqtt_publish_queue.append(topic, payload, qos=qos, retain=_retain, coalesce=coalesce)
+                self.metrics.increment("spooled")
                 return True
             else:
+                self.metrics.increment("dropped")
                 return False
 
-        _retain = retained
-        if retained is None:
-            _retain = self._settings.get_boolean(["broker", "retain"])
+        if coalesce and self._spool_drainer is not None and self._spool_drainer.active:
+            # a live value supersedes whatever is still waiting in the backlog for this topic
+            self._mqtt_publish_queue.discard_coalesced(topic)
+
+        # raw payloads may also be numbers, which paho sends as their text
+        if payload is None:
+            size = 0
+        elif isinstance(payload, (bytes, bytearray) + six.string_types):
+            size = len(payload)
+        else:
+            size = len(str(payload))
 
         self._mqtt.publish(topic, payload=payload, retain=_retain, qos=qos)
         self._logger.debug("Sent message: {topic} - {payload}, retain={_retain}".format(**locals()))
+
+        self.metrics.increment("published", label=topic_key(topic))
+        self.metrics.increment("bytes_out", size)
         return True
 
-    def mqtt_subscribe(self, topic, callback, args=None, kwargs=None):
+    def mqtt_subscribe(self, topic, callback, args=None, kwargs=None, stamp_receipt=False):
+        """
+        With ``stamp_receipt`` the callback additionally gets ``received``, the
+        ``time.monotonic()`` at which the network thread picked the message up.
+        """
         if args is None:
             args = []
         if kwargs is None:
             kwargs = dict()
 
-        self._mqtt_subscriptions.append((topic, callback, args, kwargs))
+        self._mqtt_subscriptions.append((topic, callback, args, kwargs, stamp_receipt))
+        self._rebuild_subscription_trie()
 
         if not self._mqtt_connected:
             self._mqtt_subscribe_queue.append(topic)
@@ -488,17 +653,25 @@ class PrintagoMqttConnector(octoprint.plugin.SettingsPlugin,
             self._mqtt.subscribe(topic)
 
     def mqtt_unsubscribe(self, callback, topic=None):
-        subbed_topics = [subbed_topic for subbed_topic, subbed_callback, _, _ in self._mqtt_subscriptions if callback == subbed_callback and (topic is None or topic == subbed_topic)]
+        subbed_topics = [subbed_topic for subbed_topic, subbed_callback, _, _, _ in self._mqtt_subscriptions if callback == subbed_callback and (topic is None or topic == subbed_topic)]
 
         def remove_sub(entry):
-            subbed_topic, subbed_callback, _, _ = entry
+            subbed_topic, subbed_callback, _, _, _ = entry
             return not (callback == subbed_callback and (topic is None or subbed_topic == topic))
 
         self._mqtt_subscriptions = list(filter(remove_sub, self._mqtt_subscriptions))
+        self._rebuild_subscription_trie()
 
         if self._mqtt_connected and subbed_topics:
             self._mqtt.unsubscribe(*subbed_topics)
 
+    def _rebuild_subscription_trie(self):
+        trie = TopicTrie()
+        for subscription in self._mqtt_subscriptions:
+            trie.add(subscription[0], subscription)
+        # swapped in one assignment, so the network thread never sees a half-built trie
+        self._mqtt_subscription_trie = trie
+
     ##~~ mqtt client callbacks
 
     def _on_mqtt_connect(self, client, userdata, flags, rc):
@@ -521,34 +694,29 @@ class PrintagoMqttConnector(octoprint.plugin.SettingsPlugin,
                 reason = None
 
             self._logger.error(reason if reason else "Connection to mqtt broker refused, unknown error")
+            self.metrics.increment("connect_failures")
             return
 
         self._logger.info("Connected to mqtt broker")
-        lw_active = self._settings.get_boolean(["publish", "lwActive"])
+        lw_active = self._publish_plan.lw_active
         lw_topic = self._get_topic("lw")
-        lw_retain = self._settings.get_boolean(["broker", "lwRetain"])
+        lw_retain = self._publish_plan.lw_retain
         if lw_active and lw_topic:
             self._mqtt.publish(lw_topic, self.LWT_CONNECTED, qos=1, retain=lw_retain)
 
-        _retain = self._settings.get_boolean(["broker", "retain"])
-        if self._mqtt_publish_queue:
-            try:
-                while True:
-                    topic, payload, qos = self._mqtt_publish_queue.popleft()
-                    self._mqtt.publish(topic, payload=payload, retain=_retain, qos=qos)
-            except IndexError:
-                # that's ok, queue is just empty
-                pass
-
-        subbed_topics = list(map(lambda t: (t, 0), {topic for topic, _, _, _ in self._mqtt_subscriptions}))
+        subbed_topics = list(map(lambda t: (t, 0), {topic for topic, _, _, _, _ in self._mqtt_subscriptions}))
         if subbed_topics:
             self._mqtt.subscribe(subbed_topics)
             self._logger.debug("Subscribed to topics")
 
         self._mqtt_connected = True
+        self.metrics.increment("connects")
+
+        if self._spool_drainer is not None:
+            self._spool_drainer.start()
 
         if self._mqtt_reset_state:
-            self._update_progress("", "")
+            self._progress_throttle.update("", "", 0, force=True)
             self.on_slicing_progress("", "", "", "", "", 0)
             self._mqtt_reset_state = False
 
@@ -562,46 +730,86 @@ class PrintagoMqttConnector(octoprint.plugin.SettingsPlugin,
             self._logger.info("Disconnected from mqtt broker")
 
         self._mqtt_connected = False
+        self.metrics.increment("disconnects")
+        if self._spool_drainer is not None:
+            self._spool_drainer.stop()
+
+    def _publish_spooled(self, topic, payload, qos, retain):
+        return self._mqtt.publish(topic, payload=payload, retain=retain, qos=qos)
+
+    def _register_metrics_gauges(self):
+        metrics = self.metrics
+        metrics.register_gauge("connected", lambda: self._mqtt_connected)
+        metrics.register_gauge("spool_depth", lambda: len(self._mqtt_publish_queue))
+        metrics.register_gauge("spool_bytes", lambda: self._mqtt_publish_queue.size)
+        metrics.register_gauge("paho_out_packets",
+                               lambda: len(getattr(self._mqtt, "_out_packet", ())) if self._mqtt is not None else 0)
+        metrics.register_gauge("paho_inflight",
+                               lambda: len(getattr(self._mqtt, "_out_messages", ())) if self._mqtt is not None else 0)
+        metrics.register_gauge("publish_backlog", self.get_publish_backlog)
+
+    def _publish_metrics(self):
+        if self._mqtt_connected and getattr(self, "command_handler", None) is not None:
+            self.command_handler.send_outgoing_message("metrics", self.metrics.snapshot())
+
+    def get_publish_backlog(self):
+        """
+        Number of messages waiting to go out: packets paho hasn't written to the socket yet
+        plus whatever is left in the spool. None while disconnected.
+        """
+        if not self._mqtt_connected or self._mqtt is None:
+            return None
+
+        backlog = len(getattr(self._mqtt, "_out_packet", ()))
+        if self._mqtt_publish_queue is not None:
+            backlog += len(self._mqtt_publish_queue)
+        return backlog
 
     def _on_mqtt_message(self, client, userdata, msg):
         if not client == self._mqtt:
             return
 
-        from paho.mqtt.client import topic_matches_sub
-        for subscription in self._mqtt_subscriptions:
-            topic, callback, args, kwargs = subscription
-            if topic_matches_sub(topic, msg.topic):
-                args = [msg.topic, msg.payload] + args
-                kwargs.update(dict(retained=msg.retain, qos=msg.qos))
-                try:
-                    callback(*args, **kwargs)
-                except:
-                    self._logger.exception("Error while calling mqtt callback")
+        received = time.monotonic()
+        for topic, callback, args, kwargs, stamp_receipt in self._mqtt_subscription_trie.match(msg.topic):
+            call_args = [msg.topic, msg.payload] + args
+            call_kwargs = dict(kwargs)
+            call_kwargs.update(retained=msg.retain, qos=msg.qos)
+            if stamp_receipt:
+                call_kwargs["received"] = received
+            try:
+                callback(*call_args, **call_kwargs)
+            except:
+                self._logger.exception("Error while calling mqtt callback")
 
-    def _get_topic(self, topic_type):
-        sub_topic = self._settings.get(["publish", topic_type + "Topic"])
-        topic_active = self._settings.get(["publish", topic_type + "Active"])
+    def _rebuild_publish_plan(self):
+        self._publish_plan = build_publish_plan(self._settings, self.EVENT_CLASS_TO_EVENT_LIST, logger=self._logger)
+        self._temperature_aggregator = TemperatureAggregator(self._publish_plan.temperature_window)
 
-        if not sub_topic or not topic_active:
-            return None
-
-        return self._settings.get(["publish", "baseTopic"]) + sub_topic
+    def _get_topic(self, topic_type):
+        return self._publish_plan.get_topic(topic_type)
 
     def _is_event_active(self, event):
-        for event_class, events in self.EVENT_CLASS_TO_EVENT_LIST.items():
-            if event in events:
-                return self._settings.get_boolean(["publish", "events", event_class])
-        return self._settings.get_boolean(["publish", "events", "unclassified"])
+        return self._publish_plan.is_event_active(event)
 
     def on_gcode_received(self, comm, line, *args, **kwargs):
-        if line.startswith('echo:busy: paused for user'):
-            topic = self._get_topic("event")
-            event = 'PausedForUser'
-            payload = dict()
-            payload["_event"] = event
-            self.mqtt_publish_with_timestamp(topic.format(event=event), payload)
+        # runs for every line the printer sends, anything beyond the match belongs in _on_firmware_triggers
+        triggers = self._publish_plan.firmware_triggers.match(line)
+        if triggers:
+            self._on_firmware_triggers(line, triggers)
         return line
 
+    def _on_firmware_triggers(self, line, triggers):
+        topic = self._get_topic("event")
+        if not topic:
+            return
+
+        for trigger in triggers:
+            payload = trigger.payload(line)
+            if payload is None:
+                continue
+            payload["_event"] = trigger.event
+            self.mqtt_publish_with_timestamp(topic.format(event=trigger.event), payload)
+
 
 __plugin_name__ = "Printago Connector"
 __plugin_pythoncompat__ = ">=2.7,<4"
@@ -614,7 +822,8 @@ def __plugin_load__():
         mqtt_publish=plugin.mqtt_publish,
         mqtt_publish_with_timestamp=plugin.mqtt_publish_with_timestamp,
         mqtt_subscribe=plugin.mqtt_subscribe,
-        mqtt_unsubscribe=plugin.mqtt_unsubscribe
+        mqtt_unsubscribe=plugin.mqtt_unsubscribe,
+        register_command=plugin.register_command
     )
 
     global __plugin_implementation__
@@ -0,0 +1,88 @@
+import json
+import zlib
+
+FORMAT_JSON = "json"
+FORMAT_MSGPACK = "msgpack"
+FORMAT_CBOR = "cbor"
+
+# Payloads that aren't plain JSON start with ENVELOPE_MAGIC followed by one flags byte.
+# 0xFF never starts a UTF-8 encoded JSON document, so receivers can tell both apart.
+ENVELOPE_MAGIC = 0xFF
+FLAG_ZLIB = 0x10
+FORMAT_FLAGS = {FORMAT_JSON: 0x00, FORMAT_MSGPACK: 0x01, FORMAT_CBOR: 0x02}
+
+
+class CodecError(ValueError):
+    pass
+
+
+def _load_format(fmt):
+    if fmt == FORMAT_MSGPACK:
+        import msgpack
+        return (lambda obj: msgpack.packb(obj, use_bin_type=True),
+                lambda data: msgpack.unpackb(data, raw=False))
+    elif fmt == FORMAT_CBOR:
+        import cbor2
+        return cbor2.dumps, cbor2.loads
+    else:
+        return (lambda obj: json.dumps(obj, separators=(",", ":")).encode("utf-8"),
+                lambda data: json.loads(data))
+
+
+class PayloadCodec:
+    """
+    Serializes outgoing payloads exactly once, optionally as MessagePack or CBOR and
+    optionally zlib-compressed once they exceed ``compress_threshold`` bytes.
+
+    Uncompressed JSON goes out as plain JSON text, exactly as before. Everything else is
+    wrapped in a two byte envelope: ``0xFF`` and a flags byte holding the format in the
+    low nibble and ``0x10`` for zlib.
+    """
+
+    def __init__(self, fmt=FORMAT_JSON, compress_threshold=0, logger=None):
+        try:
+            self._dumps, self._loads = _load_format(fmt)
+        except ImportError:
+            if logger is not None:
+                logger.warning(f"Payload format {fmt} needs an additional package that isn't installed, "
+                               f"falling back to {FORMAT_JSON}")
+            fmt = FORMAT_JSON
+            self._dumps, self._loads = _load_format(fmt)
+
+        self.format = fmt
+        self._flags = FORMAT_FLAGS[fmt]
+        self._compress_threshold = compress_threshold
+
+    def encode(self, obj):
+        data = self._dumps(obj)
+        flags = self._flags
+
+        if self._compress_threshold and len(data) > self._compress_threshold:
+            compressed = zlib.compress(data, 6)
+            if len(compressed) + 2 < len(data):
+                data = compressed
+                flags |= FLAG_ZLIB
+
+        if not flags:
+            return data
+        return bytes((ENVELOPE_MAGIC, flags)) + data
+
+    def decode(self, payload):
+        if isinstance(payload, str):
+            return json.loads(payload)
+        if not payload or payload[0] != ENVELOPE_MAGIC:
+            return json.loads(payload)
+        if len(payload) < 2:
+            raise CodecError("Truncated payload envelope")
+
+        flags = payload[1]
+        data = payload[2:]
+        if flags & FLAG_ZLIB:
+            data = zlib.decompress(data)
+
+        fmt = next((name for name, value in FORMAT_FLAGS.items() if value == flags & 0x0F), None)
+        if fmt is None:
+            raise CodecError(f"Unknown payload format flags 0x{flags:02x}")
+        if fmt == self.format:
+            return self._loads(data)
+        return _load_format(fmt)[1](data)
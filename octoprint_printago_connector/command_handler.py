@@ -1,23 +1,35 @@
 import os
-import json
+import hashlib
+import tempfile
+import threading
+import time
 import requests
 import datetime
-import io
+import concurrent.futures
+import uuid
 
-from io import BytesIO
 from urllib.parse import urlparse
-from PIL import Image
-
 from octoprint.filemanager import FileDestinations
-import octoprint.plugin
+from octoprint.filemanager.util import DiskFileWrapper
+
+from .executor import CommandContext, CommandExecutor, LANE_BULK, LANE_DEFAULT, LANE_URGENT
+from .gcode_analysis import GcodeAnalyzer
+from .job_cache import JobCache
+from .job_queue import JobQueue
+from .registry import NUMBER, CommandRegistry, CommandValidationError, Param, UnknownCommandError
+from .snapshot import SNAPSHOT_CONTENT_TYPE, SnapshotCache, downscale_jpeg, split_chunks
+from .status_stream import STATUS_MODE_DELTA, StatusStream
+from .stream import FrameStream
+from .tracing import CommandTrace, LatencyRecorder
+from .transfer import DownloadError, TransferWorker
+from .webcams import WebcamInventory
 
-class FileWrapper:
-    def __init__(self, obj):
-        self.obj = obj
+# Downloads are streamed to disk in chunks of this size, so peak memory stays
+# constant no matter how large the G-code file is.
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = 30
 
-    def save(self, path):
-        with open(path, 'wb') as f:
-            f.write(self.obj.getvalue())
+MAX_BATCH_SIZE = 50
 
 
 class CommandHandler:
@@ -29,363 +41,822 @@ class CommandHandler:
         self._plugin_manager = plugin_instance._plugin_manager
         self._settings = plugin_instance._settings
 
-        self._currentCommandType = None
-        self._currentCommandAction = None
-        self._currentCommandParameters = None
+        self._registry = CommandRegistry()
+        self._register_builtin_commands()
+
+        self._executor = CommandExecutor(self._logger)
+        self.latency = LatencyRecorder(window=self._settings.get_int(["printago", "latency_window"]))
+        self._status_stream = StatusStream(interval=self._settings.get_float(["printago", "status_interval"]),
+                                           keyframe_interval=self._settings.get_float(["printago", "status_keyframe_interval"]))
+        self.job_cache = JobCache(os.path.join(self.plugin.get_plugin_data_folder(), "job_cache.json"),
+                                  max_bytes=self._settings.get_int(["printago", "cache_max_bytes"]), logger=self._logger)
+        self.transfer_worker = TransferWorker(self, max_queued=self._settings.get_int(["printago", "transfer_queue_size"]))
+        self.job_queue = JobQueue(self, os.path.join(self.plugin.get_plugin_data_folder(), "job_queue.json"),
+                                  prefetch=self._settings.get_int(["printago", "queue_prefetch"]),
+                                  rate_limit=self._prefetch_rate_limit)
+        self._snapshot_cache = SnapshotCache(ttl=self._settings.get_float(["printago", "snapshot_cache_ttl"]))
+        self._snapshot_chunk_size = self._settings.get_int(["printago", "snapshot_chunk_size"])
+        # cameras with a snapshot_all capture still running, so a hung camera never gets a second thread
+        self._snapshot_busy = set()
+        self._snapshot_busy_lock = threading.Lock()
+        self.webcams = WebcamInventory(self._plugin_manager, self._logger)
+        self._streams = {}
+        self._streams_lock = threading.Lock()
 
         # Subscribe to incoming MQTT commands
         self.subscribe_to_mqtt_commands()
 
+        # resume prefetching jobs left in the queue before a restart
+        self.job_queue.prefetch()
+
     def subscribe_to_mqtt_commands(self):
         command_topic = self._settings.get(["subscribe", "command_topic"])
         if not command_topic:
             command_topic = "octoPrint/commands"
-        self.plugin.mqtt_subscribe(command_topic, self.process_command)
-
-    def process_command(self, topic, payload, **kwargs):
+        self.plugin.mqtt_subscribe(command_topic, self.process_command, stamp_receipt=True)
+
+    def shutdown(self):
+        with self._streams_lock:
+            for stream in self._streams.values():
+                stream.stop()
+            self._streams.clear()
+        self._executor.stop()
+        self.transfer_worker.stop()
+
+    def register_command(self, command_type, action, handler, params=(), lane=LANE_DEFAULT):
+        return self._registry.register(command_type, action, handler, params=params, lane=lane)
+
+    def _register_builtin_commands(self):
+        register = self._registry.register
+
+        register("printer_control", "download_gcode", self._download_gcode,
+                 params=(Param("url", str, required=True), Param("sha256", str), Param("job_id", str)))
+        register("printer_control", "pause_print", self._pause_print, lane=LANE_URGENT)
+        register("printer_control", "resume_print", self._resume_print, lane=LANE_URGENT)
+        register("printer_control", "stop_print", self._stop_print, lane=LANE_URGENT)
+        register("printer_control", "get_status", self._get_status, lane=LANE_BULK)
+        register("printer_control", "start_print", self._start_print,
+                 params=(Param("file_name", str, required=True),))
+        register("printer_control", "enqueue_job", self._enqueue_job,
+                 params=(Param("url", str, required=True), Param("sha256", str), Param("job_id", str)))
+        register("printer_control", "remove_job", self._remove_job,
+                 params=(Param("job_id", str, required=True),))
+        register("printer_control", "get_queue", self._get_queue, lane=LANE_BULK)
+        register("printer_control", "confirm_bed_clear", self._confirm_bed_clear)
+        register("printer_control", "get_latency_report", self._get_latency_report, lane=LANE_BULK,
+                 params=(Param("command", str), Param("buckets", bool, default=False)))
+
+        register("temperature_control", "set_hotend", self._set_hotend,
+                 params=(Param("temperature", NUMBER, required=True), Param("tool", int, default=0)))
+        register("temperature_control", "set_bed", self._set_bed,
+                 params=(Param("temperature", NUMBER, required=True),))
+        register("temperature_control", "get_history", self._get_temperature_history, lane=LANE_BULK,
+                 params=(Param("points", int, default=300), Param("heaters", list), Param("since", NUMBER)))
+
+        register("movement_control", "jog", self._jog,
+                 params=(Param("axes", dict, required=True), Param("relative", bool, default=True),
+                         Param("speed", NUMBER), Param("tags", list, default=[])))
+        register("movement_control", "extrude", self._extrude,
+                 params=(Param("amount", NUMBER, required=True), Param("speed", NUMBER),
+                         Param("tags", list, default=[])))
+        register("movement_control", "home", self._home,
+                 params=(Param("axes", (str, list), required=True),))
+
+        register("camera_control", "get_providers", self._get_providers, lane=LANE_BULK)
+        register("camera_control", "snapshot", self._snapshot, lane=LANE_BULK,
+                 params=(Param("camera_provider_id", str, required=True), Param("camera_name", str, required=True),
+                         Param("max_dimension", int)))
+        register("camera_control", "snapshot_all", self._snapshot_all, lane=LANE_BULK,
+                 params=(Param("max_dimension", int), Param("timeout", NUMBER)))
+        register("camera_control", "start_stream", self._start_stream,
+                 params=(Param("camera_provider_id", str, required=True), Param("camera_name", str, required=True),
+                         Param("fps", NUMBER, default=1.0), Param("max_dimension", int),
+                         Param("change_threshold", NUMBER)))
+        register("camera_control", "stop_stream", self._stop_stream,
+                 params=(Param("camera_provider_id", str, required=True), Param("camera_name", str, required=True)))
+
+    def process_command(self, topic, payload, received=None, **kwargs):
+        request_id = None
+        self.plugin.metrics.increment("commands_received")
         try:
-            message_data = json.loads(payload)
+            message_data = self.plugin._publish_plan.codec.decode(payload)
+            if isinstance(message_data, list):
+                message_data = dict(commands=message_data)
+            request_id = message_data.get("request_id")
 
-            if 'type' not in message_data:
-                self._logger.error("No command type specified in the received message.")
-                self.send_error_message("No command type specified in the received message.")
-                return
-            self._currentCommandType = message_data["type"]
+            sent_at = message_data.get("sent_at")
+            trace = CommandTrace(received, sent_at=sent_at if isinstance(sent_at, (int, float)) else None)
 
-            if 'action' not in message_data:
-                self._logger.error(f"No action specified for {self._currentCommandType} command.")
-                self.send_error_message(f"No action specified for {self._currentCommandType} command.")
+            try:
+                if "commands" in message_data:
+                    self._process_batch(message_data, request_id, trace)
+                    return
+                spec, parameters = self._resolve_command(message_data)
+            except (UnknownCommandError, CommandValidationError) as e:
+                self.plugin.metrics.increment("commands_rejected")
+                self._logger.warning(str(e))
+                self.send_error_message(str(e), request_id=request_id)
                 return
-            self._currentCommandAction = message_data["action"]
 
-            if 'parameters' not in message_data:
-                self._logger.error(f"No parameters specified for {self._currentCommandAction} action.")
-                self.send_error_message(f"No parameters specified for {self._currentCommandAction} action.")
-                return
-            self._currentCommandParameters = message_data["parameters"]
-
-            if self._currentCommandType == "printer_control":
-                self._logger.info("Processing Printago Printer Control Command")
-                self._handle_printer_control(message_data)
-        
-            elif self._currentCommandType == "temperature_control":
-                self._logger.info("Processing Printago Temperature Control Command")
-                self._handle_temperature_control(message_data)
-            
-            elif self._currentCommandType == "movement_control":
-                self._logger.info("Processing Printago Movement Control Command")
-                self._handle_movement_control(message_data)
-
-            elif self._currentCommandType == "camera_control":
-                self._logger.info("Processing Printago Webcam Control Command")
-                self._handle_camera_control(message_data)
-
-            else:
-                self._logger.warning(f"Unknown command type: {self._currentCommandType}")
-                self.send_error_message(f"Unknown Printago command type: {self._currentCommandType}")
+            ctx = CommandContext(spec.type, spec.action, parameters, request_id=request_id, trace=trace)
+            trace.mark_dispatched()
+            self._executor.submit(spec.lane, self._execute_command, spec, ctx)
 
         except Exception as e:
+            self.plugin.metrics.increment("command_errors")
             self._logger.error(f"Error processing message: {e}")
-            self.send_error_message(f"Error processing message {str(e)}")
-
-    def _handle_printer_control(self, message_data):
-        self._logger.info(f"Processing Printago command - printer_control::{self._currentCommandAction}")
-
-        if self._currentCommandAction == "download_gcode":
-            if "url" in self._currentCommandParameters:
-                self.download_file(self._currentCommandParameters.get("url"))
-            else:
-                self._logger.error("No URL provided for downloading file.")
-                self.send_error_message("No URL provided for downloading file.")
-
-        elif self._currentCommandAction == "pause_print":
+            self.send_error_message(f"Error processing message {str(e)}", request_id=request_id)
+
+    def _resolve_command(self, message_data):
+        """Looks up and validates one command, returns ``(spec, parameters)``."""
+        if 'type' not in message_data:
+            raise CommandValidationError("No command type specified in the received message.")
+        command_type = message_data["type"]
+
+        if 'action' not in message_data:
+            raise CommandValidationError(f"No action specified for {command_type} command.")
+        action = message_data["action"]
+
+        if 'parameters' not in message_data:
+            raise CommandValidationError(f"No parameters specified for {action} action.")
+
+        spec = self._registry.lookup(command_type, action)
+        return spec, spec.validate(message_data["parameters"])
+
+    def _process_batch(self, message_data, request_id, trace):
+        commands = message_data["commands"]
+        if not isinstance(commands, list) or not commands:
+            raise CommandValidationError("Batch commands must be a non-empty list")
+        if len(commands) > MAX_BATCH_SIZE:
+            raise CommandValidationError(f"Batch has {len(commands)} commands, at most {MAX_BATCH_SIZE} are allowed")
+
+        # everything is validated up front, so a typo in the last command doesn't leave the first ones half done
+        resolved = []
+        errors = []
+        for index, command in enumerate(commands):
             try:
+                if not isinstance(command, dict):
+                    raise CommandValidationError("Batch entries must be objects")
+                if "commands" in command:
+                    raise CommandValidationError("Batches can't be nested")
+                resolved.append(self._resolve_command(command))
+            except (UnknownCommandError, CommandValidationError) as e:
+                errors.append(f"Command {index}: {e}")
+        if errors:
+            self.plugin.metrics.increment("commands_rejected")
+            self._logger.warning(f"Rejected batch: {'; '.join(errors)}")
+            self.send_error_message(dict(message="Invalid batch, nothing was executed", errors=errors),
+                                    request_id=request_id)
+            return
+
+        ctx = CommandContext("batch", "execute", dict(commands=resolved,
+                                                      stop_on_error=bool(message_data.get("stop_on_error", False))),
+                             request_id=request_id, trace=trace)
+        trace.mark_dispatched()
+        # the whole batch runs in order on one lane: the urgent lane only if every command belongs there,
+        # so a slow batch can't hold up a later stop_print behind it
+        urgent = all(spec.lane == LANE_URGENT for spec, _ in resolved)
+        lane = LANE_URGENT if urgent else LANE_DEFAULT
+        self._executor.submit(lane, self._execute_batch, ctx)
+
+    def _execute_batch(self, ctx):
+        ctx.trace.mark_started()
+        self._logger.info(f"Processing Printago batch of {len(ctx.parameters['commands'])} commands")
+
+        results = []
+        failed = False
+        for index, (spec, parameters) in enumerate(ctx.parameters["commands"]):
+            if failed and ctx.parameters["stop_on_error"]:
+                results.append(dict(index=index, type=spec.type, action=spec.action, status="skipped"))
+                continue
+
+            command = CommandContext(spec.type, spec.action, parameters, request_id=ctx.request_id,
+                                     trace=CommandTrace(ctx.trace.received, sent_at=ctx.trace.sent_at))
+            command.trace.dispatched = ctx.trace.dispatched
+            # replies are collected into the aggregated result instead of being published
+            command.replies = []
+            self._execute_command(spec, command)
+
+            status = "success"
+            for reply_type, _ in command.replies:
+                if reply_type == "error":
+                    status = "error"
+                    failed = True
+            result = dict(index=index, type=spec.type, action=spec.action, status=status,
+                          latency=command.trace.stages())
+            if len(command.replies) == 1:
+                result["data"] = command.replies[0][1]
+            elif command.replies:
+                result["data"] = [data for _, data in command.replies]
+            results.append(result)
+
+        summary = dict((status, sum(1 for result in results if result["status"] == status))
+                       for status in ("success", "error", "skipped"))
+        self.send_response_message(dict(results=results, **summary), ctx)
+        self.latency.record(ctx.key, ctx.trace)
+
+    def _execute_command(self, spec, ctx):
+        ctx.trace.mark_started()
+        self._logger.info(f"Processing Printago command - {ctx.key}")
+        metrics = self.plugin.metrics
+        try:
+            result = spec.handler(ctx)
+            if result is not None:
+                self.send_response_message(result, ctx)
+        except Exception as e:
+            metrics.increment("command_failures", label=ctx.key)
+            self._logger.error(f"Error processing message: {e}")
+            self.send_error_message(f"Error processing message {str(e)}", ctx)
+        finally:
+            # measured from receipt, so time spent waiting in the lane counts too
+            self.latency.record(ctx.key, ctx.trace)
+            metrics.observe("command_latency_ms", (time.monotonic() - ctx.trace.received) * 1000, label=ctx.key)
+
+    ##~~ printer_control
+
+    def _download_gcode(self, ctx):
+        job = self.transfer_worker.submit(ctx.parameters["url"],
+                                          sha256=ctx.parameters["sha256"],
+                                          job_id=ctx.parameters["job_id"],
+                                          request_id=ctx.request_id)
+        if job is None:
+            self._logger.error("Transfer queue is full, rejecting download.")
+            self.send_error_message("Transfer queue is full, rejecting download.", ctx)
+
+    def _pause_print(self, ctx):
+        try:
+            with ctx.trace.printer_call():
                 self._printer.pause_print()
-                self.send_success_message("Print paused command issued successfully.")
-            except Exception as e:
-                self._logger.error(f"Error pausing print: {e}")
-                self.send_error_message(f"Error pausing print: {e}")
-            
-        elif self._currentCommandAction == "resume_print":
-            try:
+            self.send_success_message("Print paused command issued successfully.", ctx)
+        except Exception as e:
+            self._logger.error(f"Error pausing print: {e}")
+            self.send_error_message(f"Error pausing print: {e}", ctx)
+
+    def _resume_print(self, ctx):
+        try:
+            with ctx.trace.printer_call():
                 self._printer.resume_print()
-                self.send_success_message("Print resumed command issued successfully.")
-            except Exception as e:
-                self._logger.error(f"Error resuming print: {e}")
-                self.send_error_message(f"Error resuming print: {e}")
+            self.send_success_message("Print resumed command issued successfully.", ctx)
+        except Exception as e:
+            self._logger.error(f"Error resuming print: {e}")
+            self.send_error_message(f"Error resuming print: {e}", ctx)
 
-        elif self._currentCommandAction == "stop_print":
-            try:
+    def _stop_print(self, ctx):
+        try:
+            with ctx.trace.printer_call():
                 self._printer.cancel_print()
-                self.send_success_message("Print stop command issued successfully.")
-            except Exception as e:
-                self._logger.error(f"Error stopping print: {e}")
-                self.send_error_message(f"Error stopping print: {e}")
-
-        elif self._currentCommandAction == "get_status":
-            self.send_printer_status()
-            
-        elif self._currentCommandAction == "start_print":
-            file_path = 'Printago/'
-            file_name = message_data["parameters"].get("file_name", None) 
-            if not file_name.startswith(file_path):
-                file_name = file_path + file_name
-            if self._file_manager.file_exists(FileDestinations.LOCAL, file_name): 
-                try:
+            self.send_success_message("Print stop command issued successfully.", ctx)
+        except Exception as e:
+            self._logger.error(f"Error stopping print: {e}")
+            self.send_error_message(f"Error stopping print: {e}", ctx)
+
+    def _get_status(self, ctx):
+        self.send_printer_status(ctx=ctx)
+
+    def _start_print(self, ctx):
+        file_path = 'Printago/'
+        file_name = ctx.parameters["file_name"]
+        if not file_name.startswith(file_path):
+            file_name = file_path + file_name
+        if self._file_manager.file_exists(FileDestinations.LOCAL, file_name):
+            try:
+                with ctx.trace.printer_call():
                     self._printer.select_file(file_name, sd=False, printAfterSelect=True)
-                    self.send_success_message("Print start command issued successfully.")
-                except Exception as e:
-                    self._logger.error(f"Error starting print: {e}")
-                    self.send_error_message(f"Error starting print: {e}")
-            else:
-                self._logger.info(f"File does not exist: {file_name}")
-                self.send_error_message(f"File does not exist: {file_name}")
-
-        else:
-            self._logger.warning(f"Unknown action for printer_control: {self._currentCommandAction}")
-            self.send_error_message(f"Unknown action for printer_control: {self._currentCommandAction}")
-
-    def _handle_temperature_control(self, message_data):
-        self._logger.info(f"Processing Printago command - temperature_control::{self._currentCommandAction}")
-        if self._currentCommandAction == "set_hotend":
-            target_temp = self._currentCommandParameters.get("temperature", None)
-            tool = self._currentCommandParameters.get("tool", 0)  # Default to the first tool if not specified
-
-            if target_temp is not None:
-                try:
-                    toolText = "tool" + str(tool)
-                    self._printer.set_temperature(toolText, target_temp)
-                    self.send_success_message("Hotend temperature command issued successfully.")
-                except Exception as e:
-                    self._logger.error(f"Error setting hotend temperature: {e}")
-                    self.send_error_message(f"Error setting hotend temperature: {e}")
-                self._logger.info(f"Setting hotend {tool} temperature to {target_temp}°C.")
-            else:
-                self._logger.error("Target temperature not provided for setting hotend temperature.")
-                self.send_error_message("Target temperature not provided for setting hotend temperature.")
-
-        elif self._currentCommandAction == "set_bed":
-            target_temp = self._currentCommandParameters.get("temperature", None)
-            
-            if target_temp is not None:
-                try:
-                    self._printer.set_temperature("bed", target_temp)
-                    self.send_success_message("Bed temperature command issued successfully.")
-                except Exception as e:
-                    self._logger.error(f"Error setting bed temperature: {e}")
-                    self.send_error_message(f"Error setting bed temperature: {e}")
-                self._logger.info(f"Setting bed temperature to {target_temp}°C.")
-            else:
-                self._logger.error("Target temperature not provided for setting bed temperature.")
-                self.send_error_message("Target temperature not provided for setting bed temperature.")
-
+                self.send_success_message("Print start command issued successfully.", ctx)
+            except Exception as e:
+                self._logger.error(f"Error starting print: {e}")
+                self.send_error_message(f"Error starting print: {e}", ctx)
         else:
-            self._logger.warning(f"Unknown action for temperature_control: {self._currentCommandAction}")
-            self.send_error_message(f"Unknown action for temperature_control: {self._currentCommandAction}")
-
-    def _handle_movement_control(self, message_data):
-        self._logger.info(f"Processing Printago command - movement_control::{self._currentCommandAction}")
-        if self._currentCommandAction == "jog":
-            axes_data = self._currentCommandParameters.get("axes", None)
-            relative = self._currentCommandParameters.get("relative", True)
-            speed = self._currentCommandParameters.get("speed", None)
-            tags = set(self._currentCommandParameters.get("tags", []))  # Convert to set
-
-            if axes_data:
-                try:
-                    self._printer.jog(axes=axes_data, relative=relative, speed=speed, tags=tags)
-                    self.send_success_message("Jogging axes command issued successfully.")
-                except Exception as e:
-                    self._logger.error(f"Error jogging axes: {e}")
-                    self.send_error_message(f"Error jogging axes: {e}")
-                axes_str = ', '.join([f"{k}={v}" for k, v in axes_data.items()])
-                self._logger.info(f"Jogging axes: {axes_str} with relative={relative} and speed={speed}.")
-            else:
-                self._logger.error("Invalid axes data provided for jogging.")
-                self.send_error_message("Invalid axes data provided for jogging.")
-    
-        elif self._currentCommandAction == "extrude":
-            amount = self._currentCommandParameters.get("amount", None)
-            speed = self._currentCommandParameters.get("speed", None)
-            tags = self._currentCommandParameters.get("used", [])
-            
-            if amount is not None:  
-                try:
-                    self._printer.extrude(amount=amount, speed=speed, tags=tags)
-                    self.send_success_message("Extruding filament command issued successfully.")
-                except Exception as e:
-                    self._logger.error(f"Error extruding: {e}")
-                    self.send_error_message(f"Error extruding: {e}")
-                self._logger.info(f"Extruding {amount}mm of filament at speed={speed}.")
-            else:
-                self._logger.error("Invalid amount provided for extrusion.")
-                self.send_error_message("Invalid amount provided for extrusion.")
-
-        elif self._currentCommandAction == "home":
-            axes = self._currentCommandParameters.get("axes", None)
-
-            if isinstance(axes, str):
-                axes = [axis.strip().lower() for axis in axes.split(",")]
-
-            if axes:
-                try:
-                    self._printer.home(axes=axes)
-                    self.send_success_message("Homing axes command issued successfully.")
-                except Exception as e:
-                    self._logger.error(f"Error homing axes: {e}")
-                    self.send_error_message(f"Error homing axes: {e}")
-                self._logger.info(f"Homing axes: {', '.join(axes)}.")
-            else:
-                self._logger.error(f"Invalid axes specified for homing: {axes}")
-                self.send_error_message(f"Invalid axes specified for homing: {axes}")
-        
+            self._logger.info(f"File does not exist: {file_name}")
+            self.send_error_message(f"File does not exist: {file_name}", ctx)
+
+    def _enqueue_job(self, ctx):
+        job, position = self.job_queue.enqueue(ctx.parameters["url"], sha256=ctx.parameters["sha256"],
+                                               job_id=ctx.parameters["job_id"], request_id=ctx.request_id)
+        self._logger.info(f"Queued job {job['job_id']} at position {position}: {job['url']}")
+
+    def _remove_job(self, ctx):
+        job_id = ctx.parameters["job_id"]
+        if not self.job_queue.remove(job_id):
+            self.send_error_message(f"No queued job with id {job_id}", ctx)
+
+    def _get_queue(self, ctx):
+        self.send_response_message(self.job_queue.snapshot(), ctx)
+
+    def _confirm_bed_clear(self, ctx):
+        job = self.job_queue.confirm_bed_clear()
+        if job is None:
+            self.send_success_message("Bed clear confirmed, the next queued job starts when the printer is idle.", ctx)
         else:
-            self._logger.warning(f"Unknown action for movement_control: {self._currentCommandAction}")
-            self.send_error_message(f"Unknown action for movement_control: {self._currentCommandAction}")
+            self.send_success_message(f"Bed clear confirmed, started queued job {job['job_id']}.", ctx)
 
-    def _handle_camera_control(self, message_data):
-        self._logger.info(f"Processing Printago command - webcam_control::{self._currentCommandAction}")
-        if self._currentCommandAction == "get_providers":
-            try:
-                provider_info = self._get_webcam_provider_info()
-                self.send_response_message(provider_info)
+    def _get_latency_report(self, ctx):
+        report = self.latency.report(key=ctx.parameters["command"], buckets=ctx.parameters["buckets"])
+        self.send_response_message(dict(window=self.latency.window, commands=report), ctx)
 
-                self._logger.info(f"Webcam providers sent to Printago: {len(provider_info)}")
-            except Exception as e:
-                self._logger.error(f"Error getting webcam providers: {e}")
-                self.send_error_message(f"Error getting webcam providers: {e}")
-        
-        elif self._currentCommandAction == "snapshot":
-            params = self._currentCommandParameters
-            
-            if 'camera_provider_id' not in params or 'camera_name' not in params:
-                self._logger.error("No webcam provider or name specified for webcam snapshot.")
-                self.send_error_message("No webcam provider or name specified for webcam snapshot.")
-                return
-            
-            camera_provider_id = params['camera_provider_id']
-            camera_name = params['camera_name']
+    def on_transfer_finished(self, transfer):
+        # a slot in the transfer queue is free again, which queued jobs may be waiting for
+        self.job_queue.prefetch()
+
+    def on_printer_idle(self):
+        if self.job_queue.bed_clear:
+            self._executor.submit(LANE_DEFAULT, self.job_queue.start_next)
+
+    def _prefetch_rate_limit(self):
+        # only hold back while a print is being streamed over serial
+        if self._printer.is_printing():
+            return self._settings.get_int(["printago", "prefetch_max_rate"]) or None
+        return None
+
+    ##~~ temperature_control
+
+    def _set_hotend(self, ctx):
+        target_temp = ctx.parameters["temperature"]
+        tool = ctx.parameters["tool"]
+
+        try:
+            with ctx.trace.printer_call():
+                self._printer.set_temperature(f"tool{tool}", target_temp)
+            self.send_success_message("Hotend temperature command issued successfully.", ctx)
+        except Exception as e:
+            self._logger.error(f"Error setting hotend temperature: {e}")
+            self.send_error_message(f"Error setting hotend temperature: {e}", ctx)
+        self._logger.info(f"Setting hotend {tool} temperature to {target_temp}°C.")
+
+    def _set_bed(self, ctx):
+        target_temp = ctx.parameters["temperature"]
+
+        try:
+            with ctx.trace.printer_call():
+                self._printer.set_temperature("bed", target_temp)
+            self.send_success_message("Bed temperature command issued successfully.", ctx)
+        except Exception as e:
+            self._logger.error(f"Error setting bed temperature: {e}")
+            self.send_error_message(f"Error setting bed temperature: {e}", ctx)
+        self._logger.info(f"Setting bed temperature to {target_temp}°C.")
+
+    def _get_temperature_history(self, ctx):
+        points = ctx.parameters["points"]
+        if points < 2:
+            self.send_error_message("At least 2 points are required for temperature history.", ctx)
+            return
+
+        history = self.plugin.temperature_history.query(points=points,
+                                                        heaters=ctx.parameters["heaters"],
+                                                        since=ctx.parameters["since"])
+        self.send_response_message(dict(history=history), ctx)
+
+    ##~~ movement_control
+
+    def _jog(self, ctx):
+        axes_data = ctx.parameters["axes"]
+        relative = ctx.parameters["relative"]
+        speed = ctx.parameters["speed"]
+        tags = set(ctx.parameters["tags"])
+
+        try:
+            with ctx.trace.printer_call():
+                self._printer.jog(axes=axes_data, relative=relative, speed=speed, tags=tags)
+            self.send_success_message("Jogging axes command issued successfully.", ctx)
+        except Exception as e:
+            self._logger.error(f"Error jogging axes: {e}")
+            self.send_error_message(f"Error jogging axes: {e}", ctx)
+        axes_str = ', '.join([f"{k}={v}" for k, v in axes_data.items()])
+        self._logger.info(f"Jogging axes: {axes_str} with relative={relative} and speed={speed}.")
+
+    def _extrude(self, ctx):
+        amount = ctx.parameters["amount"]
+        speed = ctx.parameters["speed"]
+        tags = set(ctx.parameters["tags"])
+
+        try:
+            with ctx.trace.printer_call():
+                self._printer.extrude(amount=amount, speed=speed, tags=tags)
+            self.send_success_message("Extruding filament command issued successfully.", ctx)
+        except Exception as e:
+            self._logger.error(f"Error extruding: {e}")
+            self.send_error_message(f"Error extruding: {e}", ctx)
+        self._logger.info(f"Extruding {amount}mm of filament at speed={speed}.")
+
+    def _home(self, ctx):
+        axes = ctx.parameters["axes"]
 
+        if isinstance(axes, str):
+            axes = [axis.strip().lower() for axis in axes.split(",") if axis.strip()]
+
+        if not axes:
+            self._logger.error(f"Invalid axes specified for homing: {axes}")
+            self.send_error_message(f"Invalid axes specified for homing: {axes}", ctx)
+            return
+
+        try:
+            with ctx.trace.printer_call():
+                self._printer.home(axes=axes)
+            self.send_success_message("Homing axes command issued successfully.", ctx)
+        except Exception as e:
+            self._logger.error(f"Error homing axes: {e}")
+            self.send_error_message(f"Error homing axes: {e}", ctx)
+        self._logger.info(f"Homing axes: {', '.join(axes)}.")
+
+    ##~~ camera_control
+
+    def _get_providers(self, ctx):
+        try:
+            provider_info = self._get_webcam_provider_info(ctx)
+            self.send_response_message(provider_info, ctx)
+
+            self._logger.info(f"Webcam providers sent to Printago: {len(provider_info)}")
+        except Exception as e:
+            self._logger.error(f"Error getting webcam providers: {e}")
+            self.send_error_message(f"Error getting webcam providers: {e}", ctx)
+
+    def _snapshot(self, ctx):
+        camera_provider_id = ctx.parameters['camera_provider_id']
+        camera_name = ctx.parameters['camera_name']
+        max_dimension = ctx.parameters.get('max_dimension')
+
+        try:
+            capture = self._snapshot_capture(camera_provider_id, camera_name)
+            jpeg_bytes, captured_at, shared = self._snapshot_cache.get((camera_provider_id, camera_name), capture)
+            jpeg_bytes, width, height = downscale_jpeg(jpeg_bytes, max_dimension)
+            self.send_snapshot(jpeg_bytes, ctx, camera_provider_id=camera_provider_id, camera_name=camera_name,
+                               width=width, height=height, captured_at=captured_at, shared=shared)
+        except Exception as e:
+            self._logger.error(f"Error capturing webcam snapshot: {e}")
+            self.send_error_message(f"Error capturing webcam snapshot: {e}", ctx)
+
+    def _snapshot_all(self, ctx):
+        max_dimension = ctx.parameters.get('max_dimension')
+        timeout = ctx.parameters.get('timeout')
+        if timeout is None:
+            timeout = self._settings.get_float(["printago", "snapshot_timeout"])
+
+        cameras = self.webcams.cameras()
+        if not cameras:
+            self._logger.error("No webcams available for snapshots.")
+            self.send_error_message("No webcams available for snapshots.", ctx)
+            return
+
+        with self._snapshot_busy_lock:
+            busy = set(camera for camera in cameras if camera in self._snapshot_busy)
+            self._snapshot_busy.update(camera for camera in cameras if camera not in busy)
+
+        def take(camera, future, expired):
+            camera_provider_id, camera_name = camera
             try:
-                camPlugin = self._plugin_manager.get_plugin(camera_provider_id).implementation
-                self._logger.info(f"Taking webcam snapshot from {type(camPlugin)} - {camera_name}")
-                jpeg_bytes = camPlugin.take_webcam_snapshot(camera_name)
-                jpeg_image = Image.open(io.BytesIO(b"".join(jpeg_bytes)))
-                png_buffer = io.BytesIO()
-                jpeg_image.save(png_buffer, format="PNG")
-                png_bytes = png_buffer.getvalue()
-
-                self.send_success_message("Webcam snapshot command issued successfully.")
+                capture = self._snapshot_capture(camera_provider_id, camera_name)
+                jpeg_bytes, captured_at, shared = self._snapshot_cache.get(camera, capture)
+                jpeg_bytes, width, height = downscale_jpeg(jpeg_bytes, max_dimension)
+                # a capture finishing after its deadline doesn't publish a stale frame
+                if expired.is_set():
+                    future.set_result(None)
+                    return
+                future.set_result(self.send_snapshot(jpeg_bytes, ctx, camera_provider_id=camera_provider_id,
+                                                     camera_name=camera_name, width=width, height=height,
+                                                     captured_at=captured_at, shared=shared))
             except Exception as e:
-                self._logger.error(f"Error capturing webcam snapshot: {e}")
-                self.send_error_message(f"Error capturing webcam snapshot: {e}")
-        
-        else:
-            self._logger.warning(f"Unknown action for webcam_control: {self._currentCommandAction}")
-            self.send_error_message(f"Unknown action for webcam_control: {self._currentCommandAction}")
+                future.set_exception(e)
+            finally:
+                with self._snapshot_busy_lock:
+                    self._snapshot_busy.discard(camera)
+
+        # one thread per camera, each with its own deadline from the moment its capture starts
+        captures = dict()
+        for camera in cameras:
+            if camera in busy:
+                continue
+            future, expired = concurrent.futures.Future(), threading.Event()
+            captures[camera] = (future, expired, time.monotonic() + timeout)
+            threading.Thread(target=take, args=(camera, future, expired), name=f"PrintagoSnapshot-{camera[1]}",
+                             daemon=True).start()
+
+        results = []
+        for camera in cameras:
+            camera_provider_id, camera_name = camera
+            result = dict(camera_provider_id=camera_provider_id, camera_name=camera_name)
+            if camera in busy:
+                result["error"] = "An earlier capture from this camera is still running"
+                results.append(result)
+                continue
+
+            future, expired, deadline = captures[camera]
+            try:
+                result["snapshot_id"] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except concurrent.futures.TimeoutError:
+                expired.set()
+                result["error"] = f"Timed out after {timeout} s"
+            except Exception as e:
+                result["error"] = str(e)
+            results.append(result)
+
+        captured = sum(1 for result in results if "snapshot_id" in result)
+        self._logger.info(f"Captured {captured} of {len(results)} webcams")
+        self.send_response_message(dict(snapshots=results), ctx)
+
+    def _start_stream(self, ctx):
+        camera_provider_id = ctx.parameters['camera_provider_id']
+        camera_name = ctx.parameters['camera_name']
+        max_dimension = ctx.parameters.get('max_dimension')
+        key = (camera_provider_id, camera_name)
+
+        fps = ctx.parameters['fps']
+        max_fps = self._settings.get_float(["printago", "stream_max_fps"])
+        if not 0 < fps <= max_fps:
+            self.send_error_message(f"Stream rate must be between 0 and {max_fps} fps, got {fps}", ctx)
+            return
+
+        change_threshold = ctx.parameters.get('change_threshold')
+        if change_threshold is None:
+            change_threshold = self._settings.get_float(["printago", "stream_change_threshold"])
+
+        try:
+            capture = self._snapshot_capture(camera_provider_id, camera_name)
+        except Exception as e:
+            self._logger.error(f"Error starting webcam stream: {e}")
+            self.send_error_message(f"Error starting webcam stream: {e}", ctx)
+            return
+
+        def capture_frame():
+            # every frame is fresh from the camera, and handed to the snapshot cache so snapshot
+            # requests during a stream reuse it
+            jpeg_bytes = capture()
+            self._snapshot_cache.put(key, jpeg_bytes)
+            return jpeg_bytes
+
+        def publish_frame(jpeg_bytes, frame, skipped):
+            jpeg_bytes, width, height = downscale_jpeg(jpeg_bytes, max_dimension)
+            self.send_snapshot(jpeg_bytes, camera_provider_id=camera_provider_id, camera_name=camera_name,
+                               width=width, height=height, stream_id=stream.stream_id, frame=frame, skipped=skipped,
+                               interval=round(stream.interval, 3))
+
+        stream = FrameStream(capture_frame, publish_frame, self.plugin.get_publish_backlog, fps=fps,
+                             change_threshold=change_threshold,
+                             heartbeat=self._settings.get_float(["printago", "stream_heartbeat"]),
+                             max_backlog=self._settings.get_int(["printago", "stream_max_backlog"]),
+                             logger=self._logger)
+
+        with self._streams_lock:
+            previous = self._streams.pop(key, None)
+            if previous is not None:
+                previous.stop()
+            self._streams[key] = stream
+        stream.start()
+
+        self._logger.info(f"Started webcam stream {stream.stream_id} from {camera_provider_id} - {camera_name} at {fps} fps")
+        self.send_success_message(dict(message="Webcam stream started.", stream_id=stream.stream_id), ctx)
+
+    def _stop_stream(self, ctx):
+        key = (ctx.parameters['camera_provider_id'], ctx.parameters['camera_name'])
+
+        with self._streams_lock:
+            stream = self._streams.pop(key, None)
+        if stream is None:
+            self.send_error_message(f"No webcam stream running for {key[0]} - {key[1]}", ctx)
+            return
+
+        stream.stop()
+        self._logger.info(f"Stopped webcam stream {stream.stream_id}: {stream.frames} frames sent, "
+                          f"{stream.skipped} unchanged and {stream.throttled} throttled frames skipped")
+        self.send_success_message(dict(message="Webcam stream stopped.", stream_id=stream.stream_id,
+                                       frames=stream.frames, skipped=stream.skipped, throttled=stream.throttled), ctx)
+
+    def _snapshot_capture(self, camera_provider_id, camera_name):
+        camPlugin = self.webcams.provider(camera_provider_id)
+        if camPlugin is None:
+            raise ValueError(f"Unknown webcam provider: {camera_provider_id}")
+
+        def capture():
+            self._logger.debug(f"Taking webcam snapshot from {type(camPlugin)} - {camera_name}")
+            return b"".join(camPlugin.take_webcam_snapshot(camera_name))
+
+        return capture
+
+    def send_snapshot(self, jpeg_bytes, ctx=None, **info):
+        """
+        Announces a snapshot with a ``snapshot`` message, then publishes the JPEG as raw
+        bytes in ``chunks`` pieces to ``octoprint/snapshot/<snapshot_id>/<index>``.
+        """
+        snapshot_id = uuid.uuid4().hex
+        chunks = split_chunks(jpeg_bytes, self._snapshot_chunk_size)
+
+        info.update(snapshot_id=snapshot_id, content_type=SNAPSHOT_CONTENT_TYPE, size=len(jpeg_bytes),
+                    sha256=hashlib.sha256(jpeg_bytes).hexdigest(), chunks=len(chunks),
+                    chunk_size=self._snapshot_chunk_size)
+        # every snapshot gets topics of its own, retaining them would pile up on the broker forever
+        self.send_outgoing_message("snapshot", info, request_id=self._request_id(ctx), retained=False)
+
+        for index, chunk in enumerate(chunks):
+            self.plugin.mqtt_publish(f"octoprint/snapshot/{snapshot_id}/{index}", chunk, retained=False,
+                                     raw_data=True)
+        return snapshot_id
 
     ## Various helper functions like _get_webcam_provider_info, download_file, etc. remain unchanged
-    def _get_webcam_provider_info(self):
-        cameraPlugins = self._plugin_manager.get_implementations(octoprint.plugin.WebcamProviderPlugin)
-        provider_info = {}
-
-        for camPlugin in cameraPlugins:
-            provider_entry = {
-                "provider_info": {
-                    "id": camPlugin._identifier,
-                    "name": camPlugin._plugin_name
-                },
-                "webcams": []
-            }
-
-            if hasattr(camPlugin, 'get_webcam_configurations'):
-                webcams = camPlugin.get_webcam_configurations()
-                for webcam in webcams:
-                    compat = getattr(webcam, 'compat', {})
-                    snapshot_url = getattr(compat, 'snapshot', '')
-                    stream_url = getattr(compat, 'stream', '')
-                    
-                    webcam_entry = {
-                        "name": webcam.name,
-                        "can_snapshot": webcam.canSnapshot,
-                        "flipH" : webcam.flipH,
-                        "flipV" : webcam.flipV,
-                        "rotate90" : webcam.rotate90,
-                        "deprecated_snapshot_url" : snapshot_url,
-                        "deprecated_stream_url" : stream_url,
-                    }
-                    provider_entry["webcams"].append(webcam_entry)
-            else:
-                self._logger.warning(f"Provider {camPlugin._identifier} does not have 'get_webcam_configurations' method.")
-
-            provider_info[camPlugin._identifier] = provider_entry
-
-        if not cameraPlugins:    
+    def _get_webcam_provider_info(self, ctx=None):
+        provider_info = self.webcams.providers()
+
+        if not provider_info:
             self._logger.error("No webcam providers found.")
-            self.send_error_message("No webcam providers found.")
+            self.send_error_message("No webcam providers found.", ctx)
 
         return provider_info
-                
-    def download_file(self, url):
-        response = requests.get(url, stream=True)
-        if response.status_code != 200:
-            self._logger.error(f"Failed to download GCODE from {url}")
-            return
 
-        folder_path = "Printago"
-        if not self._file_manager.folder_exists(FileDestinations.LOCAL, folder_path):
-            self._file_manager.add_folder(FileDestinations.LOCAL, folder_path)
-            
-        all_files = self._file_manager.list_files(path=folder_path, recursive=False)
-        
+    def download_file(self, url, sha256=None, progress_callback=None, rate_limit=None, job_id=None, request_id=None):
+        """
+        Returns the path of the downloaded (or cached) file. Every failure is raised as
+        ``DownloadError``; reporting it to ``request_id`` is up to the caller, the transfer
+        worker does so with its ``failed`` state.
+        """
         try:
-            gcode_data = BytesIO(response.content)
-            file_wrapper = FileWrapper(gcode_data)
+            return self._download_file(url, sha256=sha256, progress_callback=progress_callback, rate_limit=rate_limit,
+                                       job_id=job_id, request_id=request_id)
         except Exception as e:
-            self._logger.error(f"Error creating file wrapper: {e}")
-            self.send_error_message(f"Error creating file wrapper: {e}")
-            return
-        
+            if not isinstance(e, DownloadError):
+                e = DownloadError(f"Error storing GCODE from {url}: {e}")
+            self.plugin.metrics.increment("download_failures")
+            self._logger.error(str(e))
+            raise e
+
+    def _download_file(self, url, sha256=None, progress_callback=None, rate_limit=None, job_id=None, request_id=None):
+        folder_path = "Printago"
         file_manager = self._file_manager
         location = FileDestinations.LOCAL
-        
+
         try:
             parsed_url = urlparse(url)
         except Exception as e:
-            self._logger.error(f"Error parsing URL: {e}")
-            self.send_error_message(f"Error parsing URL: {e}")
-            return
-        
-        try: 
-            filename_without_params = os.path.basename(parsed_url.path)
-            filename = f"{folder_path}/{filename_without_params}"
-        except Exception as e:
-            self._logger.error(f"Error creating filename: {e}")
-            self.send_error_message(f"Error creating filename: {e}")
-            return
-        
+            raise DownloadError(f"Error parsing URL: {e}")
+
         try:
-            file_manager.add_file(location, filename, file_wrapper, allow_overwrite=True)
+            display_name = os.path.basename(parsed_url.path)
+            stem, extension = os.path.splitext(display_name)
         except Exception as e:
-            self._logger.error(f"Error adding file: {e}")
-            self.send_error_message(f"Error adding file: {e}")
-            return
-        
-        # If the number of files exceeds the threshold, delete the oldest
+            raise DownloadError(f"Error creating filename: {e}")
+
+        if not file_manager.folder_exists(location, folder_path):
+            file_manager.add_folder(location, folder_path)
+
+        self._reconcile_job_cache(folder_path)
+
+        if sha256:
+            cached = self.job_cache.lookup_sha256(sha256)
+            if cached is not None:
+                self.job_cache.touch(cached)
+                self.plugin.metrics.increment("download_cache_hits", label="sha256")
+                self._logger.info(f"GCODE for {url} is already cached as {cached} (sha256={sha256})")
+                return cached
+
+        # revalidate what we downloaded from this URL before, unless the caller already
+        # told us the content changed
+        etag = None
+        previous = self.job_cache.lookup_url(url)
+        if previous is not None and previous["etag"] and (not sha256 or previous["sha256"] == sha256.lower()):
+            etag = previous["etag"]
+
+        # analyze while the bytes stream in, so OctoPrint doesn't have to read the file again afterwards
+        analyzer = GcodeAnalyzer()
+        started = time.monotonic()
         try:
-            if len(all_files) > self._settings.get(["printago", "max_printago_files"]):
-                oldest_file = min(all_files, key=lambda k: all_files[k]['date'])
-                self._file_manager.remove_file(FileDestinations.LOCAL, oldest_file)
+            tmp_path, digest, size, response_etag = self._stream_to_temp_file(url, progress_callback=progress_callback,
+                                                                              etag=etag, rate_limit=rate_limit,
+                                                                              analyzer=analyzer)
         except Exception as e:
-            self._logger.error(f"Error purging old Printago file: {e}")
-            self.send_error_message(f"Error purging old Printago file: {e}")
-            return
-        
-        self._logger.info(f"Downloaded GCODE from {url} to {filename}")
+            raise DownloadError(f"Failed to download GCODE from {url}: {e}")
+
+        metrics = self.plugin.metrics
+        elapsed = time.monotonic() - started
+        if tmp_path is not None:
+            metrics.increment("downloads")
+            metrics.increment("download_bytes", size)
+            metrics.observe("download_ms", elapsed * 1000)
+            if elapsed > 0:
+                metrics.set("download_throughput_kbps", round(size / 1024 / elapsed, 1))
+
+        if tmp_path is None:
+            self.job_cache.touch(previous["path"])
+            self.plugin.metrics.increment("download_cache_hits", label="etag")
+            self._logger.info(f"GCODE at {url} is unchanged (ETag {etag}), using {previous['path']}")
+            return previous["path"]
 
-    def send_outgoing_message(self, msg_type, data):
+        try:
+            if sha256 and digest != sha256.lower():
+                raise DownloadError(f"Checksum mismatch for {url}: expected {sha256}, got {digest}")
+
+            # stored under the URL's file name, unless that would overwrite different G-code a queued
+            # job or the current print still needs; then the content hash tells the two apart and
+            # OctoPrint shows the original name from the "display" metadata
+            filename = f"{folder_path}/{display_name}"
+            if filename in self._protected_paths():
+                existing = self.job_cache.lookup_path(filename)
+                if existing is None or existing["sha256"] != digest:
+                    filename = f"{folder_path}/{stem}-{digest[:16]}{extension or '.gcode'}"
+
+            analysis = analyzer.finish()
+            try:
+                file_wrapper = DiskFileWrapper(display_name, tmp_path)
+                file_manager.add_file(location, filename, file_wrapper, allow_overwrite=True,
+                                      analysis=GcodeAnalyzer.octoprint_analysis(analysis))
+                if filename != f"{folder_path}/{display_name}":
+                    file_manager.set_additional_metadata(location, filename, "display", display_name,
+                                                         overwrite=True)
+                file_manager.set_additional_metadata(location, filename, "printago_analysis", analysis, overwrite=True)
+            except Exception as e:
+                raise DownloadError(f"Error adding file: {e}")
+        finally:
+            # DiskFileWrapper moves the file into place, so this only cleans up after failures
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self.job_cache.add(filename, url, digest, response_etag, size)
+        self._evict_job_cache(keep={filename}, request_id=request_id)
+
+        self.send_outgoing_message("job_analysis", dict(file_name=filename, url=url, sha256=digest, job_id=job_id,
+                                                        analysis=analysis), request_id=request_id)
+
+        self._logger.info(f"Downloaded GCODE from {url} to {filename} ({size} bytes, sha256={digest})")
+        return filename
+
+    def _reconcile_job_cache(self, folder_path):
+        listing = self._file_manager.list_files(FileDestinations.LOCAL, path=folder_path, recursive=False)
+        files = dict((entry["path"], (entry.get("size") or 0, entry.get("date") or 0))
+                     for entry in listing.get(FileDestinations.LOCAL, {}).values()
+                     if entry.get("type") != "folder")
+        self.job_cache.reconcile(files)
+
+    def _protected_paths(self):
+        """Files of prefetched jobs and of the current print, which must be neither evicted nor overwritten."""
+        paths = self.job_queue.pinned_paths()
+        current_job = self._printer.get_current_job() or {}
+        current_path = (current_job.get("file") or {}).get("path")
+        if current_path:
+            paths.add(current_path)
+        return paths
+
+    def _evict_job_cache(self, keep=(), request_id=None):
+        keep = set(keep) | self._protected_paths()
+
+        for path in self.job_cache.evict(keep=keep):
+            try:
+                self._file_manager.remove_file(FileDestinations.LOCAL, path)
+                self._logger.info(f"Evicted {path} from the Printago job cache")
+            except Exception as e:
+                self._logger.error(f"Error purging old Printago file: {e}")
+                self.send_error_message(f"Error purging old Printago file: {e}", request_id=request_id)
+
+    def _stream_to_temp_file(self, url, progress_callback=None, etag=None, rate_limit=None, analyzer=None):
+        """
+        Returns ``(tmp_path, sha256, size, etag)``, or ``tmp_path`` None if the server
+        answered a conditional request for ``etag`` with 304 Not Modified. ``rate_limit``
+        is asked for the allowed bytes per second after every chunk, and ``analyzer`` is
+        fed every chunk.
+        """
+        headers = {"If-None-Match": etag} if etag else None
+
+        # The temp file lives in the plugin's data folder rather than /tmp, which is
+        # frequently a RAM-backed tmpfs on a Raspberry Pi.
+        fd, tmp_path = tempfile.mkstemp(suffix=".gcode", dir=self.plugin.get_plugin_data_folder())
+        hasher = hashlib.sha256()
+        size = 0
+        limit, window_start, window_bytes = None, time.monotonic(), 0
+
+        try:
+            with os.fdopen(fd, "wb") as f, requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT,
+                                                         headers=headers) as response:
+                if etag and response.status_code == 304:
+                    os.remove(tmp_path)
+                    return None, None, 0, etag
+                if response.status_code != 200:
+                    raise IOError(f"Unexpected HTTP status {response.status_code}")
+                total = int(response.headers.get("Content-Length") or 0) or None
+
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if not chunk:
+                        continue
+                    f.write(chunk)
+                    hasher.update(chunk)
+                    if analyzer is not None:
+                        analyzer.feed(chunk)
+                    size += len(chunk)
+                    if progress_callback is not None:
+                        progress_callback(size, total)
+
+                    if rate_limit is not None:
+                        current = rate_limit()
+                        if current != limit:
+                            limit, window_start, window_bytes = current, time.monotonic(), 0
+                        window_bytes += len(chunk)
+                        if limit:
+                            ahead = window_bytes / limit - (time.monotonic() - window_start)
+                            if ahead > 0:
+                                time.sleep(ahead)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+        return tmp_path, hasher.hexdigest(), size, response.headers.get("ETag")
+
+    def send_outgoing_message(self, msg_type, data, request_id=None, latency=None, retained=None):
         topic = f"octoprint/{msg_type}"
-        printer_id = self._settings.get(["printago_id"])
+        printer_id = self.plugin._publish_plan.printer_id
         message = {
             "type": msg_type,
             "timestamp": datetime.datetime.utcnow().isoformat() + 'Z',
@@ -393,11 +864,34 @@ class CommandHandler:
             "client_type": 'octoprint',
             "data": data
         }
-        self.plugin.mqtt_publish(topic, json.dumps(message))
-        return json.dumps(message)
+        if request_id is not None:
+            message["request_id"] = request_id
+        if latency is not None:
+            message["latency"] = latency
+
+        payload = self.plugin._publish_plan.codec.encode(message)
+        self.plugin.mqtt_publish(topic, payload, retained=retained, raw_data=True)
+        return payload
 
     # Helper methods for sending messages via MQTT
-    def send_printer_status(self, storage=None, path=None, progress=None):
+    def send_printer_status(self, storage=None, path=None, progress=None, ctx=None):
+        message_data = self._collect_printer_status(storage=storage, path=path, progress=progress)
+
+        if self.plugin._publish_plan.status_mode == STATUS_MODE_DELTA:
+            # an explicit status request doubles as the resync request, so it always gets a keyframe
+            message_data = self._status_stream.next_message(message_data, force_keyframe=True)
+
+        self.send_outgoing_message("status", message_data, request_id=self._request_id(ctx))
+
+    def publish_status_update(self):
+        if not self._status_stream.due():
+            return
+
+        message_data = self._status_stream.next_message(self._collect_printer_status())
+        if message_data is not None:
+            self.send_outgoing_message("status", message_data)
+
+    def _collect_printer_status(self, storage=None, path=None, progress=None):
         stateId = self._printer.get_state_id()
         stateString = self._printer.get_state_string()
         stateData = self._printer.get_current_data()
@@ -416,15 +910,36 @@ class CommandHandler:
         }
 
         # Remove None values from the message_data
-        message_data = {k: v for k, v in message_data.items() if v is not None}
-        self.send_outgoing_message("status", message_data)
+        return {k: v for k, v in message_data.items() if v is not None}
 
-    def send_error_message(self, error_data):
+    def send_error_message(self, error_data, ctx=None, request_id=None):
         error_message = {"error": error_data}
-        self.send_outgoing_message("error", error_message)
+        self._send_reply("error", error_message, ctx, request_id)
+
+    def send_success_message(self, successdata, ctx=None, request_id=None):
+        self._send_reply("success", successdata, ctx, request_id)
 
-    def send_success_message(self, successdata):
-        self.send_outgoing_message("success", successdata)
+    def send_response_message(self, response_data, ctx=None, request_id=None):
+        self._send_reply("response", response_data, ctx, request_id)
 
-    def send_response_message(self, response_data):
-        self.send_outgoing_message("response", response_data)
+    def _send_reply(self, msg_type, data, ctx, request_id):
+        if ctx is not None and ctx.replies is not None:
+            # part of a batch, which sends a single aggregated reply at the end
+            ctx.trace.mark_replied()
+            ctx.replies.append((msg_type, data))
+            return
+        self.send_outgoing_message(msg_type, data, request_id=self._request_id(ctx, request_id),
+                                   latency=self._reply_latency(ctx))
+
+    @staticmethod
+    def _reply_latency(ctx):
+        if ctx is None:
+            return None
+        ctx.trace.mark_replied()
+        return ctx.trace.stages()
+
+    @staticmethod
+    def _request_id(ctx, request_id=None):
+        if ctx is not None:
+            return ctx.request_id
+        return request_id
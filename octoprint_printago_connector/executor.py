@@ -0,0 +1,80 @@
+import queue
+import threading
+
+from .tracing import CommandTrace
+
+LANE_URGENT = "urgent"
+LANE_DEFAULT = "default"
+LANE_BULK = "bulk"
+
+
+class CommandContext:
+    """
+    Everything a handler needs to know about one incoming command. Each command gets its
+    own context, so commands running concurrently on different lanes never share state.
+    """
+
+    def __init__(self, command_type, action, parameters, request_id=None, trace=None):
+        self.type = command_type
+        self.action = action
+        self.parameters = parameters
+        self.request_id = request_id
+        self.trace = trace if trace is not None else CommandTrace()
+        # set to a list for commands within a batch, their replies are collected there
+        self.replies = None
+
+    @property
+    def key(self):
+        return f"{self.type}::{self.action}"
+
+    def __repr__(self):
+        return f"CommandContext({self.type}::{self.action}, request_id={self.request_id!r})"
+
+
+class CommandExecutor:
+    """
+    Executes commands off the MQTT network thread. Every lane has its own queue and
+    worker threads, so urgent commands like ``stop_print`` never wait behind slow work
+    such as snapshots. Commands within a single-worker lane run in submission order.
+    """
+
+    DEFAULT_LANES = {
+        LANE_URGENT: 1,
+        LANE_DEFAULT: 1,
+        LANE_BULK: 2,
+    }
+
+    def __init__(self, logger, lanes=None):
+        self._logger = logger
+        self._lanes = dict(lanes or self.DEFAULT_LANES)
+        self._queues = {}
+
+        for lane, workers in self._lanes.items():
+            self._queues[lane] = queue.Queue()
+            for index in range(workers):
+                thread = threading.Thread(target=self._run, args=(self._queues[lane],),
+                                          name=f"PrintagoCommands-{lane}-{index}")
+                thread.daemon = True
+                thread.start()
+
+    def submit(self, lane, func, *args, **kwargs):
+        if lane not in self._queues:
+            lane = LANE_DEFAULT
+        self._queues[lane].put((func, args, kwargs))
+
+    def stop(self):
+        for lane, workers in self._lanes.items():
+            for _ in range(workers):
+                self._queues[lane].put(None)
+
+    def _run(self, lane_queue):
+        while True:
+            item = lane_queue.get()
+            if item is None:
+                break
+
+            func, args, kwargs = item
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                self._logger.exception("Error while executing Printago command")
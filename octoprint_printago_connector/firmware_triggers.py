@@ -0,0 +1,80 @@
+import re
+from collections import namedtuple
+
+# Lines are bucketed by their first few characters, so a line that can't match any
+# trigger costs one slice and one dict lookup. Longer keys split the buckets further,
+# but a trigger prefix shorter than the key caps it.
+MAX_KEY_LENGTH = 8
+
+DEFAULT_FIRMWARE_TRIGGERS = [
+    dict(event="PausedForUser", prefix="echo:busy: paused for user"),
+    dict(event="FilamentRunout", prefix="//action:prompt_begin FilamentRunout"),
+    dict(event="FilamentRunout", prefix="//action:filament_runout"),
+    dict(event="ThermalRunaway", prefix="Error:Thermal Runaway", pattern=r"Heater_ID: (?P<heater>\w+)"),
+    dict(event="ThermalRunaway", prefix="Error:Heating failed", pattern=r"Heater_ID: (?P<heater>\w+)"),
+    dict(event="ThermalRunaway", prefix="Error:MAXTEMP triggered"),
+    dict(event="ThermalRunaway", prefix="Error:MINTEMP triggered"),
+    dict(event="ProbingFailed", prefix="Error:Probing Failed"),
+    dict(event="HostAction", prefix="//action:", pattern=r"//action:(?P<action>\S+)\s*(?P<arguments>.*)"),
+]
+
+
+class FirmwareTrigger(namedtuple("FirmwareTrigger", ("event", "prefix", "pattern"))):
+    __slots__ = ()
+
+    def payload(self, line):
+        """Event payload for a line starting with ``prefix``, or None if ``pattern`` doesn't match."""
+        payload = dict(line=line)
+        if self.pattern is not None:
+            match = self.pattern.search(line)
+            if match is None:
+                return None
+            payload.update(match.groupdict())
+        return payload
+
+
+class FirmwareTriggerMatcher:
+    """
+    Matches firmware lines against a set of prefix triggers. ``match`` returns the
+    triggers whose prefix the line starts with, in configuration order, or an empty
+    tuple for the vast majority of lines that match nothing.
+    """
+
+    def __init__(self, triggers, logger=None):
+        compiled = []
+        for trigger in triggers or ():
+            event = trigger.get("event")
+            prefix = trigger.get("prefix")
+            if not event or not prefix:
+                if logger is not None:
+                    logger.warning(f"Ignoring firmware trigger without event or prefix: {trigger}")
+                continue
+
+            pattern = trigger.get("pattern")
+            try:
+                pattern = re.compile(pattern) if pattern else None
+            except re.error as e:
+                if logger is not None:
+                    logger.warning(f"Ignoring firmware trigger {event} with invalid pattern {pattern}: {e}")
+                continue
+            compiled.append(FirmwareTrigger(event, prefix, pattern))
+
+        self.triggers = tuple(compiled)
+        self._key_length = min([MAX_KEY_LENGTH] + [len(trigger.prefix) for trigger in compiled])
+
+        buckets = dict()
+        for trigger in compiled:
+            buckets.setdefault(trigger.prefix[:self._key_length], []).append(trigger)
+        self._buckets = dict((key, tuple(bucket)) for key, bucket in buckets.items())
+        self.match = self._compile_match(self._buckets.get, self._key_length)
+
+    @staticmethod
+    def _compile_match(lookup, key_length):
+        # a closure over locals saves the attribute lookups on every line
+        def match(line):
+            bucket = lookup(line[:key_length])
+            if bucket is None:
+                return ()
+            return [trigger for trigger in bucket if line.startswith(trigger.prefix)]
+
+        return match
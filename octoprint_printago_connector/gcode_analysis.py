@@ -0,0 +1,394 @@
+import math
+import re
+
+DEFAULT_FILAMENT_DIAMETER = 1.75
+
+# "; key = value" settings PrusaSlicer, SuperSlicer, OrcaSlicer and Bambu Studio write into the file
+SLICER_SETTINGS = {
+    b"estimated printing time (normal mode)": "estimated_time",
+    b"model printing time": "estimated_time",
+    b"total estimated time": "estimated_time",
+    b"filament used [mm]": "filament_mm",
+    b"filament used [g]": "filament_g",
+    b"total filament used [g]": "filament_g",
+    b"total layers count": "layer_count",
+    b"total layer number": "layer_count",
+    b"layer_height": "layer_height",
+    b"first_layer_height": "first_layer_height",
+    b"nozzle_diameter": "nozzle_diameter",
+    b"filament_diameter": "filament_diameter",
+    b"filament_type": "filament_type",
+    b"temperature": "temperature",
+    b"first_layer_temperature": "first_layer_temperature",
+    b"nozzle_temperature": "temperature",
+    b"bed_temperature": "bed_temperature",
+    b"first_layer_bed_temperature": "first_layer_bed_temperature",
+    b"hot_plate_temp": "bed_temperature",
+    b"printer_model": "printer_model",
+}
+
+# ";KEY:value" comments written by Cura
+CURA_SETTINGS = {
+    b"TIME": "estimated_time",
+    b"Filament used": "filament_m",
+    b"Layer height": "layer_height",
+    b"LAYER_COUNT": "layer_count",
+    b"FLAVOR": "flavor",
+    b"TARGET_MACHINE.NAME": "printer_model",
+}
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)\s*([dhms])")
+DURATION_UNITS = dict(d=86400, h=3600, m=60, s=1)
+
+
+def parse_duration(value):
+    """Parses ``1234``, ``1234.5`` or PrusaSlicer's ``1d 2h 3m 4s`` into seconds."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _first_number(value):
+    # multi extruder settings are comma separated, the first tool is what we report
+    try:
+        return float(value.split(",")[0].split(";")[0])
+    except ValueError:
+        return None
+
+
+def _arc_centre(start_x, start_y, end_x, end_y, offsets, clockwise):
+    """Centre of a G2/G3 arc in the XY plane, from its I/J offsets or its R radius like Marlin does."""
+    if b"R" not in offsets:
+        if b"I" not in offsets and b"J" not in offsets:
+            return None
+        return start_x + offsets.get(b"I", 0.0), start_y + offsets.get(b"J", 0.0)
+
+    radius = offsets[b"R"]
+    dx, dy = end_x - start_x, end_y - start_y
+    distance = math.hypot(dx, dy)
+    if distance == 0:
+        return None
+    # a negative R asks for the longer of the two possible arcs
+    height = math.sqrt(max(0.0, (abs(radius) - distance / 2) * (abs(radius) + distance / 2)))
+    side = -1 if clockwise != (radius < 0) else 1
+    return ((start_x + end_x) / 2 - side * height * dy / distance,
+            (start_y + end_y) / 2 + side * height * dx / distance)
+
+
+class _Box:
+    __slots__ = ("min_x", "max_x", "min_y", "max_y", "min_z", "max_z")
+
+    def __init__(self):
+        self.min_x = self.min_y = self.min_z = math.inf
+        self.max_x = self.max_y = self.max_z = -math.inf
+
+    def add(self, x, y, z):
+        if x < self.min_x:
+            self.min_x = x
+        if x > self.max_x:
+            self.max_x = x
+        if y < self.min_y:
+            self.min_y = y
+        if y > self.max_y:
+            self.max_y = y
+        if z < self.min_z:
+            self.min_z = z
+        if z > self.max_z:
+            self.max_z = z
+
+    def area(self):
+        if self.min_x == math.inf:
+            return dict(minX=0, maxX=0, minY=0, maxY=0, minZ=0, maxZ=0)
+        return dict(minX=round(self.min_x, 3), maxX=round(self.max_x, 3), minY=round(self.min_y, 3),
+                    maxY=round(self.max_y, 3), minZ=round(self.min_z, 3), maxZ=round(self.max_z, 3))
+
+    def dimensions(self):
+        area = self.area()
+        return dict(width=round(area["maxX"] - area["minX"], 3), depth=round(area["maxY"] - area["minY"], 3),
+                    height=round(area["maxZ"] - area["minZ"], 3))
+
+
+class GcodeAnalyzer:
+    """
+    Single-pass G-code analysis fed with the raw bytes of a download as they arrive.
+
+    Collects slicer header and footer settings, layer change markers, net extrusion per
+    tool, the first hotend and bed temperatures, and the bounding boxes of extruding and
+    of all moves, G2/G3 arcs included. Lines are processed as bytes and only comments are
+    decoded, which keeps the pass cheap enough to run inline with the download.
+    """
+
+    def __init__(self):
+        self._remainder = b""
+        self._lines = 0
+        self._layers = 0
+
+        self._relative = False
+        self._relative_e = False
+        self._x = self._y = self._z = 0.0
+        self._tool = 0
+        self._e = {0: 0.0}
+        self._extruded = {0: 0.0}
+        self._printing = _Box()
+        self._travel = _Box()
+
+        self._slicer = None
+        self._settings = {}
+        self._temperatures = {}
+
+    def feed(self, data):
+        lines = (self._remainder + data).split(b"\n")
+        self._remainder = lines.pop()
+        for line in lines:
+            self._line(line)
+
+    def finish(self):
+        if self._remainder:
+            self._line(self._remainder)
+            self._remainder = b""
+        return self.result()
+
+    def result(self):
+        settings = self._settings
+        diameter = _first_number(settings.get("filament_diameter", "")) or DEFAULT_FILAMENT_DIAMETER
+        cross_section = math.pi * (diameter / 2) ** 2
+
+        filament = dict((f"tool{tool}", dict(length=round(length, 2),
+                                                     volume=round(length * cross_section / 1000, 3)))
+                        for tool, length in sorted(self._extruded.items()) if length > 0)
+
+        estimated = parse_duration(settings["estimated_time"]) if "estimated_time" in settings else None
+
+        layer_count = self._layers
+        if "layer_count" in settings:
+            layer_count = int(_first_number(settings["layer_count"]) or layer_count)
+
+        temperatures = dict(self._temperatures)
+        for key, setting in (("tool0", "temperature"), ("bed", "bed_temperature")):
+            if key not in temperatures and setting in settings:
+                temperatures[key] = _first_number(settings[setting])
+
+        weight = None
+        if "filament_g" in settings:
+            weight = _first_number(settings["filament_g"])
+
+        return dict(slicer=self._slicer,
+                    printerModel=settings.get("printer_model"),
+                    filamentType=settings.get("filament_type"),
+                    estimatedPrintTime=estimated,
+                    layerCount=layer_count,
+                    layerHeight=_first_number(settings.get("layer_height", "")),
+                    filament=filament,
+                    filamentWeight=weight,
+                    temperatures=temperatures,
+                    printingArea=self._printing.area(),
+                    dimensions=self._printing.dimensions(),
+                    travelArea=self._travel.area(),
+                    travelDimensions=self._travel.dimensions(),
+                    lines=self._lines)
+
+    @staticmethod
+    def octoprint_analysis(result):
+        """
+        The subset of ``result`` in the format of OctoPrint's own analysis. Passed to
+        ``add_file``, it makes OctoPrint skip its analysis pass when the estimated print time
+        is known, and is merged into that pass otherwise.
+        """
+        analysis = dict((key, result[key]) for key in ("filament", "printingArea", "dimensions", "travelArea",
+                                                       "travelDimensions"))
+        if result["estimatedPrintTime"] is not None:
+            analysis["estimatedPrintTime"] = result["estimatedPrintTime"]
+        return analysis
+
+    def _line(self, line):
+        self._lines += 1
+        line = line.strip()
+        if not line:
+            return
+
+        if line[0] == 59:  # ";"
+            self._comment(line[1:].strip())
+            return
+
+        comment = line.find(b";")
+        if comment >= 0:
+            line = line[:comment]
+        parts = line.split()
+        if not parts:
+            return
+        code = parts[0]
+
+        if code == b"G1" or code == b"G0":
+            self._move(parts)
+        elif code == b"G2" or code == b"G3":
+            self._arc(parts, clockwise=code == b"G2")
+        elif code == b"G92":
+            self._set_position(parts)
+        elif code == b"G90":
+            self._relative = self._relative_e = False
+        elif code == b"G91":
+            self._relative = self._relative_e = True
+        elif code == b"M82":
+            self._relative_e = False
+        elif code == b"M83":
+            self._relative_e = True
+        elif code == b"G28":
+            self._home(parts)
+        elif code[0] == 84 and len(code) > 1:  # "T"
+            self._select_tool(code)
+        elif code in (b"M104", b"M109"):
+            self._temperature(parts, f"tool{self._tool}")
+        elif code in (b"M140", b"M190"):
+            self._temperature(parts, "bed")
+
+    def _move(self, parts):
+        x, y, z = self._x, self._y, self._z
+        relative = self._relative
+        delta_e = None
+
+        for part in parts[1:]:
+            axis = part[0]
+            try:
+                value = float(part[1:])
+            except ValueError:
+                continue
+            if axis == 88:  # X
+                x = x + value if relative else value
+            elif axis == 89:  # Y
+                y = y + value if relative else value
+            elif axis == 90:  # Z
+                z = z + value if relative else value
+            elif axis == 69:  # E
+                if self._relative_e:
+                    delta_e = value
+                    self._e[self._tool] += value
+                else:
+                    delta_e = value - self._e[self._tool]
+                    self._e[self._tool] = value
+
+        self._x, self._y, self._z = x, y, z
+        self._travel.add(x, y, z)
+        if delta_e is not None:
+            self._extruded[self._tool] += delta_e
+            if delta_e > 0:
+                self._printing.add(x, y, z)
+        return delta_e
+
+    def _arc(self, parts, clockwise):
+        # endpoint and extrusion work like G1, the bounding boxes also get the points where
+        # the arc crosses the axes through its centre, since those can lie beyond both ends
+        start_x, start_y = self._x, self._y
+        offsets = {}
+        for part in parts[1:]:
+            if part[:1] in (b"I", b"J", b"R"):
+                try:
+                    offsets[part[:1]] = float(part[1:])
+                except ValueError:
+                    continue
+        delta_e = self._move(parts)
+
+        centre = _arc_centre(start_x, start_y, self._x, self._y, offsets, clockwise)
+        if centre is None:
+            return
+        centre_x, centre_y = centre
+        radius = math.hypot(start_x - centre_x, start_y - centre_y)
+        start = math.atan2(start_y - centre_y, start_x - centre_x)
+        end = math.atan2(self._y - centre_y, self._x - centre_x)
+        if clockwise:
+            start, end = end, start
+        sweep = (end - start) % (2 * math.pi) or 2 * math.pi  # same start and end point: a full circle
+
+        for quarter in range(4):
+            angle = quarter * math.pi / 2
+            if (angle - start) % (2 * math.pi) <= sweep:
+                x = centre_x + radius * math.cos(angle)
+                y = centre_y + radius * math.sin(angle)
+                self._travel.add(x, y, self._z)
+                if delta_e is not None and delta_e > 0:
+                    self._printing.add(x, y, self._z)
+
+    def _set_position(self, parts):
+        for part in parts[1:]:
+            axis = part[0]
+            try:
+                value = float(part[1:])
+            except ValueError:
+                continue
+            if axis == 88:
+                self._x = value
+            elif axis == 89:
+                self._y = value
+            elif axis == 90:
+                self._z = value
+            elif axis == 69:
+                self._e[self._tool] = value
+
+    def _home(self, parts):
+        axes = set(part[:1] for part in parts[1:])
+        if not axes & {b"X", b"Y", b"Z"}:
+            axes = {b"X", b"Y", b"Z"}
+        if b"X" in axes:
+            self._x = 0.0
+        if b"Y" in axes:
+            self._y = 0.0
+        if b"Z" in axes:
+            self._z = 0.0
+
+    def _select_tool(self, code):
+        try:
+            tool = int(code[1:])
+        except ValueError:
+            return
+        self._tool = tool
+        self._e.setdefault(tool, 0.0)
+        self._extruded.setdefault(tool, 0.0)
+
+    def _temperature(self, parts, heater):
+        if heater in self._temperatures:
+            return
+        for part in parts[1:]:
+            if part[:1] == b"S":
+                try:
+                    value = float(part[1:])
+                except ValueError:
+                    return
+                if value > 0:
+                    self._temperatures[heater] = value
+                return
+
+    def _comment(self, comment):
+        if comment.startswith(b"LAYER_CHANGE") or comment.startswith(b"LAYER:"):
+            self._layers += 1
+            return
+
+        if self._slicer is None and self._lines < 50:
+            lowered = comment.lower()
+            for marker in (b"generated by ", b"generated with "):
+                if lowered.startswith(marker):
+                    self._slicer = comment[len(marker):].decode("utf-8", "replace").strip()
+                    return
+
+        separator = comment.find(b" = ")
+        if separator > 0:
+            setting = SLICER_SETTINGS.get(comment[:separator].strip())
+            if setting is not None:
+                self._settings[setting] = comment[separator + 3:].decode("utf-8", "replace").strip()
+            return
+
+        separator = comment.find(b":")
+        if separator > 0:
+            setting = CURA_SETTINGS.get(comment[:separator])
+            if setting is not None:
+                value = comment[separator + 1:].decode("utf-8", "replace").strip()
+                if setting == "filament_m":
+                    # Cura reports metres
+                    metres = _first_number(value.rstrip("m"))
+                    if metres is None:
+                        return
+                    setting, value = "filament_mm", str(metres * 1000)
+                self._settings[setting] = value
@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+import time
+
+
+class JobCache:
+    """
+    Index of the G-code files in the Printago folder, keyed by path and looked up by
+    content hash or by source URL and ETag, so a job that is already on disk doesn't
+    have to be downloaded again.
+
+    The folder is bounded by total bytes rather than file count. When it grows past
+    ``max_bytes``, ``evict`` picks the files that were printed (or downloaded) least
+    recently. The index is a small JSON file next to the spool and is written after
+    every change.
+    """
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024, logger=None):
+        self._path = path
+        self._max_bytes = max_bytes
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._entries = {}
+
+        try:
+            with open(path, "r") as f:
+                self._entries = dict((entry["path"], entry) for entry in json.load(f))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            if self._logger is not None:
+                self._logger.warning(f"Could not read the job cache index, starting empty: {e}")
+
+    def lookup_sha256(self, sha256):
+        sha256 = sha256.lower()
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.get("sha256") == sha256:
+                    return entry["path"]
+        return None
+
+    def lookup_url(self, url):
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.get("url") == url:
+                    return dict(entry)
+        return None
+
+    def lookup_path(self, path):
+        with self._lock:
+            entry = self._entries.get(path)
+            return dict(entry) if entry is not None else None
+
+    def add(self, path, url, sha256, etag, size):
+        with self._lock:
+            self._entries[path] = dict(path=path, url=url, sha256=sha256, etag=etag, size=size, last_used=time.time())
+            self._save()
+
+    def touch(self, path):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return
+            entry["last_used"] = time.time()
+            self._save()
+
+    def reconcile(self, files):
+        """
+        Syncs the index with ``files``, ``{path: (size, date)}`` for what is actually in
+        the folder: entries for deleted files are dropped, and files that got there some
+        other way are adopted with their modification date as last use.
+        """
+        with self._lock:
+            changed = False
+            for path in [path for path in self._entries if path not in files]:
+                del self._entries[path]
+                changed = True
+            for path, (size, date) in files.items():
+                entry = self._entries.get(path)
+                if entry is None:
+                    self._entries[path] = dict(path=path, url=None, sha256=None, etag=None, size=size, last_used=date)
+                    changed = True
+                elif entry["size"] != size:
+                    # replaced behind our back, the hash and ETag no longer describe it
+                    entry.update(size=size, sha256=None, etag=None)
+                    changed = True
+            if changed:
+                self._save()
+
+    def evict(self, keep=()):
+        """
+        Removes the least recently used entries until the folder fits ``max_bytes`` and
+        returns their paths for the caller to delete. Paths in ``keep`` are never evicted.
+        """
+        with self._lock:
+            total = sum(entry["size"] for entry in self._entries.values())
+            if total <= self._max_bytes:
+                return []
+
+            evicted = []
+            candidates = sorted((entry for entry in self._entries.values() if entry["path"] not in keep),
+                                key=lambda entry: entry["last_used"] or 0)
+            for entry in candidates:
+                if total <= self._max_bytes:
+                    break
+                total -= entry["size"]
+                evicted.append(entry["path"])
+                del self._entries[entry["path"]]
+
+            self._save()
+            return evicted
+
+    @property
+    def total_size(self):
+        with self._lock:
+            return sum(entry["size"] for entry in self._entries.values())
+
+    def _save(self):
+        tmp_path = self._path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(list(self._entries.values()), f)
+            os.replace(tmp_path, self._path)
+        except Exception as e:
+            if self._logger is not None:
+                self._logger.warning(f"Could not write the job cache index: {e}")
@@ -0,0 +1,180 @@
+import json
+import os
+import threading
+import uuid
+
+from octoprint.filemanager import FileDestinations
+
+JOB_QUEUED = "queued"
+JOB_PREFETCHING = "prefetching"
+JOB_READY = "ready"
+
+
+class JobQueue:
+    """
+    Persistent local queue of print jobs.
+
+    The next ``prefetch`` jobs are downloaded in the background through the transfer
+    worker while the current print runs, limited to ``rate_limit()`` bytes per second so
+    the download doesn't compete with serial streaming. Once Printago confirms the bed is
+    clear (``confirm_bed_clear``), the first job is started as soon as the printer is
+    idle: right away if it already is, otherwise as soon as the printer reports Operational
+    again after the current print. Each confirmation starts a single job.
+
+    Jobs are reported as ``queue`` messages with the states ``queued``, ``ready``,
+    ``started``, ``failed`` and ``removed``; downloads additionally produce the usual
+    ``transfer`` messages with the same ``job_id``.
+    """
+
+    def __init__(self, handler, path, prefetch=2, rate_limit=None):
+        self._handler = handler
+        self._logger = handler._logger
+        self._path = path
+        self._prefetch = prefetch
+        self._rate_limit = rate_limit
+        self._lock = threading.RLock()
+        self._jobs = []
+        self._bed_clear = False
+
+        try:
+            with open(path, "r") as f:
+                state = json.load(f)
+            # a bed clear confirmation isn't restored, the bed may well be occupied after a restart
+            self._jobs = state.get("jobs", [])
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self._logger.warning(f"Could not read the job queue, starting empty: {e}")
+
+        for job in self._jobs:
+            # downloads don't survive a restart, and prefetched files may have been removed meanwhile
+            if job["state"] == JOB_PREFETCHING or (
+                    job["state"] == JOB_READY
+                    and not handler._file_manager.file_exists(FileDestinations.LOCAL, job["file_name"])):
+                job["state"] = JOB_QUEUED
+                job["file_name"] = None
+
+    def enqueue(self, url, sha256=None, job_id=None, request_id=None):
+        job = dict(job_id=job_id or uuid.uuid4().hex, url=url, sha256=sha256, request_id=request_id,
+                   state=JOB_QUEUED, file_name=None)
+        with self._lock:
+            self._jobs.append(job)
+            position = len(self._jobs)
+            self._save()
+
+        self._send_state(job, JOB_QUEUED, position=position)
+        self.prefetch()
+        return job, position
+
+    def remove(self, job_id):
+        with self._lock:
+            job = self._find(job_id)
+            if job is None:
+                return False
+            self._jobs.remove(job)
+            self._save()
+
+        self._send_state(job, "removed")
+        self.prefetch()
+        return True
+
+    def snapshot(self):
+        with self._lock:
+            return dict(bed_clear=self._bed_clear,
+                        jobs=[dict(job_id=job["job_id"], url=job["url"], state=job["state"], file_name=job["file_name"])
+                              for job in self._jobs])
+
+    @property
+    def bed_clear(self):
+        return self._bed_clear
+
+    def pinned_paths(self):
+        """Files of prefetched jobs, which the job cache must not evict."""
+        with self._lock:
+            return set(job["file_name"] for job in self._jobs if job["file_name"])
+
+    def confirm_bed_clear(self):
+        with self._lock:
+            self._bed_clear = True
+        return self.start_next()
+
+    def start_next(self):
+        """Starts the first job if the bed is clear, the printer idle and the file ready."""
+        printer = self._handler._printer
+        with self._lock:
+            if not self._bed_clear or not self._jobs or self._jobs[0]["state"] != JOB_READY:
+                return None
+            if not printer.is_operational() or printer.is_printing() or printer.is_paused():
+                return None
+
+            job = self._jobs.pop(0)
+            self._bed_clear = False
+            self._save()
+
+        try:
+            printer.select_file(job["file_name"], sd=False, printAfterSelect=True)
+        except Exception as e:
+            self._logger.error(f"Error starting queued job {job['job_id']}: {e}")
+            self._send_state(job, "failed", error=str(e))
+        else:
+            self._logger.info(f"Started queued job {job['job_id']}: {job['file_name']}")
+            self._send_state(job, "started", file_name=job["file_name"])
+
+        self.prefetch()
+        return job
+
+    def prefetch(self):
+        with self._lock:
+            pending = []
+            for job in self._jobs[:self._prefetch]:
+                if job["state"] == JOB_QUEUED:
+                    job["state"] = JOB_PREFETCHING
+                    pending.append(job)
+            if pending:
+                self._save()
+
+        for job in pending:
+            transfer = self._handler.transfer_worker.submit(job["url"], sha256=job["sha256"], job_id=job["job_id"],
+                                                            request_id=job["request_id"], on_done=self._on_prefetched,
+                                                            rate_limit=self._rate_limit)
+            if transfer is None:
+                # transfer queue is full, tried again whenever a transfer finishes
+                with self._lock:
+                    job["state"] = JOB_QUEUED
+                    self._save()
+
+    def _on_prefetched(self, transfer, filename):
+        with self._lock:
+            job = self._find(transfer.job_id)
+            if job is None:
+                # removed while downloading
+                return
+            if filename is None:
+                self._jobs.remove(job)
+            else:
+                job["state"] = JOB_READY
+                job["file_name"] = filename
+            self._save()
+
+        if filename is None:
+            self._send_state(job, "failed", error="Download failed")
+        else:
+            self._send_state(job, JOB_READY, file_name=filename)
+            self.start_next()
+        self.prefetch()
+
+    def _find(self, job_id):
+        return next((job for job in self._jobs if job["job_id"] == job_id), None)
+
+    def _save(self):
+        tmp_path = self._path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(dict(jobs=self._jobs), f)
+            os.replace(tmp_path, self._path)
+        except Exception as e:
+            self._logger.warning(f"Could not write the job queue: {e}")
+
+    def _send_state(self, job, state, **data):
+        data.update(job_id=job["job_id"], url=job["url"], state=state)
+        self._handler.send_outgoing_message("queue", data, request_id=job["request_id"])
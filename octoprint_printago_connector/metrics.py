@@ -0,0 +1,173 @@
+import bisect
+import re
+import threading
+import time
+from collections import deque
+
+# upper bounds in milliseconds, the last bucket counts everything above
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# snapshot ids and chunk indices would give every message its own topic
+_TOPIC_ID_SEGMENT = re.compile(r"(?<=/)(?:[0-9a-f]{32}|\d+)(?=/|$)")
+
+
+def topic_key(topic):
+    """Collapses id and index levels of a topic into ``+``, e.g. ``octoprint/snapshot/+/+``."""
+    return _TOPIC_ID_SEGMENT.sub("+", topic)
+
+
+class Histogram:
+    """Fixed-bucket histogram: one bisect and a few additions per observation."""
+
+    __slots__ = ("bounds", "counts", "count", "total", "max")
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """
+        Upper bound of the bucket holding the given fraction of observations, capped at the
+        largest observation.
+        """
+        if not self.count:
+            return None
+        threshold = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= threshold:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.max > self.max:
+            self.max = other.max
+
+    def to_dict(self, buckets=True):
+        result = dict(count=self.count,
+                      mean=round(self.total / self.count, 3) if self.count else None,
+                      max=round(self.max, 3),
+                      p50=self.percentile(0.5),
+                      p95=self.percentile(0.95),
+                      p99=self.percentile(0.99))
+        if buckets:
+            result["buckets"] = dict(zip([str(bound) for bound in self.bounds] + ["+Inf"], self.counts))
+        return result
+
+
+class RollingHistogram:
+    """
+    Histogram over roughly the last ``window`` seconds, kept as ``slices`` fixed-bucket
+    histograms of ``window / slices`` seconds each. Observations go into the current slice,
+    and ``merged`` adds up the slices that haven't expired yet. Not thread-safe by itself.
+    """
+
+    __slots__ = ("bounds", "_slice_length", "_slices")
+
+    def __init__(self, window=3600, slices=6, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self._slice_length = window / slices
+        self._slices = deque(maxlen=slices)
+
+    def observe(self, value, now=None):
+        index = int((time.monotonic() if now is None else now) // self._slice_length)
+        if not self._slices or self._slices[-1][0] != index:
+            self._slices.append((index, Histogram(self.bounds)))
+        self._slices[-1][1].observe(value)
+
+    def merged(self, now=None):
+        oldest = int((time.monotonic() if now is None else now) // self._slice_length) - self._slices.maxlen + 1
+        result = Histogram(self.bounds)
+        for index, histogram in self._slices:
+            if index >= oldest:
+                result.merge(histogram)
+        return result
+
+
+class Metrics:
+    """
+    Counters and latency histograms for the hot paths of the plugin.
+
+    Recording takes a lock and a couple of dict operations; everything expensive, such as
+    percentiles and collecting gauges, happens in ``snapshot``. Counters and histograms
+    are keyed by name and an optional label (a topic, an action, ...), and only grow with
+    the number of distinct labels.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def increment(self, name, value=1, label=None):
+        key = (name, label)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, label=None):
+        key = (name, label)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def set(self, name, value, label=None):
+        with self._lock:
+            self._gauges[(name, label)] = value
+
+    def register_gauge(self, name, func):
+        """Registers ``func`` to be called for the current value of ``name`` on every snapshot."""
+        with self._lock:
+            self._gauges[(name, None)] = func
+
+    def snapshot(self):
+        """
+        Returns ``{"uptime", "counters", "histograms", "gauges"}``. Labelled values are nested
+        one level deeper: ``counters["published"]["octoPrint/temperature/tool0"]``.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = dict((key, histogram.to_dict()) for key, histogram in self._histograms.items())
+            gauges = dict(self._gauges)
+
+        for key, value in gauges.items():
+            if callable(value):
+                try:
+                    gauges[key] = value()
+                except Exception:
+                    gauges[key] = None
+
+        return dict(uptime=round(time.time() - self._started, 1),
+                    counters=self._nest(counters),
+                    histograms=self._nest(histograms),
+                    gauges=self._nest(gauges))
+
+    @staticmethod
+    def _nest(values):
+        result = {}
+        for (name, label), value in values.items():
+            if label is None:
+                result[name] = value
+            else:
+                nested = result.setdefault(name, {})
+                if isinstance(nested, dict):
+                    nested[label] = value
+        return result
@@ -0,0 +1,95 @@
+import threading
+import time
+
+
+def compute_progress(print_job_progress):
+    progress = 0
+
+    if print_job_progress.get("completion") is not None:
+        progress = round(float(print_job_progress["completion"]))
+    if print_job_progress.get("printTimeLeftOrigin") == "genius" and print_job_progress.get("printTimeLeft") is not None:
+        print_time = float(print_job_progress.get("printTime") or 0)
+        total = print_time + float(print_job_progress["printTimeLeft"])
+        if total > 0:
+            progress = round(print_time / total * 100)
+
+    return progress
+
+
+class ProgressThrottle:
+    """
+    Publishes progress updates pushed by OctoPrint whenever the file or the progress
+    value changes, at most once per interval.
+
+    A change after a quiet period goes out immediately. Changes arriving within the
+    interval are held back, and the newest one is published when the interval expires
+    (trailing-edge flush), so the final state is never lost. The interval doubles up to
+    ``max_interval`` each time changes have to be held back, and drops back to
+    ``min_interval`` once progress has been quiet for a full interval.
+    """
+
+    def __init__(self, publish, min_interval=1.0, max_interval=10.0):
+        self._publish = publish
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._interval = min_interval
+
+        self._lock = threading.Lock()
+        self._last = dict(location=None, path=None, progress=-1)
+        self._last_publish = 0
+        self._pending = None
+        self._timer = None
+
+    def update(self, location, path, progress, printer_data=None, force=False):
+        data = dict(location=location, path=path, progress=progress)
+        if printer_data is not None:
+            data["printer_data"] = printer_data
+
+        with self._lock:
+            if not force and self._last["path"] == path and self._last["progress"] == progress:
+                # back to what was published last, nothing left to flush
+                self._pending = None
+                return
+
+            remaining = self._last_publish + self._interval - time.monotonic()
+            if force or remaining <= 0:
+                if remaining <= -self._interval:
+                    self._interval = self._min_interval
+                self._cancel_timer()
+                self._pending = None
+                self._mark_published(data)
+            else:
+                self._pending = data
+                if self._timer is None:
+                    self._interval = min(self._interval * 2, self._max_interval)
+                    self._timer = threading.Timer(remaining, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+
+        self._publish(data)
+
+    def flush(self):
+        with self._lock:
+            self._cancel_timer()
+            data = self._pending
+            self._pending = None
+            if data is None:
+                return
+            self._mark_published(data)
+
+        self._publish(data)
+
+    def cancel(self):
+        with self._lock:
+            self._cancel_timer()
+            self._pending = None
+
+    def _mark_published(self, data):
+        self._last = data
+        self._last_publish = time.monotonic()
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
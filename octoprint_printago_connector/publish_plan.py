@@ -0,0 +1,90 @@
+from collections import namedtuple
+from types import MappingProxyType
+
+from .codec import PayloadCodec
+from .firmware_triggers import FirmwareTriggerMatcher
+
+TOPIC_TYPES = ("event", "progress", "temperature", "metadata", "lw")
+
+
+def compile_metadata_key(key):
+    """
+    Returns an accessor for a metadata key such as ``slicer.layer_height``, resolving
+    the dotted path against a file's metadata in one go.
+    """
+    parts = tuple(key.split("."))
+
+    def get(metadata):
+        value = metadata
+        for part in parts:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(part)
+        return value
+
+    return get
+
+
+def compile_metadata_keys(setting):
+    # dict.fromkeys drops duplicates but keeps the configured order
+    keys = dict.fromkeys(key.strip() for key in (setting or "").split(",") if key.strip())
+    return tuple((key, compile_metadata_key(key)) for key in keys)
+
+
+class PublishPlan(namedtuple("PublishPlan", ("topics", "events", "unclassified_active", "retain", "lw_active",
+                                             "lw_retain", "timestamp_fieldname", "temperature_threshold",
+                                             "temperature_mode", "temperature_window", "temperature_heartbeat",
+                                             "printer_data", "printer_id", "status_mode", "codec", "metadata_active",
+                                             "metadata_keys", "firmware_triggers"))):
+    """
+    Immutable snapshot of everything the publish hot path needs from the settings. It is
+    rebuilt on startup and whenever settings are saved, so publishing an event, a
+    temperature sample or a progress tick doesn't have to read the settings at all.
+    """
+
+    __slots__ = ()
+
+    def get_topic(self, topic_type):
+        return self.topics.get(topic_type)
+
+    def is_event_active(self, event):
+        return self.events.get(event, self.unclassified_active)
+
+
+def build_publish_plan(settings, event_class_to_event_list, logger=None):
+    base_topic = settings.get(["publish", "baseTopic"])
+
+    topics = dict()
+    for topic_type in TOPIC_TYPES:
+        sub_topic = settings.get(["publish", topic_type + "Topic"])
+        topic_active = settings.get(["publish", topic_type + "Active"])
+        topics[topic_type] = base_topic + sub_topic if sub_topic and topic_active else None
+
+    events = dict()
+    for event_class, class_events in event_class_to_event_list.items():
+        active = settings.get_boolean(["publish", "events", event_class])
+        for event in class_events:
+            # first class wins, same as the linear scan this replaces
+            events.setdefault(event, active)
+
+    return PublishPlan(topics=MappingProxyType(topics),
+                       events=MappingProxyType(events),
+                       unclassified_active=settings.get_boolean(["publish", "events", "unclassified"]),
+                       retain=settings.get_boolean(["broker", "retain"]),
+                       lw_active=settings.get_boolean(["publish", "lwActive"]),
+                       lw_retain=settings.get_boolean(["broker", "lwRetain"]),
+                       timestamp_fieldname=settings.get(["timestamp_fieldname"]),
+                       temperature_threshold=settings.get_float(["publish", "temperatureThreshold"]),
+                       temperature_mode=settings.get(["publish", "temperatureMode"]),
+                       temperature_window=settings.get_float(["publish", "temperatureWindow"]),
+                       temperature_heartbeat=settings.get_float(["publish", "temperatureHeartbeat"]),
+                       printer_data=settings.get_boolean(["publish", "printerData"]),
+                       printer_id=settings.get(["printago_id"]),
+                       status_mode=settings.get(["printago", "status_mode"]),
+                       codec=PayloadCodec(settings.get(["publish", "codec"]),
+                                          compress_threshold=settings.get_int(["publish", "compressThreshold"]),
+                                          logger=logger),
+                       metadata_active=settings.get_boolean(["publish", "metadataActive"]),
+                       metadata_keys=compile_metadata_keys(settings.get(["publish", "metadataKeys"])),
+                       firmware_triggers=FirmwareTriggerMatcher(settings.get(["publish", "firmwareTriggers"]),
+                                                                logger=logger))
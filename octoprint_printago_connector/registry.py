@@ -0,0 +1,109 @@
+from .executor import LANE_DEFAULT
+
+NUMBER = (int, float)
+
+
+class CommandValidationError(ValueError):
+    pass
+
+
+class UnknownCommandError(LookupError):
+    pass
+
+
+class Param:
+    """
+    Schema entry for one command parameter. ``types`` is a type or tuple of types the
+    value must be an instance of; ``bool`` values are only accepted if ``bool`` is listed
+    explicitly, even though it is a subclass of ``int``.
+    """
+
+    def __init__(self, name, types=None, required=False, default=None):
+        self.name = name
+        self.types = types if types is None or isinstance(types, tuple) else (types,)
+        self.required = required
+        self.default = default
+
+
+def _type_names(types):
+    return " or ".join(t.__name__ for t in types)
+
+
+def compile_validator(command_type, action, params):
+    """
+    Turns a parameter schema into a single closure, so the per-command cost is a loop
+    over precomputed tuples instead of re-interpreting the schema on every message.
+    """
+
+    label = f"{command_type}::{action}"
+    checks = tuple((param.name,
+                    param.types,
+                    param.types is not None and bool not in param.types,
+                    _type_names(param.types) if param.types else None,
+                    param.required,
+                    param.default) for param in params)
+
+    def validate(parameters):
+        # parameters come fresh out of json.loads, so defaults are filled in place
+        if not isinstance(parameters, dict):
+            raise CommandValidationError(f"Parameters for {label} must be an object")
+
+        for name, types, reject_bool, type_names, required, default in checks:
+            value = parameters.get(name)
+            if value is None:
+                if required:
+                    raise CommandValidationError(f"Missing required parameter '{name}' for {label}")
+                # copy mutable defaults so handlers can't leak state between commands
+                parameters[name] = default.copy() if isinstance(default, (dict, list)) else default
+                continue
+
+            if types is not None and (not isinstance(value, types) or (reject_bool and isinstance(value, bool))):
+                raise CommandValidationError(f"Invalid parameter '{name}' for {label}: expected {type_names}, "
+                                             f"got {type(value).__name__}")
+        return parameters
+
+    return validate
+
+
+class CommandSpec:
+    def __init__(self, command_type, action, handler, params=(), lane=LANE_DEFAULT):
+        self.type = command_type
+        self.action = action
+        self.handler = handler
+        self.lane = lane
+        self.validate = compile_validator(command_type, action, params)
+
+
+class CommandRegistry:
+    """
+    Maps ``(type, action)`` to a :class:`CommandSpec`. Lookups are a single dict access,
+    and plugins can add actions through the ``register_command`` helper.
+    """
+
+    def __init__(self):
+        self._specs = {}
+        self._types = set()
+
+    def register(self, command_type, action, handler, params=(), lane=LANE_DEFAULT):
+        spec = CommandSpec(command_type, action, handler, params=params, lane=lane)
+        self._specs[(command_type, action)] = spec
+        self._types.add(command_type)
+        return spec
+
+    def unregister(self, command_type, action):
+        self._specs.pop((command_type, action), None)
+        self._types = {key[0] for key in self._specs}
+
+    def lookup(self, command_type, action):
+        spec = self._specs.get((command_type, action))
+        if spec is None:
+            if command_type not in self._types:
+                raise UnknownCommandError(f"Unknown Printago command type: {command_type}")
+            raise UnknownCommandError(f"Unknown action for {command_type}: {action}")
+        return spec
+
+    def __contains__(self, key):
+        return key in self._specs
+
+    def __len__(self):
+        return len(self._specs)
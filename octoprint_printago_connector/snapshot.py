@@ -0,0 +1,104 @@
+import io
+import threading
+import time
+
+from PIL import Image
+
+SNAPSHOT_CONTENT_TYPE = "image/jpeg"
+
+
+def downscale_jpeg(data, max_dimension, quality=85):
+    """
+    Shrinks a JPEG so neither side exceeds ``max_dimension``. Images that already fit are
+    returned untouched, without being decoded. Returns ``(data, width, height)``.
+    """
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    if not max_dimension or max(width, height) <= max_dimension:
+        return data, width, height
+
+    # let the JPEG decoder scale by 1/2, 1/4 or 1/8 while decoding, which is far cheaper
+    # than decoding at full resolution and resizing afterwards
+    image.draft("RGB", (max_dimension, max_dimension))
+    image.thumbnail((max_dimension, max_dimension))
+
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue(), image.width, image.height
+
+
+def split_chunks(data, chunk_size):
+    return [data[offset:offset + chunk_size] for offset in range(0, len(data), chunk_size)] or [b""]
+
+
+class _PendingCapture:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SnapshotCache:
+    """
+    Per-camera snapshot cache. A snapshot is reused for ``ttl`` seconds, and requests for
+    a camera that is being captured right now wait for that capture instead of starting
+    their own, so a burst of requests costs the webcam a single frame.
+    """
+
+    def __init__(self, ttl=2.0):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._pending = {}
+
+    def get(self, key, capture):
+        """
+        Returns ``(data, captured_at, shared)``, where ``shared`` tells whether the frame
+        was taken for an earlier or concurrent request.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self._ttl:
+                return entry[1], entry[2], True
+
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._pending[key] = _PendingCapture()
+
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value[0], pending.value[1], True
+
+        try:
+            data = capture()
+            captured_at = time.time()
+            pending.value = (data, captured_at)
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+                if pending.error is None:
+                    self._prune(time.monotonic())
+                    self._entries[key] = (time.monotonic(), data, captured_at)
+            pending.done.set()
+
+        return data, captured_at, False
+
+    def put(self, key, data):
+        """Stores a frame captured elsewhere, such as by a stream, for later requests to reuse."""
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            self._entries[key] = (now, data, time.time())
+
+    def _prune(self, now):
+        for key in [key for key, entry in self._entries.items() if now - entry[0] >= self._ttl]:
+            del self._entries[key]
@@ -0,0 +1,242 @@
+import sqlite3
+import threading
+import time
+
+
+class PublishSpool:
+    """
+    Disk-backed queue for messages published while the broker is unreachable.
+
+    Messages live in a small SQLite database, so memory use stays flat during long
+    outages and the backlog survives a restart. The spool is bounded by total payload
+    bytes and by message age; when a limit is exceeded the oldest messages are dropped
+    first. Messages appended with ``coalesce=True`` (retained-style state such as
+    temperatures or progress) replace any older message on the same topic, all other
+    messages are kept in order.
+    """
+
+    def __init__(self, path, max_bytes=5 * 1024 * 1024, max_age=24 * 60 * 60, logger=None):
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._logger = logger
+        self._lock = threading.RLock()
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS messages ("
+                         "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "topic TEXT NOT NULL, "
+                         "payload BLOB, "
+                         "qos INTEGER NOT NULL DEFAULT 0, "
+                         "retain INTEGER NOT NULL DEFAULT 0, "
+                         "coalesce_key TEXT UNIQUE, "
+                         "created REAL NOT NULL, "
+                         "size INTEGER NOT NULL)")
+
+        count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM messages").fetchone()
+        self._count = count
+        self._size = size
+
+    def append(self, topic, payload, qos=0, retain=False, coalesce=False):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        elif isinstance(payload, (int, float)):
+            # raw numeric payloads, paho would have sent them as text too
+            payload = str(payload).encode("utf-8")
+        size = len(payload) if payload is not None else 0
+        now = time.time()
+
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                if coalesce:
+                    previous = self._db.execute("SELECT size FROM messages WHERE coalesce_key = ?",
+                                                (topic,)).fetchone()
+                    if previous is not None:
+                        self._db.execute("DELETE FROM messages WHERE coalesce_key = ?", (topic,))
+                        self._count -= 1
+                        self._size -= previous[0]
+
+                self._db.execute("INSERT INTO messages (topic, payload, qos, retain, coalesce_key, created, size) "
+                                 "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 (topic, payload, qos, int(bool(retain)), topic if coalesce else None, now, size))
+                self._count += 1
+                self._size += size
+
+                self._enforce_limits(now)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                self._reload_totals()
+                raise
+
+    def peek(self, limit=100):
+        """Returns up to ``limit`` of the oldest messages as ``(id, topic, payload, qos, retain)`` tuples."""
+        with self._lock:
+            rows = self._db.execute("SELECT id, topic, payload, qos, retain FROM messages ORDER BY id LIMIT ?",
+                                    (limit,)).fetchall()
+        return [(entry_id, topic, payload, qos, bool(retain)) for entry_id, topic, payload, qos, retain in rows]
+
+    def discard_coalesced(self, topic):
+        """Drops a spooled retained-style message that a live publish on the same topic just superseded."""
+        with self._lock:
+            if self._db.execute("DELETE FROM messages WHERE coalesce_key = ?", (topic,)).rowcount > 0:
+                self._reload_totals()
+
+    def remove(self, ids):
+        ids = list(ids)
+        if not ids:
+            return
+
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                for offset in range(0, len(ids), 500):
+                    chunk = ids[offset:offset + 500]
+                    self._db.execute(f"DELETE FROM messages WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            finally:
+                self._reload_totals()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @property
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return self._count
+
+    def _enforce_limits(self, now):
+        if self._max_age:
+            # rows are ordered by insertion, so only look further if the oldest one has expired
+            oldest = self._db.execute("SELECT created FROM messages ORDER BY id LIMIT 1").fetchone()
+            if oldest is not None and oldest[0] < now - self._max_age:
+                self._drop("DELETE FROM messages WHERE created < ?", (now - self._max_age,), "older than the age limit")
+
+        while self._max_bytes and self._size > self._max_bytes and self._count > 1:
+            # drop the oldest tenth of the backlog at a time instead of row by row
+            self._drop("DELETE FROM messages WHERE id IN (SELECT id FROM messages ORDER BY id LIMIT ?)",
+                       (max(1, self._count // 10),), "over the size limit")
+
+    def _drop(self, statement, args, reason):
+        dropped = self._db.execute(statement, args).rowcount
+        if dropped > 0:
+            self._reload_totals()
+            if self._logger is not None:
+                self._logger.warning(f"Dropped {dropped} spooled MQTT messages {reason}")
+
+    def _reload_totals(self):
+        self._count, self._size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) "
+                                                   "FROM messages").fetchone()
+
+
+class SpoolDrainer:
+    """
+    Publishes the spool's backlog on a background thread after a reconnect, paced to
+    ``rate`` messages per second and with at most ``max_inflight`` unacknowledged QoS>0
+    messages at a time. Live publishes go straight to the client meanwhile, so they
+    interleave with the backlog instead of waiting behind it.
+
+    ``publish`` is called as ``publish(topic, payload, qos, retain)`` and must return
+    paho's ``MQTTMessageInfo``.
+    """
+
+    BATCH_SIZE = 50
+
+    def __init__(self, spool, publish, rate=50, max_inflight=20, logger=None):
+        self._spool = spool
+        self._publish = publish
+        self._interval = 1.0 / rate if rate else 0
+        self._max_inflight = max_inflight
+        self._logger = logger
+
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._running = False
+        self._restart = False
+
+    @property
+    def active(self):
+        return self._running
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                # a reconnect right after a disconnect: the stopped thread drains again instead of exiting
+                if self._stopped.is_set():
+                    self._restart = True
+                return
+            if not self._spool:
+                return
+
+            self._stopped.clear()
+            self._running = True
+
+        thread = threading.Thread(target=self._run, name="PrintagoSpoolDrainer")
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._restart = False
+            self._stopped.set()
+
+    def _run(self):
+        while True:
+            self._drain()
+            with self._lock:
+                if not self._restart:
+                    self._running = False
+                    return
+                self._restart = False
+                self._stopped.clear()
+
+    def _drain(self):
+        inflight = []
+        sent = 0
+        next_send = time.monotonic()
+
+        while not self._stopped.is_set():
+            batch = self._spool.peek(self.BATCH_SIZE)
+            if not batch:
+                break
+
+            published = []
+            try:
+                for entry_id, topic, payload, qos, retain in batch:
+                    if self._stopped.is_set():
+                        break
+
+                    delay = next_send - time.monotonic()
+                    if delay > 0 and self._stopped.wait(delay):
+                        break
+                    next_send = max(next_send + self._interval, time.monotonic())
+
+                    inflight = [info for info in inflight if not info.is_published()]
+                    while len(inflight) >= self._max_inflight and not self._stopped.wait(0.05):
+                        inflight = [info for info in inflight if not info.is_published()]
+                    if self._stopped.is_set():
+                        break
+
+                    info = self._publish(topic, payload, qos, retain)
+                    if info.rc != 0:
+                        # not connected anymore, the rest stays spooled for the next connect
+                        self._stopped.set()
+                        break
+
+                    published.append(entry_id)
+                    if qos > 0:
+                        inflight.append(info)
+            finally:
+                self._spool.remove(published)
+                sent += len(published)
+
+        if self._logger is not None and sent:
+            self._logger.info(f"Drained {sent} spooled MQTT messages, {len(self._spool)} left")
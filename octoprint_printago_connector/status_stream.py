@@ -0,0 +1,76 @@
+import copy
+import threading
+import time
+
+STATUS_MODE_FULL = "full"
+STATUS_MODE_DELTA = "delta"
+
+
+def merge_patch_diff(old, new):
+    """
+    Returns a JSON merge patch (RFC 7386) that turns ``old`` into ``new``. Removed keys
+    are set to ``None``; since merge patches can't tell a removed key from a key set to
+    null, receivers treat both the same.
+    """
+    patch = {}
+    for key, value in new.items():
+        if key not in old:
+            patch[key] = value
+            continue
+
+        old_value = old[key]
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            nested = merge_patch_diff(old_value, value)
+            if nested:
+                patch[key] = nested
+        elif value != old_value:
+            patch[key] = value
+
+    for key in old:
+        if key not in new:
+            patch[key] = None
+
+    return patch
+
+
+class StatusStream:
+    """
+    Turns successive printer status snapshots into a numbered stream of messages: a full
+    keyframe every ``keyframe_interval`` seconds and merge-patch deltas against the
+    previously sent state in between. Every message carries a ``seq`` one higher than the
+    previous one, and deltas name the ``base_seq`` they apply to, so a receiver that sees
+    a gap can ask for a resync (``get_status``), which forces a keyframe.
+    """
+
+    def __init__(self, interval=5.0, keyframe_interval=60.0):
+        self._interval = interval
+        self._keyframe_interval = keyframe_interval
+
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._state = None
+        self._last_sent = 0
+        self._last_keyframe = 0
+
+    def due(self):
+        return time.monotonic() - self._last_sent >= self._interval
+
+    def next_message(self, state, force_keyframe=False):
+        now = time.monotonic()
+        with self._lock:
+            keyframe = force_keyframe or self._state is None or now - self._last_keyframe >= self._keyframe_interval
+
+            if keyframe:
+                message = dict(seq=self._seq + 1, keyframe=True, state=state)
+                self._last_keyframe = now
+            else:
+                patch = merge_patch_diff(self._state, state)
+                self._last_sent = now
+                if not patch:
+                    return None
+                message = dict(seq=self._seq + 1, base_seq=self._seq, keyframe=False, patch=patch)
+
+            self._seq += 1
+            self._state = copy.deepcopy(state)
+            self._last_sent = now
+            return message
@@ -0,0 +1,119 @@
+import io
+import threading
+import time
+import uuid
+
+from PIL import Image
+
+SIGNATURE_SIZE = (32, 24)
+
+
+def frame_signature(data):
+    """
+    Tiny grayscale thumbnail of a JPEG frame, used to tell whether the scene changed. The
+    decoder is asked for a heavily reduced image (``draft``), so this costs a fraction of
+    a full decode.
+    """
+    image = Image.open(io.BytesIO(data))
+    image.draft("L", (SIGNATURE_SIZE[0] * 4, SIGNATURE_SIZE[1] * 4))
+    return image.convert("L").resize(SIGNATURE_SIZE).tobytes()
+
+
+def frame_difference(a, b):
+    """Mean absolute pixel difference of two signatures, 0 to 255."""
+    return sum(abs(x - y) for x, y in zip(a, b)) / len(a)
+
+
+class FrameStream:
+    """
+    Captures frames from one camera at ``fps`` on a background thread and hands them to
+    ``publish(data, frame, skipped)``.
+
+    Frames whose signature differs from the last published one by less than
+    ``change_threshold`` are skipped, except that one frame goes out at least every
+    ``heartbeat`` seconds. Before each capture ``backlog()`` is asked how many messages
+    are still waiting to go out: above ``max_backlog`` the frame interval doubles (up to
+    ``max_interval``), and it shrinks back towards the target rate once the backlog has
+    drained. ``backlog()`` returning None means there is no connection, and the frame is
+    skipped without capturing.
+    """
+
+    def __init__(self, capture, publish, backlog, fps=1.0, change_threshold=2.0, heartbeat=30.0, max_backlog=4,
+                 max_interval=30.0, logger=None):
+        self.stream_id = uuid.uuid4().hex
+        self._capture = capture
+        self._publish = publish
+        self._backlog = backlog
+        self._base_interval = 1.0 / fps
+        self._interval = self._base_interval
+        self._max_interval = max(max_interval, self._base_interval)
+        self._change_threshold = change_threshold
+        self._heartbeat = heartbeat
+        self._max_backlog = max_backlog
+        self._logger = logger
+
+        self.frames = 0
+        self.skipped = 0
+        self.throttled = 0
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"PrintagoFrameStream-{self.stream_id[:8]}")
+        self._thread.daemon = True
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @property
+    def running(self):
+        return self._thread.is_alive() and not self._stopped.is_set()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        signature = None
+        last_publish = 0
+        skipped = 0
+        deadline = time.monotonic()
+
+        while not self._stopped.wait(max(0, deadline - time.monotonic())):
+            started = time.monotonic()
+            backlog = self._backlog()
+            deadline = started + self._adapt_interval(backlog)
+
+            if backlog is None or backlog > self._max_backlog:
+                self.throttled += 1
+                continue
+
+            try:
+                data = self._capture()
+                current = frame_signature(data)
+            except Exception as e:
+                if self._logger is not None:
+                    self._logger.warning(f"Frame stream {self.stream_id} failed to capture a frame: {e}")
+                continue
+
+            if signature is not None and started - last_publish < self._heartbeat \
+                    and frame_difference(current, signature) < self._change_threshold:
+                skipped += 1
+                self.skipped += 1
+                continue
+
+            self._publish(data, self.frames, skipped)
+            self.frames += 1
+            signature = current
+            last_publish = started
+            skipped = 0
+
+    def _adapt_interval(self, backlog):
+        if backlog is None:
+            return self._interval
+        if backlog > self._max_backlog:
+            self._interval = min(self._interval * 2, self._max_interval)
+        elif not backlog and self._interval > self._base_interval:
+            self._interval = max(self._interval * 0.75, self._base_interval)
+        return self._interval
@@ -0,0 +1,171 @@
+import threading
+from array import array
+
+TEMPERATURE_MODE_PER_HEATER = "per_heater"
+TEMPERATURE_MODE_FRAME = "frame"
+TEMPERATURE_MODE_AGGREGATE = "aggregate"
+
+
+def temperature_changed(value, last, threshold):
+    # in issue #42 the problem wasn't a failure to get the key, but
+    # the last_temp value was None. Hence "or 0". However by pulling
+    # lastTemp we risk failing on the dict navigation, so we'll be careful.
+    safe_actual_temp = value.get("actual") or 0
+    safe_actual_target_temp = value.get("target") or 0
+    safe_last_temp = 0
+    safe_last_target_temp = 0
+    if last is not None:
+        safe_last_temp = last.get("actual") or 0
+        safe_last_target_temp = last.get("target") or 0
+
+    # some pedantry on the target temp to keep away from float math problems
+    return not safe_last_temp \
+        or abs(safe_actual_temp - safe_last_temp) >= threshold \
+        or abs(safe_actual_target_temp - safe_last_target_temp) >= 0.1
+
+
+class TemperatureAggregator:
+    """
+    Collects min/max/mean/last per heater over a window of ``window`` seconds of sample
+    time. ``add`` returns the finished window as ``(stats, changed)`` once the window is
+    full, where ``changed`` tells whether any sample in it crossed the publish threshold.
+    """
+
+    def __init__(self, window):
+        self._window = window
+        self._start = None
+        self._stats = {}
+        self._changed = False
+
+    def add(self, timestamp, heaters, changed):
+        if self._start is None:
+            self._start = timestamp
+
+        for key, value in heaters.items():
+            actual = value.get("actual") or 0
+            stats = self._stats.get(key)
+            if stats is None:
+                self._stats[key] = [actual, actual, actual, 1, actual, value.get("target")]
+            else:
+                if actual < stats[0]:
+                    stats[0] = actual
+                if actual > stats[1]:
+                    stats[1] = actual
+                stats[2] += actual
+                stats[3] += 1
+                stats[4] = actual
+                stats[5] = value.get("target")
+
+        self._changed = self._changed or changed
+
+        if timestamp - self._start < self._window:
+            return None
+
+        result = dict((key, dict(min=round(mn, 2), max=round(mx, 2), mean=round(total / count, 2), last=round(last, 2),
+                                 target=target, samples=count))
+                      for key, (mn, mx, total, count, last, target) in self._stats.items())
+        result_changed = self._changed
+
+        self._start = None
+        self._stats = {}
+        self._changed = False
+        return result, result_changed
+
+
+class _HeaterRing:
+    __slots__ = ("times", "actuals", "targets", "head", "count")
+
+    def __init__(self, capacity):
+        # preallocated columns: 8 bytes for the timestamp and 4 each for actual and target
+        self.times = array("d", bytes(8 * capacity))
+        self.actuals = array("f", bytes(4 * capacity))
+        self.targets = array("f", bytes(4 * capacity))
+        self.head = 0
+        self.count = 0
+
+    def append(self, timestamp, actual, target):
+        head = self.head
+        self.times[head] = timestamp
+        self.actuals[head] = actual
+        self.targets[head] = target
+
+        capacity = len(self.times)
+        self.head = (head + 1) % capacity
+        if self.count < capacity:
+            self.count += 1
+
+    def ordered_indices(self):
+        capacity = len(self.times)
+        start = (self.head - self.count) % capacity
+        return [(start + offset) % capacity for offset in range(self.count)]
+
+
+class TemperatureHistory:
+    """
+    Fixed-capacity history of temperature samples per heater, stored in preallocated
+    ``array`` columns instead of lists of dicts. Memory use is ``16 * capacity`` bytes per
+    heater, allocated when the heater is first seen and never grown: the default of 7200
+    samples covers four hours at OctoPrint's 2 s reporting interval in about 113 KiB per
+    heater.
+    """
+
+    def __init__(self, capacity=7200):
+        self._capacity = capacity
+        self._rings = {}
+        self._lock = threading.Lock()
+
+    def add(self, timestamp, heaters):
+        with self._lock:
+            for key, value in heaters.items():
+                ring = self._rings.get(key)
+                if ring is None:
+                    ring = self._rings[key] = _HeaterRing(self._capacity)
+                ring.append(timestamp, value.get("actual") or 0, value.get("target") or 0)
+
+    def query(self, points=300, heaters=None, since=None):
+        """
+        Returns ``{heater: {"time": [...], "actual": [...], "target": [...]}}`` with at most
+        ``points`` samples per heater. Longer histories are downsampled into min/max buckets,
+        which keeps spikes visible that plain decimation would drop.
+        """
+        result = {}
+        with self._lock:
+            for key, ring in self._rings.items():
+                if heaters and key not in heaters:
+                    continue
+
+                indices = ring.ordered_indices()
+                if since is not None:
+                    indices = [index for index in indices if ring.times[index] >= since]
+                if len(indices) > points:
+                    indices = self._min_max_buckets(ring.actuals, indices, points)
+
+                result[key] = dict(time=[ring.times[index] for index in indices],
+                                   actual=[round(ring.actuals[index], 2) for index in indices],
+                                   target=[round(ring.targets[index], 2) for index in indices])
+        return result
+
+    @staticmethod
+    def _min_max_buckets(values, indices, points):
+        buckets = max(1, points // 2)
+        size = len(indices) / buckets
+        selected = []
+
+        for bucket in range(buckets):
+            chunk = indices[int(bucket * size):int((bucket + 1) * size)]
+            if not chunk:
+                continue
+            positions = range(len(chunk))
+            low = min(positions, key=lambda position: values[chunk[position]])
+            high = max(positions, key=lambda position: values[chunk[position]])
+            # keep the pair in time order
+            for position in sorted({low, high}):
+                selected.append(chunk[position])
+        return selected
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def memory_usage(self):
+        return len(self._rings) * self._capacity * 16
@@ -0,0 +1,69 @@
+class _Node:
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children = {}
+        self.values = []
+
+
+class TopicTrie:
+    """
+    Maps MQTT topic filters (including ``+`` and ``#`` wildcards) to values. Matching a
+    topic walks the trie level by level, so its cost depends on the depth of the topic and
+    the number of wildcard branches, not on the number of subscriptions.
+
+    ``match`` returns values in insertion order and once per matching filter, same as
+    checking every subscription with ``topic_matches_sub`` in turn.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._count = 0
+
+    def add(self, topic_filter, value):
+        node = self._root
+        for level in topic_filter.split("/"):
+            node = node.children.setdefault(level, _Node())
+        node.values.append((self._count, value))
+        self._count += 1
+
+    def match(self, topic):
+        levels = topic.split("/")
+        matches = []
+        nodes = [self._root]
+
+        for index, level in enumerate(levels):
+            # wildcards at the first level must not match topics starting with $ (MQTT 3.1.1, 4.7.2)
+            wildcards = not (index == 0 and level.startswith("$"))
+            next_nodes = []
+
+            for node in nodes:
+                children = node.children
+                if wildcards:
+                    multi = children.get("#")
+                    if multi is not None:
+                        matches.extend(multi.values)
+                    single = children.get("+")
+                    if single is not None:
+                        next_nodes.append(single)
+                exact = children.get(level)
+                if exact is not None:
+                    next_nodes.append(exact)
+
+            nodes = next_nodes
+            if not nodes:
+                break
+        else:
+            for node in nodes:
+                matches.extend(node.values)
+                # "a/#" also matches "a" itself
+                multi = node.children.get("#")
+                if multi is not None:
+                    matches.extend(multi.values)
+
+        if len(matches) > 1:
+            matches.sort(key=lambda entry: entry[0])
+        return [value for _, value in matches]
+
+    def __len__(self):
+        return self._count
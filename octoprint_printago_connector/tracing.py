@@ -0,0 +1,108 @@
+import threading
+import time
+
+from .metrics import RollingHistogram
+
+STAGES = ("broker", "decode", "queue", "handler", "printer", "total")
+
+
+class CommandTrace:
+    """
+    Monotonic timestamps of one command on its way through the plugin: received by the
+    MQTT network thread, dispatched to its lane after decoding and validation, started by
+    the lane worker and answered. Time spent inside printer API calls is accumulated
+    separately through ``printer_call``.
+
+    ``sent_at`` is the sender's wall clock time in seconds since the epoch, if the command
+    carried one. The broker stage derived from it is only as good as the two clocks.
+    """
+
+    __slots__ = ("received", "received_at", "sent_at", "dispatched", "started", "replied", "printer",
+                 "_printer_start", "_stages")
+
+    def __init__(self, received=None, sent_at=None):
+        now = time.monotonic()
+        self.received = received if received is not None else now
+        self.received_at = time.time() - (now - self.received)
+        self.sent_at = sent_at
+        self.dispatched = self.started = self.replied = None
+        self.printer = 0.0
+        self._printer_start = None
+        self._stages = None
+
+    def mark_dispatched(self):
+        self.dispatched = time.monotonic()
+
+    def mark_started(self):
+        self.started = time.monotonic()
+
+    def mark_replied(self):
+        # only the first reply counts, anything sent later is follow-up data
+        if self.replied is None:
+            self.replied = time.monotonic()
+
+    def printer_call(self):
+        """Context manager around a printer API call: ``with ctx.trace.printer_call(): ...``"""
+        return self
+
+    def __enter__(self):
+        self._printer_start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.printer += time.monotonic() - self._printer_start
+
+    def stages(self):
+        """Stage durations in milliseconds; stages that didn't happen (yet) are left out."""
+        if self._stages is not None:
+            return self._stages
+
+        replied = self.replied
+        end = replied if replied is not None else time.monotonic()
+        stages = dict(total=round((end - self.received) * 1000, 3))
+        if self.sent_at is not None:
+            stages["broker"] = round((self.received_at - self.sent_at) * 1000, 3)
+        if self.dispatched is not None:
+            stages["decode"] = round((self.dispatched - self.received) * 1000, 3)
+            if self.started is not None:
+                stages["queue"] = round((self.started - self.dispatched) * 1000, 3)
+                stages["handler"] = round((end - self.started - self.printer) * 1000, 3)
+                stages["printer"] = round(self.printer * 1000, 3)
+
+        if replied is not None:
+            # final once answered, the reply and the recorder share one computation
+            self._stages = stages
+        return stages
+
+
+class LatencyRecorder:
+    """Rolling per-action, per-stage latency histograms over the last ``window`` seconds."""
+
+    def __init__(self, window=3600):
+        self.window = window
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def record(self, key, trace):
+        stages = trace.stages()
+        now = time.monotonic()
+        with self._lock:
+            histograms = self._histograms.get(key)
+            if histograms is None:
+                histograms = self._histograms[key] = dict((stage, RollingHistogram(self.window))
+                                                          for stage in STAGES)
+            for stage, value in stages.items():
+                # a skewed sender clock can put the broker stage below zero
+                histograms[stage].observe(value if value > 0 else 0.0, now=now)
+
+    def report(self, key=None, buckets=False):
+        """``{"type::action": {stage: histogram}}``, for all actions or just ``key``."""
+        now = time.monotonic()
+        with self._lock:
+            actions = dict((action, dict((stage, histogram.merged(now=now)) for stage, histogram in stages.items()))
+                           for action, stages in self._histograms.items()
+                           if key is None or action == key)
+
+        return dict((action, dict((stage, histogram.to_dict(buckets=buckets))
+                                  for stage, histogram in stages.items() if histogram.count))
+                    for action, stages in actions.items())
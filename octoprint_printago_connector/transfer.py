@@ -0,0 +1,113 @@
+import queue
+import threading
+import time
+import uuid
+
+
+class DownloadError(Exception):
+    """A download failed; the message is what gets reported to Printago."""
+
+
+class TransferJob:
+    def __init__(self, url, sha256=None, job_id=None, request_id=None, on_done=None, rate_limit=None):
+        self.url = url
+        self.sha256 = sha256
+        self.job_id = job_id or uuid.uuid4().hex
+        self.request_id = request_id
+        self.on_done = on_done
+        self.rate_limit = rate_limit
+        self.queued_at = time.time()
+
+
+class TransferWorker:
+    """
+    Runs G-code downloads on a dedicated thread so the MQTT network loop only has to
+    enqueue the job. Progress, completion and failure are reported as ``transfer``
+    messages through the command handler.
+
+    ``on_done(job, filename)`` is called after a job finishes, with ``filename`` None if
+    it failed. ``rate_limit`` is a callable returning the current download limit in bytes
+    per second, or None for no limit.
+    """
+
+    PROGRESS_INTERVAL = 2.0
+
+    def __init__(self, handler, max_queued=8):
+        self._handler = handler
+        self._logger = handler._logger
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._stopped = threading.Event()
+
+        self._thread = threading.Thread(target=self._run, name="PrintagoTransferWorker")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, url, sha256=None, job_id=None, request_id=None, on_done=None, rate_limit=None):
+        job = TransferJob(url, sha256=sha256, job_id=job_id, request_id=request_id, on_done=on_done,
+                          rate_limit=rate_limit)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            return None
+
+        self._send_state(job, "queued", queue_depth=self._queue.qsize())
+        return job
+
+    def stop(self):
+        self._stopped.set()
+        self._queue.put(None)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            job = self._queue.get()
+            if job is None:
+                break
+
+            filename = None
+            try:
+                filename = self._process(job)
+            except Exception as e:
+                self._logger.exception(f"Unexpected error while transferring {job.url}")
+                self._send_state(job, "failed", error=str(e))
+            finally:
+                self._queue.task_done()
+
+            if job.on_done is not None:
+                try:
+                    job.on_done(job, filename)
+                except Exception:
+                    self._logger.exception(f"Error in completion callback for transfer {job.job_id}")
+
+            try:
+                self._handler.on_transfer_finished(job)
+            except Exception:
+                self._logger.exception(f"Error after finishing transfer {job.job_id}")
+
+    def _process(self, job):
+        self._send_state(job, "started")
+        started = time.monotonic()
+        last_report = [started]
+
+        def on_progress(received, total):
+            now = time.monotonic()
+            if now - last_report[0] < self.PROGRESS_INTERVAL:
+                return
+            last_report[0] = now
+
+            progress = round(received * 100.0 / total) if total else None
+            self._send_state(job, "progress", received=received, total=total, progress=progress)
+
+        try:
+            filename = self._handler.download_file(job.url, sha256=job.sha256, progress_callback=on_progress,
+                                                   rate_limit=job.rate_limit, job_id=job.job_id,
+                                                   request_id=job.request_id)
+        except DownloadError as e:
+            self._send_state(job, "failed", error=str(e))
+            return None
+
+        self._send_state(job, "done", file_name=filename, duration=round(time.monotonic() - started, 3))
+        return filename
+
+    def _send_state(self, job, state, **data):
+        data.update(job_id=job.job_id, url=job.url, state=state)
+        self._handler.send_outgoing_message("transfer", data, request_id=job.request_id)
@@ -0,0 +1,80 @@
+import threading
+
+import octoprint.plugin
+
+
+class WebcamInventory:
+    """
+    Cached view of the installed ``WebcamProviderPlugin`` implementations and their
+    cameras. It is built on first use and rebuilt after ``invalidate``, which the plugin
+    calls whenever settings are saved or plugins are installed, enabled or disabled.
+    """
+
+    def __init__(self, plugin_manager, logger):
+        self._plugin_manager = plugin_manager
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._providers = None
+        self._implementations = None
+        self._cameras = None
+
+    def invalidate(self):
+        with self._lock:
+            self._providers = None
+            self._implementations = None
+            self._cameras = None
+
+    def providers(self):
+        """Returns ``{provider_id: {"provider_info": ..., "webcams": [...]}}``."""
+        return self._load()[0]
+
+    def provider(self, provider_id):
+        return self._load()[1].get(provider_id)
+
+    def cameras(self):
+        """Returns ``(provider_id, camera_name)`` for every camera that can take snapshots."""
+        return self._load()[2]
+
+    def _load(self):
+        with self._lock:
+            if self._providers is None:
+                self._build()
+            return self._providers, self._implementations, self._cameras
+
+    def _build(self):
+        providers = {}
+        implementations = {}
+        cameras = []
+
+        for camPlugin in self._plugin_manager.get_implementations(octoprint.plugin.WebcamProviderPlugin):
+            provider_entry = {
+                "provider_info": {
+                    "id": camPlugin._identifier,
+                    "name": camPlugin._plugin_name
+                },
+                "webcams": []
+            }
+
+            if hasattr(camPlugin, 'get_webcam_configurations'):
+                for webcam in camPlugin.get_webcam_configurations():
+                    compat = getattr(webcam, 'compat', {})
+                    provider_entry["webcams"].append({
+                        "name": webcam.name,
+                        "can_snapshot": webcam.canSnapshot,
+                        "flipH": webcam.flipH,
+                        "flipV": webcam.flipV,
+                        "rotate90": webcam.rotate90,
+                        "deprecated_snapshot_url": getattr(compat, 'snapshot', ''),
+                        "deprecated_stream_url": getattr(compat, 'stream', ''),
+                    })
+                    if webcam.canSnapshot:
+                        cameras.append((camPlugin._identifier, webcam.name))
+            else:
+                self._logger.warning(f"Provider {camPlugin._identifier} does not have 'get_webcam_configurations' method.")
+
+            providers[camPlugin._identifier] = provider_entry
+            implementations[camPlugin._identifier] = camPlugin
+
+        self._providers = providers
+        self._implementations = implementations
+        self._cameras = tuple(cameras)
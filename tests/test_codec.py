@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from octoprint_printago_connector.codec import (ENVELOPE_MAGIC, FLAG_ZLIB, FORMAT_CBOR, FORMAT_JSON, FORMAT_MSGPACK,
+                                                CodecError, PayloadCodec)
+
+STATUS = {
+    "state": {"text": "Printing", "flags": {"operational": True, "printing": True, "paused": False}},
+    "job": {"file": {"name": "bracket_x4.gcode", "path": "Printago/bracket_x4.gcode"}, "estimatedPrintTime": 14523.4},
+    "progress": {"completion": 42.1734, "filepos": 7706722, "printTimeLeft": None},
+    "temperatures": [{"tool0": 214.8}, {"bed": 60.1}],
+    "message": "Überhitzung — ok",
+}
+
+FORMATS = (FORMAT_JSON, FORMAT_MSGPACK, FORMAT_CBOR)
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+@pytest.mark.parametrize("compress_threshold", (0, 64))
+def test_round_trip(fmt, compress_threshold):
+    codec = PayloadCodec(fmt, compress_threshold=compress_threshold)
+    assert codec.format == fmt
+    assert codec.decode(codec.encode(STATUS)) == STATUS
+
+
+def test_uncompressed_json_is_plain_json():
+    payload = PayloadCodec(FORMAT_JSON).encode(STATUS)
+    assert payload[0] != ENVELOPE_MAGIC
+    assert json.loads(payload) == STATUS
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_compresses_above_threshold_only(fmt):
+    codec = PayloadCodec(fmt, compress_threshold=64)
+
+    large = codec.encode(dict(lines=["G1 X10 Y10 E0.5"] * 100))
+    assert large[0] == ENVELOPE_MAGIC and large[1] & FLAG_ZLIB
+
+    small = codec.encode(dict(ok=True))
+    assert not (small[0] == ENVELOPE_MAGIC and small[1] & FLAG_ZLIB)
+
+
+@pytest.mark.parametrize("sender", FORMATS)
+@pytest.mark.parametrize("receiver", FORMATS)
+def test_decodes_any_format(sender, receiver):
+    payload = PayloadCodec(sender, compress_threshold=64).encode(STATUS)
+    assert PayloadCodec(receiver).decode(payload) == STATUS
+
+
+def test_decodes_text_payloads():
+    assert PayloadCodec(FORMAT_MSGPACK).decode('{"type": "printer_control"}') == {"type": "printer_control"}
+
+
+def test_unknown_format_flags():
+    with pytest.raises(CodecError):
+        PayloadCodec().decode(bytes((ENVELOPE_MAGIC, 0x07)) + b"{}")
+
+
+def test_truncated_envelope():
+    with pytest.raises(CodecError):
+        PayloadCodec().decode(bytes((ENVELOPE_MAGIC,)))
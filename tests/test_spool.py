@@ -0,0 +1,186 @@
+import logging
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from octoprint_printago_connector import spool as spool_module
+from octoprint_printago_connector.spool import PublishSpool, SpoolDrainer
+
+
+def topics(spool):
+    return [topic for _, topic, _, _, _ in spool.peek(1000)]
+
+
+def test_keeps_messages_in_order(tmp_path):
+    spool = PublishSpool(str(tmp_path / "spool.db"))
+    for index in range(3):
+        spool.append(f"octoPrint/event/E{index}", f'{{"index": {index}}}', qos=1)
+
+    assert topics(spool) == ["octoPrint/event/E0", "octoPrint/event/E1", "octoPrint/event/E2"]
+    assert len(spool) == 3
+    assert spool.peek(1)[0][2:] == (b'{"index": 0}', 1, False)
+
+
+def test_coalesce_replaces_older_message_on_same_topic(tmp_path):
+    spool = PublishSpool(str(tmp_path / "spool.db"))
+    spool.append("octoPrint/temperature/bed", b"60.0", retain=True, coalesce=True)
+    spool.append("octoPrint/event/PrintStarted", b"{}")
+    spool.append("octoPrint/temperature/bed", b"60.25", retain=True, coalesce=True)
+
+    assert topics(spool) == ["octoPrint/event/PrintStarted", "octoPrint/temperature/bed"]
+    assert spool.peek(10)[1][2] == b"60.25"
+    assert spool.size == len(b"{}") + len(b"60.25")
+
+
+def test_without_coalesce_repeated_topics_are_all_kept(tmp_path):
+    spool = PublishSpool(str(tmp_path / "spool.db"))
+    spool.append("octoPrint/event/Upload", b"a")
+    spool.append("octoPrint/event/Upload", b"b")
+
+    assert [payload for _, _, payload, _, _ in spool.peek(10)] == [b"a", b"b"]
+
+
+def test_discard_coalesced(tmp_path):
+    spool = PublishSpool(str(tmp_path / "spool.db"))
+    spool.append("octoPrint/progress/printing", b"47", coalesce=True)
+    spool.append("octoPrint/event/PrintStarted", b"{}")
+
+    spool.discard_coalesced("octoPrint/progress/printing")
+    spool.discard_coalesced("octoPrint/event/PrintStarted")
+
+    assert topics(spool) == ["octoPrint/event/PrintStarted"]
+    assert len(spool) == 1
+
+
+def test_byte_limit_drops_oldest_first(tmp_path):
+    spool = PublishSpool(str(tmp_path / "spool.db"), max_bytes=1000, logger=logging.getLogger(__name__))
+    for index in range(30):
+        spool.append(f"octoPrint/event/E{index}", b"x" * 100)
+
+    assert spool.size <= 1000
+    remaining = topics(spool)
+    assert remaining[-1] == "octoPrint/event/E29"
+    assert remaining == [f"octoPrint/event/E{index}" for index in range(30 - len(remaining), 30)]
+
+
+def test_byte_limit_keeps_a_single_oversized_message(tmp_path):
+    spool = PublishSpool(str(tmp_path / "spool.db"), max_bytes=10)
+    spool.append("octoPrint/event/Big", b"x" * 100)
+
+    assert len(spool) == 1
+
+
+def test_age_limit_drops_expired_messages(tmp_path, monkeypatch):
+    now = [1000000.0]
+    monkeypatch.setattr(spool_module.time, "time", lambda: now[0])
+    spool = PublishSpool(str(tmp_path / "spool.db"), max_age=60)
+
+    spool.append("octoPrint/event/Old", b"{}")
+    now[0] += 30
+    spool.append("octoPrint/event/Recent", b"{}")
+    now[0] += 45
+    spool.append("octoPrint/event/New", b"{}")
+
+    assert topics(spool) == ["octoPrint/event/Recent", "octoPrint/event/New"]
+
+
+def test_remove(tmp_path):
+    spool = PublishSpool(str(tmp_path / "spool.db"))
+    for index in range(5):
+        spool.append(f"octoPrint/event/E{index}", b"ab")
+
+    spool.remove([entry_id for entry_id, _, _, _, _ in spool.peek(3)])
+
+    assert topics(spool) == ["octoPrint/event/E3", "octoPrint/event/E4"]
+    assert len(spool) == 2
+    assert spool.size == 4
+
+
+def test_persists_across_reopen(tmp_path):
+    path = str(tmp_path / "spool.db")
+    spool = PublishSpool(path)
+    spool.append("octoPrint/temperature/tool0", b"215.0", qos=1, retain=True, coalesce=True)
+    spool.append("octoPrint/event/PrintDone", b'{"time": 12}', qos=1)
+    spool.close()
+
+    reopened = PublishSpool(path)
+    assert len(reopened) == 2
+    assert reopened.size == len(b"215.0") + len(b'{"time": 12}')
+    assert [entry[1:] for entry in reopened.peek(10)] == [
+        ("octoPrint/temperature/tool0", b"215.0", 1, True),
+        ("octoPrint/event/PrintDone", b'{"time": 12}', 1, False),
+    ]
+
+    # coalescing still applies to what was spooled before the restart
+    reopened.append("octoPrint/temperature/tool0", b"214.5", coalesce=True)
+    assert topics(reopened) == ["octoPrint/event/PrintDone", "octoPrint/temperature/tool0"]
+
+
+class MessageInfo:
+    rc = 0
+
+    def is_published(self):
+        return True
+
+
+def test_drainer_publishes_backlog_in_order(tmp_path):
+    spool = PublishSpool(str(tmp_path / "spool.db"))
+    for index in range(5):
+        spool.append(f"octoPrint/event/E{index}", b"{}")
+    published = []
+    drained = threading.Event()
+
+    def publish(topic, payload, qos, retain):
+        published.append(topic)
+        if len(published) == 5:
+            drained.set()
+        return MessageInfo()
+
+    SpoolDrainer(spool, publish, rate=0).start()
+
+    assert drained.wait(5)
+    assert published == [f"octoPrint/event/E{index}" for index in range(5)]
+
+
+def test_drainer_restarts_when_started_again_before_stopping(tmp_path):
+    spool = PublishSpool(str(tmp_path / "spool.db"))
+    for index in range(3):
+        spool.append(f"octoPrint/event/E{index}", b"{}")
+    first_publish, release = threading.Event(), threading.Event()
+    published = []
+
+    def publish(topic, payload, qos, retain):
+        published.append(topic)
+        first_publish.set()
+        release.wait(5)
+        return MessageInfo()
+
+    drainer = SpoolDrainer(spool, publish, rate=0)
+    drainer.start()
+    assert first_publish.wait(5)
+
+    # disconnect and reconnect while the old thread is still busy
+    drainer.stop()
+    drainer.start()
+    release.set()
+
+    deadline = time.monotonic() + 5
+    while (len(spool) or drainer.active) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(spool) == 0
+    assert published == ["octoPrint/event/E0", "octoPrint/event/E1", "octoPrint/event/E2"]
+
+
+def test_failed_remove_rolls_back(tmp_path):
+    spool = PublishSpool(str(tmp_path / "spool.db"))
+    spool.append("octoPrint/event/E0", b"{}")
+
+    with pytest.raises(sqlite3.Error):
+        spool.remove([object()])
+
+    # the connection isn't left inside a transaction
+    spool.append("octoPrint/event/E1", b"{}")
+    spool.remove([entry_id for entry_id, _, _, _, _ in spool.peek(1)])
+    assert topics(spool) == ["octoPrint/event/E1"]
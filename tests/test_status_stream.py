@@ -0,0 +1,65 @@
+import copy
+
+import pytest
+
+from octoprint_printago_connector.status_stream import merge_patch_diff
+
+
+def apply_merge_patch(target, patch):
+    # RFC 7386, section 2
+    if not isinstance(patch, dict):
+        return patch
+    result = copy.deepcopy(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+    return result
+
+
+OLD = {
+    "state": {"text": "Printing", "flags": {"printing": True, "paused": False}},
+    "progress": {"completion": 42.1, "printTimeLeft": 8402},
+    "temperatures": {"tool0": {"actual": 214.8, "target": 215.0}},
+    "offsets": [0, 0],
+}
+
+
+def test_identical_documents_give_an_empty_patch():
+    assert merge_patch_diff(OLD, copy.deepcopy(OLD)) == {}
+
+
+def test_only_changed_leaves_are_included():
+    new = copy.deepcopy(OLD)
+    new["progress"]["completion"] = 42.6
+    new["state"]["flags"]["paused"] = True
+
+    assert merge_patch_diff(OLD, new) == {"progress": {"completion": 42.6}, "state": {"flags": {"paused": True}}}
+
+
+def test_added_and_removed_keys():
+    new = copy.deepcopy(OLD)
+    del new["progress"]["printTimeLeft"]
+    new["temperatures"]["bed"] = {"actual": 60.1, "target": 60.0}
+
+    assert merge_patch_diff(OLD, new) == {"progress": {"printTimeLeft": None},
+                                          "temperatures": {"bed": {"actual": 60.1, "target": 60.0}}}
+
+
+def test_lists_and_type_changes_are_replaced_whole():
+    new = copy.deepcopy(OLD)
+    new["offsets"] = [0, 1]
+    new["state"] = "Operational"
+
+    assert merge_patch_diff(OLD, new) == {"offsets": [0, 1], "state": "Operational"}
+
+
+@pytest.mark.parametrize("new", [
+    {},
+    {"state": {"text": "Operational", "flags": {"printing": False}}},
+    dict(OLD, progress={"completion": 100.0, "printTimeLeft": 0}, job={"file": {"name": "part.gcode"}}),
+    dict(OLD, temperatures={}),
+])
+def test_applying_the_patch_gives_the_new_document(new):
+    assert apply_merge_patch(OLD, merge_patch_diff(OLD, new)) == new
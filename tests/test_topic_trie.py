@@ -0,0 +1,56 @@
+import pytest
+
+from octoprint_printago_connector.topic_trie import TopicTrie
+
+
+def trie_of(*topic_filters):
+    trie = TopicTrie()
+    for topic_filter in topic_filters:
+        trie.add(topic_filter, topic_filter)
+    return trie
+
+
+@pytest.mark.parametrize("topic_filter, topic, matches", [
+    ("octoPrint/commands", "octoPrint/commands", True),
+    ("octoPrint/commands", "octoPrint/commands/extra", False),
+    ("octoPrint/+", "octoPrint/commands", True),
+    ("octoPrint/+", "octoPrint", False),
+    ("octoPrint/+", "octoPrint/a/b", False),
+    ("+/+", "/finance", True),
+    ("+", "/finance", False),
+    ("octoPrint/+/set", "octoPrint/bed/set", True),
+    ("octoPrint/+/set", "octoPrint/bed/get", False),
+    ("octoPrint/#", "octoPrint", True),
+    ("octoPrint/#", "octoPrint/a/b/c", True),
+    ("octoPrint/#", "other/a", False),
+    ("#", "octoPrint/a", True),
+    ("+/#", "octoPrint", True),
+])
+def test_wildcards(topic_filter, topic, matches):
+    assert (trie_of(topic_filter).match(topic) == [topic_filter]) is matches
+
+
+@pytest.mark.parametrize("topic_filter, topic, matches", [
+    ("#", "$SYS/broker/uptime", False),
+    ("+/broker/uptime", "$SYS/broker/uptime", False),
+    ("+/#", "$SYS", False),
+    ("$SYS/#", "$SYS/broker/uptime", True),
+    ("$SYS/+/uptime", "$SYS/broker/uptime", True),
+    ("octoPrint/+", "octoPrint/$state", True),
+])
+def test_wildcards_skip_dollar_topics_only_at_first_level(topic_filter, topic, matches):
+    assert (trie_of(topic_filter).match(topic) == [topic_filter]) is matches
+
+
+def test_matches_in_insertion_order_once_per_filter():
+    trie = trie_of("octoPrint/#", "octoPrint/commands", "+/commands", "#")
+    trie.add("octoPrint/commands", "duplicate")
+
+    assert trie.match("octoPrint/commands") == ["octoPrint/#", "octoPrint/commands", "+/commands", "#",
+                                                "duplicate"]
+    assert len(trie) == 5
+
+
+def test_no_match():
+    assert trie_of("octoPrint/commands").match("printago/commands") == []
+    assert TopicTrie().match("octoPrint/commands") == []